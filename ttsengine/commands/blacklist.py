@@ -12,6 +12,7 @@ class BlacklistCommands(TTSBase):
         if user.id not in blacklist:
             blacklist.append(user.id)
             await self.config.guild(interaction.guild).blacklisted_users.set(blacklist)
+            self.membership_index.set_blacklist(interaction.guild.id, blacklist)
             await interaction.response.send_message(f"Added user {user.mention} to blacklist!",
                                                     allowed_mentions=discord.AllowedMentions(users=False))
         else:
@@ -35,6 +36,7 @@ class BlacklistCommands(TTSBase):
         if user.id in blacklist:
             blacklist.remove(user.id)
             await self.config.guild(interaction.guild).blacklisted_users.set(blacklist)
+            self.membership_index.set_blacklist(interaction.guild.id, blacklist)
             await interaction.response.send_message(f"Removed {user.mention} from blacklist!",
                                                     allowed_mentions=discord.AllowedMentions(users=False))
         else:
@@ -60,6 +62,7 @@ class BlacklistCommands(TTSBase):
         if stale_ids:
             cleaned = [uid for uid in blacklist if uid not in stale_ids]
             await self.config.guild(interaction.guild).blacklisted_users.set(cleaned)
+            self.membership_index.set_blacklist(interaction.guild.id, cleaned)
 
         if user_list == "":
             user_list = "None"
@@ -1,5 +1,6 @@
 import json
 import io
+from typing import Literal
 
 import discord
 import logging
@@ -7,8 +8,7 @@ import logging
 from redbot.core import app_commands
 
 from ttsengine.core.base import TTSBase
-from ttsengine.core import text_filter
-from ttsengine.core.settings import TTSGuildSettings
+from ttsengine.core import audio_staging, offline_tts, text_filter
 
 log = logging.getLogger("red.mednis-cogs.poitranslator.settings_commands")
 
@@ -24,7 +24,7 @@ class SettingsCommands(TTSBase):
             return
 
         log.info(f"Setting TTS voice for {user} to {voice}")
-        await self.config.user(user).voice.set(voice)
+        await self.user_profiles.update(user, voice=voice)
         await interaction.response.send_message(f"Set TTS voice for {user.mention} to `{voice}`.", ephemeral=True)
 
     @tts_settings.command(name="max_message_length", description="The maximum length of a TTS message.")
@@ -32,6 +32,7 @@ class SettingsCommands(TTSBase):
     @app_commands.checks.has_permissions(manage_guild=True)
     async def tts_max_message_length(self, interaction: discord.Interaction, length: int):
         await self.config.guild(interaction.guild).max_message_length.set(length)
+        self.guild_settings_cache.invalidate(interaction.guild.id)
         await interaction.response.send_message(f"Set the maximum message length to {length} characters.")
 
     @tts_settings.command(name="repeated_word_percentage",
@@ -40,6 +41,7 @@ class SettingsCommands(TTSBase):
     @app_commands.checks.has_permissions(manage_guild=True)
     async def tts_repeated_word_percentage(self, interaction: discord.Interaction, percentage: int):
         await self.config.guild(interaction.guild).repeated_word_percentage.set(percentage)
+        self.guild_settings_cache.invalidate(interaction.guild.id)
         await interaction.response.send_message(f"Set the repeated word percentage to {percentage}%.")
 
     @tts_settings.command(name="max_word_length", description="The maximum length of a word for it to be filtered.")
@@ -47,13 +49,72 @@ class SettingsCommands(TTSBase):
     @app_commands.checks.has_permissions(manage_guild=True)
     async def tts_max_word_length(self, interaction: discord.Interaction, length: int):
         await self.config.guild(interaction.guild).max_word_length.set(length)
+        self.guild_settings_cache.invalidate(interaction.guild.id)
         await interaction.response.send_message(f"Set the maximum word length to {length} characters.")
 
+    @tts_settings.command(name="max_queued_messages",
+                          description="How many messages can wait to be read out before the oldest are dropped.")
+    @app_commands.guild_only()
+    @app_commands.checks.has_permissions(manage_guild=True)
+    async def tts_max_queued_messages(self, interaction: discord.Interaction,
+                                      messages: app_commands.Range[int, 1, 100]):
+        await self.config.guild(interaction.guild).max_queued_messages.set(messages)
+        self.guild_settings_cache.invalidate(interaction.guild.id)
+        await interaction.response.send_message(f"Set the maximum queued messages to {messages}.")
+
+    @tts_settings.command(name="max_user_messages",
+                          description="How many messages one user can have waiting to be read out.")
+    @app_commands.guild_only()
+    @app_commands.checks.has_permissions(manage_guild=True)
+    async def tts_max_user_messages(self, interaction: discord.Interaction,
+                                    messages: app_commands.Range[int, 1, 100]):
+        await self.config.guild(interaction.guild).max_user_messages.set(messages)
+        self.guild_settings_cache.invalidate(interaction.guild.id)
+        await interaction.response.send_message(f"Set the maximum queued messages per user to {messages}.")
+
+    @tts_settings.command(name="max_message_age",
+                          description="Drop messages that have waited this many seconds to be read out. 0 disables it.")
+    @app_commands.guild_only()
+    @app_commands.checks.has_permissions(manage_guild=True)
+    async def tts_max_message_age(self, interaction: discord.Interaction,
+                                  seconds: app_commands.Range[int, 0, 600]):
+        await self.config.guild(interaction.guild).max_message_age.set(seconds)
+        self.guild_settings_cache.invalidate(interaction.guild.id)
+        if seconds > 0:
+            await interaction.response.send_message(f"Messages that have waited over {seconds} seconds will "
+                                                    f"not be read out.")
+        else:
+            await interaction.response.send_message("Messages will wait as long as it takes to be read out.")
+
+    @tts_settings.command(name="coalesce_window",
+                          description="Read quick successive messages from one user together. 0 disables it.")
+    @app_commands.guild_only()
+    @app_commands.checks.has_permissions(manage_guild=True)
+    async def tts_coalesce_window(self, interaction: discord.Interaction,
+                                  seconds: app_commands.Range[float, 0, 10]):
+        await self.config.guild(interaction.guild).coalesce_window.set(seconds)
+        self.guild_settings_cache.invalidate(interaction.guild.id)
+        if seconds > 0:
+            await interaction.response.send_message(f"Messages sent within {seconds} seconds of each other by the "
+                                                    f"same user will be read out together.")
+        else:
+            await interaction.response.send_message("Disabled message coalescing.")
+
+    @tts_settings.command(name="filter_engine",
+                          description="Which implementation of the message filters to use.")
+    @app_commands.guild_only()
+    @app_commands.checks.has_permissions(manage_guild=True)
+    async def tts_filter_engine(self, interaction: discord.Interaction, engine: Literal["classic", "tokenized"]):
+        await self.config.guild(interaction.guild).filter_engine.set(engine)
+        self.guild_settings_cache.invalidate(interaction.guild.id)
+        await interaction.response.send_message(f"Set the filter engine to `{engine}`.")
+
     @tts_settings.command(name="say_name", description="Whether to say the name of the user who sent the message.")
     @app_commands.guild_only()
     @app_commands.checks.has_permissions(manage_guild=True)
     async def tts_say_name(self, interaction: discord.Interaction, say_name: bool):
         await self.config.guild(interaction.guild).say_name.set(say_name)
+        self.guild_settings_cache.invalidate(interaction.guild.id)
         await interaction.response.send_message(f"Set say name to {say_name}.")
 
     @tts_settings.command(name="add_word_substitution", description="Add a word substitution")
@@ -64,6 +125,7 @@ class SettingsCommands(TTSBase):
         if source not in words.keys():
             words[source] = substitution
             await self.config.guild(interaction.guild).word_replacements.set(words)
+            self.guild_settings_cache.invalidate(interaction.guild.id)
             await interaction.response.send_message(f"Added word substitution `{source}`:`{substitution}` to word "
                                                     f"replacements.")
         else:
@@ -77,6 +139,7 @@ class SettingsCommands(TTSBase):
         if source in words.keys():
             words.pop(source)
             await self.config.guild(interaction.guild).word_replacements.set(words)
+            self.guild_settings_cache.invalidate(interaction.guild.id)
             await interaction.response.send_message(f"Removed word substitution for word `{source}`")
         else:
             await interaction.response.send_message(f"`{source}` does not have a word substitution!")
@@ -89,6 +152,7 @@ class SettingsCommands(TTSBase):
         if source not in words.keys():
             words[source] = substitution
             await self.config.guild(interaction.guild).name_replacements.set(words)
+            self.guild_settings_cache.invalidate(interaction.guild.id)
             await interaction.response.send_message(f"Added name substitution `{source}`:`{substitution}` to name "
                                                     f"replacements.")
         else:
@@ -102,6 +166,7 @@ class SettingsCommands(TTSBase):
         if source in words.keys():
             words.pop(source)
             await self.config.guild(interaction.guild).name_replacements.set(words)
+            self.guild_settings_cache.invalidate(interaction.guild.id)
             await interaction.response.send_message(f"Removed name substitution for name `{source}`")
         else:
             await interaction.response.send_message(f"`{source}` does not have a name substitution!")
@@ -124,7 +189,22 @@ class SettingsCommands(TTSBase):
                 "local_api": await self.config.local_api(),
                 "local_voices": await self.config.local_voices(),
                 "local_api_url": await self.config.local_api_url(),
-                "public_api_url": await self.config.public_api_url()
+                "public_api_url": await self.config.public_api_url(),
+                "audio_cache_size": await self.config.audio_cache_size(),
+                "synthesis_workers": await self.config.synthesis_workers(),
+                "hedge_requests": await self.config.hedge_requests(),
+                "hedge_percentile": await self.config.hedge_percentile(),
+                "audio_staging": await self.config.audio_staging(),
+                "staging_host": await self.config.staging_host(),
+                "staging_port": await self.config.staging_port(),
+                "staging_memory_size": await self.config.staging_memory_size(),
+                "offline_tts": await self.config.offline_tts(),
+                "offline_engine": await self.config.offline_engine(),
+                "offline_voices": await self.config.offline_voices(),
+                "offline_workers": await self.config.offline_workers(),
+                "post_processing": await self.config.post_processing(),
+                "ffmpeg_path": await self.config.ffmpeg_path(),
+                "loudness_target": await self.config.loudness_target()
             }
             json_bytes = io.BytesIO(json.dumps(json_response, indent=4).encode('utf-8'))
             tts_file = discord.File(json_bytes, filename="tts_settings.json")
@@ -151,6 +231,25 @@ class SettingsCommands(TTSBase):
                         "public_api_url": str
                     }
 
+                    # Keys that older settings files might not have yet
+                    optional_keys = {
+                        "audio_cache_size": int,
+                        "synthesis_workers": int,
+                        "hedge_requests": bool,
+                        "hedge_percentile": int,
+                        "audio_staging": str,
+                        "staging_host": str,
+                        "staging_port": int,
+                        "staging_memory_size": int,
+                        "offline_tts": bool,
+                        "offline_engine": str,
+                        "offline_voices": dict,
+                        "offline_workers": int,
+                        "post_processing": bool,
+                        "ffmpeg_path": str,
+                        "loudness_target": int
+                    }
+
                     # Read the file
                     file_object = await file.read()
                     settings = json.loads(file_object)
@@ -177,6 +276,20 @@ class SettingsCommands(TTSBase):
                                     )
                                     return
 
+                    if settings.get("audio_staging", "disk") not in audio_staging.STAGING_MODES:
+                        await interaction.followup.send(
+                            f"Invalid value for key 'audio_staging'. Expected one of "
+                            f"{', '.join(audio_staging.STAGING_MODES)}.", ephemeral=True
+                        )
+                        return
+
+                    if settings.get("offline_engine", "espeak-ng") not in offline_tts.ENGINES:
+                        await interaction.followup.send(
+                            f"Invalid value for key 'offline_engine'. Expected one of "
+                            f"{', '.join(offline_tts.ENGINES)}.", ephemeral=True
+                        )
+                        return
+
                     await self.config.regular_voices.set(settings["regular_voices"])
                     await self.config.extra_voices.set(settings["extra_voices"])
                     await self.config.statistics.set(settings["statistics"])
@@ -185,7 +298,26 @@ class SettingsCommands(TTSBase):
                     await self.config.local_api_url.set(settings["local_api_url"])
                     await self.config.public_api_url.set(settings["public_api_url"])
 
-                    await interaction.followup.send("Settings file uploaded and saved!", ephemeral=True)
+                    for key, expected_type in optional_keys.items():
+                        if key not in settings:
+                            continue
+                        if not isinstance(settings[key], expected_type):
+                            await interaction.followup.send(
+                                f"Invalid type for key '{key}'. Expected {expected_type.__name__}.",
+                                ephemeral=True
+                            )
+                            return
+                        await self.config.set_raw(key, value=settings[key])
+
+                    self.audio_cache.max_bytes = await self.config.audio_cache_size() * 1024 * 1024
+                    await self.audio_cache.evict()
+
+                    # The staging mode, offline engine and post-processing are set up when the cog loads,
+                    # clips already queued keep playing from where they are
+                    await interaction.followup.send("Settings file uploaded and saved!\n"
+                                                    "Audio staging, offline TTS and post-processing changes apply "
+                                                    "once the cog is reloaded.",
+                                                    ephemeral=True)
 
                 except json.JSONDecodeError:
                     await interaction.followup.send("Invalid JSON file.", ephemeral=True)
@@ -217,8 +349,8 @@ class SettingsCommands(TTSBase):
         await self._debug_tts_message(interaction, message)
 
     async def _debug_tts_message(self, interaction: discord.Interaction, message: discord.Message):
-        tts_guild_settings = await TTSGuildSettings.from_config(self.config, message.guild)
-        processed = await text_filter.filter_and_format_message(message, tts_guild_settings)
+        tts_guild_settings = await self.guild_settings_cache.get(message.guild)
+        processed = await text_filter.filter_and_format_message(message, tts_guild_settings, self.mention_cache)
 
         if processed is None:
             result = "(None - Message was filtered out and would not be sent to TTS)"
@@ -272,6 +404,21 @@ class SettingsCommands(TTSBase):
                 case "global_tts_volume":
                     general_settings += f"Global TTS Volume: `{value}%`\n"
 
+                case "max_queued_messages":
+                    general_settings += f"Maximum Queued Messages: `{value}`\n"
+
+                case "max_user_messages":
+                    general_settings += f"Maximum Queued Messages Per User: `{value}`\n"
+
+                case "max_message_age":
+                    general_settings += f"Maximum Message Wait: `{value}` seconds\n"
+
+                case "coalesce_window":
+                    general_settings += f"Message Coalescing Window: `{value}` seconds\n"
+
+                case "filter_engine":
+                    general_settings += f"Filter Engine: `{value}`\n"
+
                 case "whitelisted_channels":
                     channels = ""
                     stale_ids = []
@@ -284,6 +431,7 @@ class SettingsCommands(TTSBase):
                     if stale_ids:
                         cleaned = [cid for cid in value if cid not in stale_ids]
                         await self.config.guild(interaction.guild).whitelisted_channels.set(cleaned)
+                        self.membership_index.set_whitelist(interaction.guild.id, cleaned)
                     embed.add_field(name="Whitelisted Channels", value=channels or "`None`")
 
                 case "blacklisted_users":
@@ -298,6 +446,7 @@ class SettingsCommands(TTSBase):
                     if stale_ids:
                         cleaned = [uid for uid in value if uid not in stale_ids]
                         await self.config.guild(interaction.guild).blacklisted_users.set(cleaned)
+                        self.membership_index.set_blacklist(interaction.guild.id, cleaned)
                     embed.add_field(name="Blacklisted Users", value=users or "`None`")
 
                 case "name_replacements":
@@ -328,6 +477,11 @@ class SettingsCommands(TTSBase):
 
         embed.insert_field_at(index=0, name="General Settings", value=general_settings, inline=False)
 
+        cache = self.guild_settings_cache
+        embed.add_field(name="Settings Cache",
+                        value=f"Hits: `{cache.hits}` Misses: `{cache.misses}` Hit Ratio: `{cache.hit_ratio:.1%}`",
+                        inline=False)
+
         message = await interaction.response.send_message(embed=embed,
                                                           allowed_mentions=discord.AllowedMentions(users=False))
 
@@ -339,6 +493,7 @@ class SettingsCommands(TTSBase):
         if prefix not in prefixes:
             prefixes.append(prefix)
             await self.config.guild(interaction.guild).command_prefixes.set(prefixes)
+            self.guild_settings_cache.invalidate(interaction.guild.id)
             await interaction.response.send_message(f"Added command prefix `{prefix}`")
         else:
             await interaction.response.send_message(f"Command prefix `{prefix}` already exists!")
@@ -351,6 +506,7 @@ class SettingsCommands(TTSBase):
         if prefix in prefixes:
             prefixes.remove(prefix)
             await self.config.guild(interaction.guild).command_prefixes.set(prefixes)
+            self.guild_settings_cache.invalidate(interaction.guild.id)
             await interaction.response.send_message(f"Removed command prefix `{prefix}`")
         else:
             await interaction.response.send_message(f"Command prefix `{prefix}` does not exist!")
@@ -370,6 +526,7 @@ class SettingsCommands(TTSBase):
         whitelist.append(channel.id)
 
         await self.config.guild(interaction.guild).whitelisted_channels.set(whitelist)
+        self.membership_index.set_whitelist(interaction.guild.id, whitelist)
         await interaction.response.send_message(f"Added channel {channel.mention} to TTS whitelist!")
 
     @tts_channels.command(name="add_vc", description="Add whitelisted voice channel for TTS text")
@@ -384,6 +541,7 @@ class SettingsCommands(TTSBase):
 
         whitelist.append(channel.id)
         await self.config.guild(interaction.guild).whitelisted_channels.set(whitelist)
+        self.membership_index.set_whitelist(interaction.guild.id, whitelist)
         await interaction.response.send_message(f"Added channel {channel.mention} to TTS whitelist!")
 
     @tts_channels.command(name="remove_vc", description="Remove whitelisted voice channel for TTS text")
@@ -398,6 +556,7 @@ class SettingsCommands(TTSBase):
 
         whitelist.remove(channel.id)
         await self.config.guild(interaction.guild).whitelisted_channels.set(whitelist)
+        self.membership_index.set_whitelist(interaction.guild.id, whitelist)
         await interaction.response.send_message(f"Removed channel {channel.mention} from TTS whitelist!")
 
     @tts_channels.command(name="remove_text", description="Remove whitelisted channel for TTS text")
@@ -412,6 +571,7 @@ class SettingsCommands(TTSBase):
 
         whitelist.remove(channel.id)
         await self.config.guild(interaction.guild).whitelisted_channels.set(whitelist)
+        self.membership_index.set_whitelist(interaction.guild.id, whitelist)
         await interaction.response.send_message(f"Removed channel {channel.mention} from TTS whitelist!")
 
     @tts_channels.command(name="list", description="List whitelisted channels")
@@ -433,5 +593,6 @@ class SettingsCommands(TTSBase):
         if stale_ids:
             cleaned = [cid for cid in whitelist if cid not in stale_ids]
             await self.config.guild(interaction.guild).whitelisted_channels.set(cleaned)
+            self.membership_index.set_whitelist(interaction.guild.id, cleaned)
 
         await interaction.response.send_message(message)
\ No newline at end of file
@@ -16,10 +16,9 @@ class TTSCommands(TTSBase):
         Skip the current TTS message.
         """
         if interaction.user.voice is not None:
-            blacklist = await self.config.guild(interaction.guild).blacklisted_users()
-            if interaction.user.id not in blacklist:
+            if not self.membership_index.is_blacklisted(interaction.guild.id, interaction.user.id):
                 try:
-                    await audio_manager.skip_tts(self)
+                    await audio_manager.skip_tts(self, interaction.guild)
                     await interaction.response.send_message("Skipped TTS message!", delete_after=5)
                 except RuntimeError as err:
                     await interaction.response.send_message(err, delete_after=5)
@@ -32,10 +31,10 @@ class TTSCommands(TTSBase):
         Set the TTS volume.
         """
         if interaction.user.voice is not None:
-            blacklist = await self.config.guild(interaction.guild).blacklisted_users()
-            if interaction.user.id not in blacklist:
+            if not self.membership_index.is_blacklisted(interaction.guild.id, interaction.user.id):
                 try:
                     await self.config.guild(interaction.guild).global_tts_volume.set(volume)
+                    self.guild_settings_cache.invalidate(interaction.guild.id)
                     await interaction.response.send_message(f"Set global TTS volume to `{volume}%`!")
                 except RuntimeError as err:
                     await interaction.response.send_message(err)
@@ -53,8 +52,7 @@ class TTSCommands(TTSBase):
             return
 
         # Check if the user is blacklisted
-        blacklist = await self.config.guild(interaction.guild).blacklisted_users()
-        if interaction.user.id in blacklist:
+        if self.membership_index.is_blacklisted(interaction.guild.id, interaction.user.id):
             return
 
         # Try to connect to the user's voice channel
@@ -62,7 +60,7 @@ class TTSCommands(TTSBase):
             await audio_manager.connect_ll(self, interaction.user.voice.channel)
             await interaction.response.send_message(f" Connected to {interaction.user.voice.channel.mention}!",
                                                     ephemeral=True)
-            await self.config.user(interaction.user).warning_summon.set(False)
+            await self.user_profiles.update(interaction.user, warning_summon=False)
         except RuntimeError as err:
             await interaction.response.send_message("❌ Failed to connect to your voice channel.", ephemeral=True)
 
@@ -78,8 +76,7 @@ class TTSCommands(TTSBase):
         """
 
         # Check if the user is blacklisted
-        blacklist = await self.config.guild(interaction.guild).blacklisted_users()
-        if interaction.user.id in blacklist:
+        if self.membership_index.is_blacklisted(interaction.guild.id, interaction.user.id):
             return
 
         # Check if User is not in a voice channel
@@ -111,16 +108,17 @@ class TTSCommands(TTSBase):
                 await interaction.response.send_message("❌ You must select a voice to use TTS.", ephemeral=True)
                 return
 
+        profile = await self.user_profiles.get(interaction.user)
+
         # If the user has TTS disabled
-        if not await self.config.user(interaction.user).tts_enabled():
+        if not profile.tts_enabled:
             # If the user has disabled TTS and wants to disable it
             if voice == "disable":
                 await interaction.response.send_message("❌ TTS Was already disabled for you!", ephemeral=True)
                 return
             # Enable TTS for the user and set the voice
             else:
-                await self.config.user(interaction.user).voice.set(voice)
-                await self.config.user(interaction.user).tts_enabled.set(True)
+                await self.user_profiles.update(interaction.user, voice=voice, tts_enabled=True)
 
                 await interaction.response.send_message(f"✅ You have enabled TTS and sound like `{voice}`. \n"
                                                         f"Any messages you type in the voice channel text channels or no-mic"
@@ -132,13 +130,13 @@ class TTSCommands(TTSBase):
             # If the user has TTS enabled and wants to disable it
             if voice == "disable":
 
-                await self.config.user(interaction.user).tts_enabled.set(False)
+                await self.user_profiles.update(interaction.user, tts_enabled=False)
                 await interaction.response.send_message("❌ Disabled TTS!", ephemeral=True)
                 return
 
             # if the user has TTS enabled and wants to change the voice
             else:
-                await self.config.user(interaction.user).voice.set(voice)
+                await self.user_profiles.update(interaction.user, voice=voice)
                 await interaction.response.send_message(f"✅ You have changed your TTS voice to `{voice}`. \n"
                                                         f"Any messages you type in the voice channel text channels or no-mic"
                                                         f" will be read out.", ephemeral=True)
@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+log = logging.getLogger("red.mednis-cogs.poitranslator.audio_cache")
+
+
+def make_key(backend: str, voice: str, text: str) -> str:
+    return hashlib.sha256(f"{backend}\0{voice}\0{text}".encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """
+    Cache of generated TTS clips, keyed by backend, voice and the filtered text. Clips are files, or URLs of
+    clips held in the memory staging store, which on_remove has to drop.
+
+    Entries are evicted least recently used first once the cache goes over `max_bytes`. Clips that are
+    queued in Lavalink are held with `acquire`/`release` and never evicted while in use.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 0):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        self._entries: OrderedDict[str, tuple[str, int]] = OrderedDict()  # key -> (file path, size)
+        self._paths: dict[str, str] = {}  # file path -> key
+        self._in_use: dict[str, int] = {}  # file path -> number of queued tracks using it
+
+        # Told about every clip that is replaced or evicted, so anything remembered about it can be dropped
+        self.on_remove: Callable[[str], None] | None = None
+
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    async def load(self):
+        """
+        Picks up clips cached by a previous run, oldest first so they get evicted first.
+        """
+        files = await asyncio.to_thread(scan_cache_dir, self.path)
+
+        for file_path, size in files:
+            key = Path(file_path).stem
+            self._entries[key] = (file_path, size)
+            self._paths[file_path] = key
+            self.size += size
+
+        log.info(f"Loaded {len(self._entries)} cached TTS clips ({self.size} bytes).")
+        await self.evict()
+
+    def file_path(self, key: str, extension: str) -> str:
+        return (self.path / f"{key}.{extension}").as_posix()
+
+    def peek(self, key: str) -> str | None:
+        # Is it cached, without counting a hit or a miss or holding the clip
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def record_miss(self):
+        self.misses += 1
+
+    def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.bytes_saved += entry[1]
+
+        self.acquire(entry[0])
+        return entry[0]
+
+    async def add(self, key: str, file_path: str, size: int | None = None) -> bool:
+        """
+        Caches a clip and holds it for the caller. Returns False if the same clip was already cached somewhere
+        else, then this copy isn't cached and is released like any other clip.
+        """
+        if size is None:
+            size = await asyncio.to_thread(os.path.getsize, file_path)
+
+        existing = self._entries.get(key)
+        if existing is not None and existing[0] != file_path:
+            # Fetched twice at once, the first copy might already be queued so that is the one we keep
+            return False
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+            self._paths.pop(old[0], None)
+
+            # The same file written again, anything remembered about it is out of date
+            if self.on_remove is not None:
+                self.on_remove(old[0])
+
+        self._entries[key] = (file_path, size)
+        self._paths[file_path] = key
+        self.size += size
+
+        self.acquire(file_path)
+        await self.evict()
+        return True
+
+    def owns(self, file_path: str) -> bool:
+        return file_path in self._paths
+
+    def acquire(self, file_path: str):
+        self._in_use[file_path] = self._in_use.get(file_path, 0) + 1
+
+    def release(self, file_path: str):
+        count = self._in_use.get(file_path, 0) - 1
+
+        if count > 0:
+            self._in_use[file_path] = count
+        else:
+            self._in_use.pop(file_path, None)
+
+    async def evict(self):
+        if self.size <= self.max_bytes:
+            return
+
+        evicted = []
+        for key, (file_path, size) in self._entries.items():
+            if self.size <= self.max_bytes:
+                break
+
+            # Still queued for playback, keep it around
+            if file_path in self._in_use:
+                continue
+
+            evicted.append(key)
+            self.size -= size
+
+        paths = []
+        for key in evicted:
+            file_path, _ = self._entries.pop(key)
+            self._paths.pop(file_path, None)
+            paths.append(file_path)
+
+            if self.on_remove is not None:
+                self.on_remove(file_path)
+
+        await asyncio.to_thread(remove_files, paths)
+
+
+def scan_cache_dir(path: Path) -> list[tuple[str, int]]:
+    path.mkdir(parents=True, exist_ok=True)
+
+    files = []
+    for entry in os.scandir(path):
+        # Left over from a download that never finished
+        if entry.name.endswith(".part"):
+            os.remove(entry.path)
+            continue
+
+        if entry.is_file() and entry.name.endswith((".mp3", ".wav")):
+            stat = entry.stat()
+            files.append((stat.st_mtime, Path(entry.path).as_posix(), stat.st_size))
+
+    files.sort()
+    return [(file_path, size) for _, file_path, size in files]
+
+
+def remove_files(paths: list[str]):
+    for file_path in paths:
+        # Served from memory, nothing on disk
+        if "://" in file_path:
+            continue
+
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
@@ -1,25 +1,48 @@
+import copy
+import time
+
 import discord
 import lavalink
 import logging
 
-from ttsengine.core import file_manager
-from ttsengine.core.base import NonTTSTrack, TTSBase
+from ttsengine.core import file_manager, trace
+from ttsengine.core.track_cache import node_name
+from ttsengine.core.base import TTSBase
+from ttsengine.core.playback import GuildPlayback, InterruptState, Interruption, NonTTSTrack
 
 log = logging.getLogger("red.mednis-cogs.poitranslator.audio_manager")
 
+# TTS clips handed to Lavalink at once, the one playing and the next one so there is no gap between them
+PLAYBACK_DEPTH = 2
+
+
+def get_playback(self: TTSBase, guild_id: int) -> GuildPlayback:
+    playback = self.playback.get(guild_id)
+
+    if playback is None:
+        playback = self.playback[guild_id] = GuildPlayback(guild_id)
+
+    return playback
+
+
+def has_playback_room(self: TTSBase, guild_id: int) -> bool:
+    return len(get_playback(self, guild_id).tts_queue) < PLAYBACK_DEPTH
 
-async def skip_tts(self: TTSBase):
+
+async def skip_tts(self: TTSBase, guild: discord.Guild):
     log.info("Skipping TTS track.")
 
-    if self.llplayer is not None:
-        player = self.llplayer
+    playback = get_playback(self, guild.id)
+
+    if playback.player is not None:
+        player = playback.player
         current_track = player.current
 
         if current_track is not None:
-            if current_track.track_identifier in self.tts_queue:
+            if playback.is_tts_track(current_track):
                 track = player.current
                 await player.skip()
-                await delete_file_and_remove(self, track)
+                await delete_file_and_remove(self, playback, track)
             else:
                 raise RuntimeError("No TTS message is playing currently!")
         else:
@@ -29,7 +52,7 @@ async def skip_tts(self: TTSBase):
 
 async def connect_ll(self: TTSBase, vc: discord.VoiceChannel):
     try:
-        self.llplayer = await lavalink.connect(vc, self_deaf=True)
+        get_playback(self, vc.guild.id).player = await lavalink.connect(vc, self_deaf=True)
     except lavalink.errors.NodeNotFound:
         raise RuntimeError("Lavalink/Discord is not yet ready!")
     except lavalink.errors.PlayerException as err:
@@ -39,22 +62,25 @@ async def connect_ll(self: TTSBase, vc: discord.VoiceChannel):
 
 async def reconnect_ll(self: TTSBase, vc: discord.VoiceChannel):
     try:
-        self.llplayer = await lavalink.connect(vc, self_deaf=True)
+        get_playback(self, vc.guild.id).player = await lavalink.connect(vc, self_deaf=True)
     except lavalink.errors.NodeNotFound:
         raise RuntimeError("Lavalink/Discord is not yet ready!")
 
 
-async def play_audio(self: TTSBase, vc: discord.VoiceChannel, file_path: str, volume: int, track_name: str = "TTS"):
+async def play_audio(self: TTSBase, vc: discord.VoiceChannel, file_path: str, volume: int, track_name: str = "TTS",
+                     message_trace: trace.TTSTrace | None = None):
+
+    playback = get_playback(self, vc.guild.id)
 
     # If we don't have a lavalink reference cached.
-    if self.llplayer is None:
+    if playback.player is None:
         await reconnect_ll(self, vc)
 
-    player = self.llplayer
+    player = playback.player
 
     try:
         # Try and use our existing LavaLink client
-        response = (await player.load_tracks(file_path))
+        track = await load_track(self, player, file_path)
 
     except (RuntimeError, lavalink.errors.PlayerException):
         try:
@@ -62,18 +88,17 @@ async def play_audio(self: TTSBase, vc: discord.VoiceChannel, file_path: str, vo
             await reconnect_ll(self, vc)
 
             # Try and fix it
-            player = self.llplayer
-            response = (await player.load_tracks(file_path))
+            player = playback.player
+            track = await load_track(self, player, file_path)
         except (RuntimeError, lavalink.errors.PlayerException) as err:
             log.error("Failed to connect while trying to play TTS :(")
             log.error(err)
+            await file_manager.release_audio(self, file_path)
             return
 
-    # Response can theoretically give us multiple tracks... we only need one.
-    if len(response.tracks) > 0:
-        track = response.tracks[0]
-    else:
+    if track is None:
         log.error(f"Could not load track {file_path}")
+        await file_manager.release_audio(self, file_path)
         return
 
     # log.info(f"Current Volume: {player.volume}")
@@ -82,6 +107,11 @@ async def play_audio(self: TTSBase, vc: discord.VoiceChannel, file_path: str, vo
     # bot is running on
     track.title = track_name
 
+    # Loading the track is done, the rest of the trace is up to Lavalink and gets finished by TRACK_START
+    if message_trace is not None:
+        message_trace.lap("handoff")
+        playback.add_trace(track.track_identifier, message_trace)
+
     # If the player is not playing anything, play the track.
     if player.current is None:
         log.info("There was no track playing, playing the tts track.")
@@ -90,48 +120,173 @@ async def play_audio(self: TTSBase, vc: discord.VoiceChannel, file_path: str, vo
         player.queue.append(track)
 
         # Append the track to the TTS queue.
-        self.tts_queue.append(track.track_identifier)
+        playback.tts_queue.append(track.track_identifier)
 
         # Set the player volume to our global volume
-        await player.set_volume(volume)
+        await set_volume(player, volume)
 
         # Play the track.
         await player.play()
         return
 
     # Check if we are playing a TTS message already
-    if player.current.track_identifier in self.tts_queue:
+    if playback.is_tts_track(player.current):
         # if we are already playing tts, add it to the audio queue
-        player.queue.insert(len(self.tts_queue) - 1, track)
+        player.queue.insert(len(playback.tts_queue) - 1, track)
         # Then append it to the TTS queue
-        self.tts_queue.append(track.track_identifier)
+        playback.tts_queue.append(track.track_identifier)
         return
 
     else:
-        # If the player is playing something else, save the current track and position.
-        last_non_tts_track = NonTTSTrack(player.current, player.position, player.paused, player.volume)
+        # If the player is playing something else, stop it and queue it back up after the TTS.
+        await interrupt_music(self, playback, player, track, volume)
+
+
+async def interrupt_music(self: TTSBase, playback: GuildPlayback, player: lavalink.Player, track: lavalink.Track,
+                          volume: int):
+    saved = NonTTSTrack(player.current, player.position, player.paused, player.volume)
+
+    # The music goes back in as a copy that starts where it was stopped, so Lavalink resumes it in a single
+    # play instead of playing from the start and then pausing and seeking.
+    resume_track = copy.copy(saved.track)
+    resume_track.start_timestamp = saved.position if saved.track.seekable else 0
+
+    playback.tts_queue.append(track.track_identifier)  # Append the track to the TTS queue.
+
+    player.queue.insert(0, track)  # Insert the new track into the top of the queue.
+    player.queue.insert(1, resume_track)  # And the music right after it.
+    playback.interruption = Interruption(saved)
+
+    # Volume first, so the clip doesn't start at the music's volume
+    await set_volume(player, volume)
+
+    # Skip the current track.
+    await player.skip()
+
+
+async def begin_resume(playback: GuildPlayback, player: lavalink.Player):
+    """
+    The last TTS clip is done and Lavalink is moving on to the music, put the volume back while it does.
+    Does nothing if the resume already began.
+    """
+    interruption = playback.interruption
+    if interruption is None or interruption.state is not InterruptState.PLAYING_TTS:
+        return
+
+    interruption.state = InterruptState.RESUMING
+    interruption.resume_started = time.perf_counter()
 
-        self.tts_queue.append(track.track_identifier)  # Append the track to the TTS queue.
+    if player.volume != interruption.saved.volume:
+        interruption.updates += 1
+        await player.set_volume(interruption.saved.volume)
 
-        player.queue.insert(0, track)  # Insert the new track into the top of the queue.
 
-        # Add the saved track after the new track, at the same position it was stopped at.
-        player.queue.insert(1, last_non_tts_track.track)
-        self.last_non_tts_track = last_non_tts_track
+async def finish_resume(playback: GuildPlayback, player: lavalink.Player) -> Interruption | None:
+    """
+    Called when a track starts, if it's the music we interrupted it is back and the interruption is over.
+    Returns the finished interruption.
+    """
+    interruption = playback.interruption
+    if interruption is None or not interruption.matches(player.current):
+        return None
 
-        # Skip the current track.
-        await player.skip()
+    # A skipped clip doesn't end with a TRACK_END we act on, so the resume may start here
+    await begin_resume(playback, player)
 
-        # Set the player volume to the TTS global volume
+    # Lavalink can't start a track paused through the player, so this one still costs an update
+    if interruption.saved.was_paused:
+        interruption.updates += 1
+        await player.pause(True)
+
+    playback.interruption = None
+    return interruption
+
+
+def send_resume_statistics(self: TTSBase, guild_id: int, interruption: Interruption) -> None:
+    now = time.perf_counter()
+
+    statistics_event_tags = {
+        "guild_id": guild_id,
+        "was_paused": interruption.saved.was_paused,
+    }
+
+    statistics_event_data = {
+        "resume_latency": now - interruption.resume_started,
+        "interrupted_for": now - interruption.interrupted_at,
+        "updates": interruption.updates,
+    }
+
+    self.bot.dispatch("statistics_event", "tts_resume", statistics_event_tags, statistics_event_data)
+
+
+async def set_volume(player: lavalink.Player, volume: int):
+    # Each one is a round trip to the node, and with normalised clips the volume rarely needs to change
+    if player.volume != volume:
         await player.set_volume(volume)
 
 
-async def delete_file_and_remove(self: TTSBase, track: lavalink.Track):
+async def load_track(self: TTSBase, player: lavalink.Player, file_path: str) -> lavalink.Track | None:
+    """
+    Gets the Lavalink track for a clip. Cached clips have been loaded before, so their track is reused
+    instead of asking the node again.
+    """
+
+    node = node_name(player)
+    cached = self.audio_cache.owns(file_path)
+
+    if cached:
+        track = self.track_cache.get(node, file_path)
+        if track is not None:
+            send_track_load_statistics(self, node, True, None)
+            return track
+
+    start = time.perf_counter()
+    try:
+        with trace.span("load_tracks"):
+            response = await player.load_tracks(file_path)
+    except (RuntimeError, lavalink.errors.PlayerException):
+        self.track_cache.record_load(node, time.perf_counter() - start, False)
+        raise
+
+    latency = time.perf_counter() - start
+    self.track_cache.record_load(node, latency, len(response.tracks) > 0)
+    send_track_load_statistics(self, node, False, latency)
+
+    # Response can theoretically give us multiple tracks... we only need one.
+    if len(response.tracks) == 0:
+        return None
+
+    track = response.tracks[0]
+    if cached:
+        self.track_cache.add(node, file_path, track)
+
+    return track
+
+
+def send_track_load_statistics(self: TTSBase, node: str, hit: bool, latency: float | None) -> None:
+    stats = self.track_cache.get_load_stats(node)
+
+    statistics_event_tags = {
+        "node": node,
+        "result": "hit" if hit else "miss"
+    }
+
+    statistics_event_data = {
+        "latency": latency,
+        "p50": stats.p50,
+        "p95": stats.p95,
+        "error_rate": stats.error_rate,
+    }
+
+    self.bot.dispatch("statistics_event", "tts_track_load", statistics_event_tags, statistics_event_data)
+
+
+async def delete_file_and_remove(self: TTSBase, playback: GuildPlayback, track: lavalink.Track):
     log.info("Deleting tts track and removing it from the queue.")
-    log.info(self.tts_queue)
+    log.info(playback.tts_queue)
 
     # If the track ended, delete the audio file.
-    await file_manager.delete_audio(track.uri)
+    await file_manager.release_audio(self, track.uri)
 
     # Remove the track from the queue.
-    self.tts_queue.remove(track.track_identifier)
+    playback.tts_queue.remove(track.track_identifier)
@@ -0,0 +1,67 @@
+import logging
+import os
+import shutil
+import subprocess
+import uuid
+
+log = logging.getLogger("red.mednis-cogs.poitranslator.audio_processing")
+
+# Quieter than this at the start or end of a clip counts as silence
+SILENCE_THRESHOLD = "-50dB"
+
+# Discord plays 48kHz, so Lavalink doesn't have to resample
+SAMPLE_RATE = 48000
+
+# Any single clip taking longer than this has gone wrong
+PROCESS_TIMEOUT = 15
+
+# How each clip type is written back out
+CODECS = {
+    "mp3": ["-c:a", "libmp3lame", "-q:a", "4", "-f", "mp3"],
+    "wav": ["-c:a", "pcm_s16le", "-f", "wav"],
+}
+
+
+class AudioProcessor:
+    """
+    Trims the silence off both ends of a clip and normalises its loudness with ffmpeg, so every backend and
+    voice comes out equally loud. The processing methods block, run them in a worker thread.
+    """
+
+    def __init__(self, binary: str, loudness: float):
+        self.binary = binary
+        self.loudness = loudness
+
+    @property
+    def tag(self) -> str:
+        # Processed clips are cached separately, and again if the target changes
+        return f"norm{self.loudness:g}"
+
+    def available(self) -> bool:
+        return shutil.which(self.binary) is not None
+
+    def command(self, source: str, destination: str, extension: str) -> list[str]:
+        # Trimming the end is done by trimming the start of the reversed clip
+        trim = f"silenceremove=start_periods=1:start_threshold={SILENCE_THRESHOLD}"
+        filters = f"{trim},areverse,{trim},areverse,loudnorm=I={self.loudness:g}:TP=-1.5:LRA=11"
+
+        return [self.binary, "-nostdin", "-hide_banner", "-loglevel", "error", "-i", source, "-af", filters,
+                "-ar", str(SAMPLE_RATE), *CODECS[extension], "-y", destination]
+
+    def process_file(self, path: str, extension: str):
+        temp_path = f"{path}.{uuid.uuid4()}.part"
+        try:
+            subprocess.run(self.command(path, temp_path, extension), capture_output=True, check=True,
+                           timeout=PROCESS_TIMEOUT)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def process_bytes(self, data: bytes, extension: str) -> bytes:
+        result = subprocess.run(self.command("pipe:0", "pipe:1", extension), input=data, capture_output=True,
+                                check=True, timeout=PROCESS_TIMEOUT)
+        return result.stdout
@@ -0,0 +1,133 @@
+import hashlib
+import logging
+import uuid
+from pathlib import Path
+
+from aiohttp import web
+
+log = logging.getLogger("red.mednis-cogs.poitranslator.audio_staging")
+
+# Where clips wait for Lavalink to pick them up
+STAGING_MODES = ("disk", "tmpfs", "memory")
+
+# Memory backed on pretty much every Linux host
+TMPFS_PATH = Path("/dev/shm")
+
+
+def tmpfs_dir(cog_path: Path) -> Path:
+    # Named after the cog folder so a restart finds the same one
+    name = hashlib.sha256(cog_path.as_posix().encode("utf-8")).hexdigest()[:16]
+    return TMPFS_PATH / f"ttsengine-{name}"
+
+
+def make_tmpfs_dir(cog_path: Path) -> Path | None:
+    """
+    A folder on tmpfs for this bot's clips. Returns None if there is no tmpfs to use. Runs in a worker thread.
+    """
+    if not TMPFS_PATH.is_dir():
+        return None
+
+    path = tmpfs_dir(cog_path)
+
+    try:
+        path.mkdir(exist_ok=True)
+    except OSError:
+        return None
+
+    return path
+
+
+class MemoryAudioStore:
+    """
+    Clips waiting to be played, held in memory and served to Lavalink over HTTP, so playing a message never
+    touches the disk. Lavalink needs the http source enabled for this.
+
+    Clips stay in the store until they are released, or for cached clips until the audio cache evicts them.
+    Once it holds `max_bytes` new clips are refused, the caller puts those on disk instead.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.base_url: str | None = None
+
+        self._clips: dict[str, tuple[bytes, str]] = {}  # name -> (clip, content type)
+        self._runner: web.AppRunner | None = None
+
+    async def start(self, host: str, port: int):
+        app = web.Application()
+        app.router.add_get("/tts/{name}", self._serve)
+
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host, port).start()
+        except OSError:
+            await runner.cleanup()
+            raise
+
+        # Port 0 gets us any free port, so ask what we ended up with
+        port = runner.addresses[0][1]
+        self.base_url = f"http://{host}:{port}/tts/"
+        self._runner = runner
+
+        log.info(f"Serving TTS clips to Lavalink from {self.base_url}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+        self._clips.clear()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._clips)
+
+    def add(self, data: bytes, extension: str, content_type: str) -> str | None:
+        if self.base_url is None or self.size + len(data) > self.max_bytes:
+            return None
+
+        name = f"{uuid.uuid4().hex}.{extension}"
+        self._clips[name] = (data, content_type)
+        self.size += len(data)
+
+        return self.base_url + name
+
+    def owns(self, url: str) -> bool:
+        return self.base_url is not None and url.startswith(self.base_url) \
+            and url[len(self.base_url):] in self._clips
+
+    def size_of(self, url: str) -> int | None:
+        clip = self._clips.get(url[len(self.base_url):]) if self.owns(url) else None
+        return len(clip[0]) if clip is not None else None
+
+    def remove(self, url: str):
+        clip = self._clips.pop(url[len(self.base_url):], None)
+        if clip is not None:
+            self.size -= len(clip[0])
+
+    async def _serve(self, request: web.Request) -> web.Response:
+        clip = self._clips.get(request.match_info["name"])
+        if clip is None:
+            raise web.HTTPNotFound()
+
+        data, content_type = clip
+        headers = {"Accept-Ranges": "bytes"}
+
+        # Lavalink asks for a range when it seeks or reconnects mid clip
+        try:
+            requested = request.http_range
+        except ValueError:
+            raise web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{len(data)}"})
+
+        if requested.start is None and requested.stop is None:
+            return web.Response(body=data, content_type=content_type, headers=headers)
+
+        start, stop, _ = requested.indices(len(data))
+        if start >= stop:
+            raise web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{len(data)}"})
+
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{len(data)}"
+        return web.Response(body=data[start:stop], status=206, content_type=content_type, headers=headers)
+
@@ -0,0 +1,207 @@
+import logging
+import time
+from collections import deque
+from typing import NamedTuple
+
+log = logging.getLogger("red.mednis-cogs.poitranslator.backend_router")
+
+# How many recent requests the latency percentiles and error rate are worked out from
+WINDOW_SIZE = 50
+
+# A backend+voice slower than this at p95 is considered degraded, this used to be the cutoff for dropping clips
+SLOW_LATENCY = 2.0
+
+# Backends failing more than this share of recent requests are considered degraded
+DEGRADED_ERROR_RATE = 0.25
+
+# The circuit opens after this many failures in a row, and lets a trial request through after the cooldown
+BREAKER_FAILURES = 5
+BREAKER_COOLDOWN = 30.0
+
+# A degraded route that hasn't been used for this long gets another go, so it can show it got better
+STALE_STATS = 60.0
+
+
+class Route(NamedTuple):
+    # One way of getting a clip for a message
+    backend: str
+    voice: str
+    url: str
+    extension: str
+    content_type: str
+
+
+class LatencyStats:
+    """
+    Rolling latency and error stats of one backend and voice.
+    """
+    __slots__ = ("latencies", "outcomes", "updated")
+
+    def __init__(self):
+        self.latencies: deque[float] = deque(maxlen=WINDOW_SIZE)
+        self.outcomes: deque[bool] = deque(maxlen=WINDOW_SIZE)
+        self.updated = time.monotonic()
+
+    def record(self, latency: float | None, ok: bool):
+        if latency is not None:
+            self.latencies.append(latency)
+        self.outcomes.append(ok)
+        self.updated = time.monotonic()
+
+    def percentile(self, percent: float) -> float | None:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+    @property
+    def p50(self) -> float | None:
+        return self.percentile(50)
+
+    @property
+    def p95(self) -> float | None:
+        return self.percentile(95)
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    @property
+    def degraded(self) -> bool:
+        if time.monotonic() - self.updated > STALE_STATS:
+            return False
+
+        p95 = self.p95
+        return self.error_rate > DEGRADED_ERROR_RATE or (p95 is not None and p95 > SLOW_LATENCY)
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a backend that keeps failing. After the cooldown a single trial request
+    is let through, if that works the circuit closes again.
+    """
+    __slots__ = ("failures", "opened_at", "trial_running")
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial_running = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    @property
+    def ready_for_trial(self) -> bool:
+        return (self.opened_at is not None and not self.trial_running
+                and time.monotonic() - self.opened_at >= BREAKER_COOLDOWN)
+
+    def allows_request(self) -> bool:
+        if self.opened_at is None:
+            return True
+
+        # Half open, one request at a time gets to find out if the backend is back
+        if self.ready_for_trial:
+            self.trial_running = True
+            return True
+
+        return False
+
+    def cancel_trial(self):
+        # The trial request was cancelled before it could tell us anything
+        self.trial_running = False
+
+    def record(self, ok: bool):
+        self.trial_running = False
+
+        if ok:
+            self.failures = 0
+            self.opened_at = None
+            return
+
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= BREAKER_FAILURES:
+            # Either the trial failed or we just hit the limit, wait another cooldown
+            self.opened_at = time.monotonic()
+
+
+class BackendRouter:
+    """
+    Keeps track of how each TTS backend is doing and decides which of the routes for a message to try first.
+
+    Healthy routes keep the order they were configured in (the local API before the public one). Routes that
+    are slow or erroring go after them, fastest first. Backends with an open circuit go last and are only
+    tried once their cooldown is up.
+    """
+
+    def __init__(self):
+        self.stats: dict[tuple[str, str], LatencyStats] = {}
+        self.breakers: dict[str, CircuitBreaker] = {}
+
+        # Downloads that could have been hedged, ones that were, and ones the hedge request won
+        self.hedge_eligible = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def get_stats(self, backend: str, voice: str) -> LatencyStats:
+        stats = self.stats.get((backend, voice))
+        if stats is None:
+            stats = self.stats[(backend, voice)] = LatencyStats()
+        return stats
+
+    def get_breaker(self, backend: str) -> CircuitBreaker:
+        breaker = self.breakers.get(backend)
+        if breaker is None:
+            breaker = self.breakers[backend] = CircuitBreaker()
+        return breaker
+
+    def order(self, routes: list[Route]) -> list[Route]:
+        def health(route: Route):
+            breaker = self.get_breaker(route.backend)
+            if breaker.is_open and not breaker.ready_for_trial:
+                return 2, 0.0
+
+            # A backend due a trial keeps its place, otherwise it would never get the chance to recover
+            stats = self.get_stats(route.backend, route.voice)
+            if breaker.is_open or not stats.degraded:
+                return 0, 0.0
+            return 1, stats.p95 or 0.0
+
+        # sorted is stable, so healthy routes stay in the configured order
+        return sorted(routes, key=health)
+
+    def hedge_delay(self, route: Route, percentile: float) -> float:
+        # Until we know better, give it as long as we used to before giving up on a clip
+        latency = self.get_stats(route.backend, route.voice).percentile(percentile)
+        return SLOW_LATENCY if latency is None else latency
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedged / self.hedge_eligible if self.hedge_eligible else 0.0
+
+    @property
+    def hedge_win_rate(self) -> float:
+        return self.hedge_wins / self.hedged if self.hedged else 0.0
+
+    def allows_request(self, route: Route) -> bool:
+        return self.get_breaker(route.backend).allows_request()
+
+    def cancel(self, route: Route, elapsed: float):
+        # We don't know how long it would have taken, but at least this long. Without it a backend that always
+        # loses to a hedge request would never look slow.
+        self.get_stats(route.backend, route.voice).latencies.append(elapsed)
+        self.get_breaker(route.backend).cancel_trial()
+
+    def record(self, route: Route, latency: float | None, ok: bool):
+        self.get_stats(route.backend, route.voice).record(latency, ok)
+
+        breaker = self.get_breaker(route.backend)
+        was_open = breaker.is_open
+        breaker.record(ok)
+
+        if breaker.is_open and not was_open:
+            log.warning(f"TTS backend {route.backend} keeps failing, not sending it requests for a while.")
+        elif was_open and not breaker.is_open:
+            log.info(f"TTS backend {route.backend} is working again.")
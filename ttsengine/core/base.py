@@ -1,15 +1,18 @@
 from redbot.core.config import Config
 from redbot.core.bot import Red
-from typing import NamedTuple
-import lavalink
+import aiohttp
 from pathlib import Path
 
-class NonTTSTrack(NamedTuple):
-    # This sorts track information for non-tts tracks
-    track: lavalink.Track
-    position: int
-    was_paused: bool
-    volume: int
+from ttsengine.core.audio_cache import AudioCache
+from ttsengine.core.audio_processing import AudioProcessor
+from ttsengine.core.audio_staging import MemoryAudioStore
+from ttsengine.core.backend_router import BackendRouter
+from ttsengine.core.mention_cache import MentionCache
+from ttsengine.core.offline_tts import OfflineSynthesiser
+from ttsengine.core.playback import GuildPlayback
+from ttsengine.core.settings_cache import GuildMembershipIndex, GuildSettingsCache
+from ttsengine.core.track_cache import TrackCache
+from ttsengine.core.user_cache import UserProfileStore
 
 class TTSBase:
     # This class is mainly here to make the analysis from the IDE happy
@@ -17,8 +20,17 @@ class TTSBase:
 
     bot: Red
     config: Config
-    llplayer: lavalink.Player | None
-    tts_queue: list[str]
-    last_non_tts_track: NonTTSTrack | None
+    guild_settings_cache: GuildSettingsCache
+    membership_index: GuildMembershipIndex
+    user_profiles: UserProfileStore
+    mention_cache: MentionCache
+    playback: dict[int, GuildPlayback]
     audio_file_name: str
+    audio_cache: AudioCache
+    audio_store: MemoryAudioStore | None
+    audio_processor: AudioProcessor | None
+    track_cache: TrackCache
+    http_session: aiohttp.ClientSession | None
+    backend_router: BackendRouter
+    offline_tts: OfflineSynthesiser | None
     cog_path: Path
\ No newline at end of file
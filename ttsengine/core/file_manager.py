@@ -1,91 +1,581 @@
 import asyncio
 import os
+import subprocess
+import time
 import urllib.parse
 import uuid
 import logging
+from typing import NamedTuple
+
 import aiohttp
 
+from ttsengine.core import audio_cache, audio_staging, offline_tts, trace
+from ttsengine.core.backend_router import Route
 from ttsengine.core.base import TTSBase
+from ttsengine.core.http_client import RequestTiming
 
 log = logging.getLogger("red.mednis-cogs.poitranslator.file_manager")
 
+# Clips are written as they arrive in chunks of this size
+CHUNK_SIZE = 64 * 1024
+
+# A 400 character message is a few hundred KB, anything this big is not a TTS clip
+MAX_AUDIO_BYTES = 10 * 1024 * 1024
+
+# A single backend request gives up after this long, the router will try the next backend
+REQUEST_TIMEOUT = 10
+
+# Used for a message when no backend can do the voice the user picked
+DEFAULT_VOICE = "Brian"
+
+# What a failed backend request can raise
+DOWNLOAD_ERRORS = (RuntimeError, aiohttp.ClientError, asyncio.TimeoutError)
+
+# Downloads running at once for a batch, unless the caller says otherwise
+BATCH_CONCURRENCY = 4
+
+# Clips and partial downloads in the cog folder, cached clips live in their own folder and are not touched
+AUDIO_SUFFIXES = (".mp3", ".wav", ".part")
+
+# Audio files younger than this are left alone by the periodic cleanup, they might be on their way to the player
+ORPHAN_AGE = 300
+
+# How many orphaned files get removed per worker thread call
+RECONCILE_BATCH = 256
+
 
 async def download_audio(self: TTSBase, voice: str, text: str):
     """
-    Downloads audio from the tts api.
+    Downloads audio from the healthiest tts api that has the voice, or reuses a cached clip of the same text
+    and voice. If none of them work, the default voice is tried, just for this message.
+    """
+
+    voices = [voice] if voice == DEFAULT_VOICE else [voice, DEFAULT_VOICE]
+
+    hedge_percentile = await self.config.hedge_percentile() if await self.config.hedge_requests() else None
+
+    for attempt_voice in voices:
+        routes = self.backend_router.order(await resolve_routes(self, attempt_voice, text))
+
+        # Any backend will do if it already has the clip cached
+        if self.audio_cache.enabled:
+            file_path = get_cached(self, routes, text)
+            if file_path is not None:
+                return file_path
+
+        index = 0
+        while index < len(routes):
+            route = routes[index]
+            index += 1
+
+            if not self.backend_router.allows_request(route):
+                continue
+
+            # The next backend can back this one up, as long as it isn't known to be down
+            backup = None
+            if hedge_percentile is not None and index < len(routes):
+                if not self.backend_router.get_breaker(routes[index].backend).is_open:
+                    backup = routes[index]
+                    index += 1
+
+            try:
+                if backup is not None:
+                    file_path = await fetch_hedged(self, route, backup, text, hedge_percentile)
+                else:
+                    file_path = await fetch_route(self, route, text)
+            except DOWNLOAD_ERRORS as err:
+                log.warning(f"TTS backend {route.backend} failed for voice {route.voice}: {err!r}")
+            else:
+                record_cache_miss(self, route.backend)
+                return file_path
+
+        if attempt_voice != DEFAULT_VOICE:
+            log.error(f"No TTS backend could do voice {voice}, using {DEFAULT_VOICE} for this message.")
+
+    record_cache_miss(self, None)
+    raise RuntimeError("Failed to download audio file.")
+
+
+def get_cached(self: TTSBase, routes: list[Route], text: str) -> str | None:
+    # Only the clip we end up using counts as a hit, the backends that don't have it aren't misses
+    for route in routes:
+        key = cache_key(self, route, text)
+
+        if self.audio_cache.peek(key) is not None:
+            file_path = self.audio_cache.get(key)
+            send_cache_statistics(self, route.backend, True)
+            return file_path
+
+    return None
+
+
+def record_cache_miss(self: TTSBase, backend: str | None):
+    # Once per message that wasn't in the cache, however many backends and voices were looked at
+    if not self.audio_cache.enabled:
+        return
+
+    self.audio_cache.record_miss()
+    if backend is not None:
+        send_cache_statistics(self, backend, False)
+
+
+class BatchResult(NamedTuple):
+    # One clip of a batch, either the path or why there isn't one
+    file_path: str | None
+    latency: float
+    error: Exception | None = None
+
+
+async def download_audio_batch(self: TTSBase, requests: list[tuple[str, str]],
+                               concurrency: int = BATCH_CONCURRENCY) -> list[BatchResult]:
+    """
+    Downloads the clips for several (voice, text) pairs at once, at most `concurrency` at a time.
+    Results come back in the same order as the requests, one failing does not stop the others.
+    """
+
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def download(voice: str, text: str) -> BatchResult:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                file_path = await download_audio(self, voice, text)
+            except RuntimeError as err:
+                return BatchResult(None, time.perf_counter() - start, err)
+            return BatchResult(file_path, time.perf_counter() - start)
+
+    def release(task: asyncio.Task):
+        if task.cancelled() or task.exception() is not None or task.result().file_path is None:
+            return
+        asyncio.create_task(release_audio(self, task.result().file_path))
+
+    tasks = [asyncio.create_task(download(voice, text)) for voice, text in requests]
+
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        # Nobody is going to play the clips that did make it
+        for task in tasks:
+            if task.done():
+                release(task)
+            else:
+                task.cancel()
+                task.add_done_callback(release)
+        raise
+
+
+async def fetch_route(self: TTSBase, route: Route, text: str) -> str:
+    """
+    Downloads the clip from a single backend, and records how that went with the router.
+    """
+
+    if route.backend == offline_tts.BACKEND:
+        return await fetch_offline(self, route, text)
+
+    key, file_path = clip_path(self, route, text)
+
+    timing = RequestTiming()
+
+    try:
+        async with self.http_session.get(route.url, trace_request_ctx=timing,
+                                         timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)) as response:
+            # Check if the request returns an audio file, before we start reading the body
+            if response.content_type != route.content_type:
+                log.error(f"Was expecting {route.content_type}, got ({response.headers.get('content-type')})")
+                if route.backend == "local":
+                    log.error(f"Response: {await response.text()}")
+                raise RuntimeError("Failed to download audio file.")
+
+            if response.content_length is not None and response.content_length > MAX_AUDIO_BYTES:
+                log.error(f"Audio file is too large ({response.content_length} bytes).")
+                raise RuntimeError("Failed to download audio file.")
+
+            # Save the audio file as it arrives, or keep it in memory for Lavalink to fetch
+            in_memory = self.audio_store is not None
+            with trace.span("write"):
+                if in_memory:
+                    file_path = await stream_to_store(self, response, route, file_path)
+                else:
+                    await stream_to_file(response, file_path)
+
+            timing.finish()
+            self.backend_router.record(route, timing.total_time, True)
+
+            await send_voice_statistics(self, urllib.parse.quote_plus(text), route, response.status, timing)
+    except asyncio.CancelledError:
+        self.backend_router.cancel(route, time.perf_counter() - timing.start)
+        raise
+    except Exception:
+        timing.finish()
+        self.backend_router.record(route, timing.total_time, False)
+        raise
+
+    # Clips kept in memory were already processed on their way in
+    processed = in_memory or await post_process(self, route, file_path)
+
+    # A clip that couldn't be processed is played as it is, but not cached as a processed one
+    if key is not None and processed:
+        # A clip in the store is cached from there, the store only says how big it is
+        size = self.audio_store.size_of(file_path) if in_memory else None
+        await self.audio_cache.add(key, file_path, size)
+
+    return file_path
+
+
+async def fetch_offline(self: TTSBase, route: Route, text: str) -> str:
+    """
+    Synthesises the clip with the offline engine.
+    """
+
+    key, file_path = clip_path(self, route, text)
+    start = time.perf_counter()
+
+    try:
+        await self.offline_tts.synthesise(route.url, text, file_path)
+    except asyncio.CancelledError:
+        self.backend_router.cancel(route, time.perf_counter() - start)
+        raise
+    except Exception:
+        self.backend_router.record(route, time.perf_counter() - start, False)
+        raise
+
+    self.backend_router.record(route, time.perf_counter() - start, True)
+
+    if await post_process(self, route, file_path) and key is not None:
+        await self.audio_cache.add(key, file_path)
+
+    return file_path
+
+
+async def post_process(self: TTSBase, route: Route, file_path: str) -> bool:
+    """
+    Trims and normalises a clip in place, if post-processing is on. Returns False if that didn't work out.
+    """
+
+    if self.audio_processor is None:
+        return True
+
+    start = time.perf_counter()
+    task = asyncio.ensure_future(asyncio.to_thread(self.audio_processor.process_file, file_path, route.extension))
+
+    try:
+        # ffmpeg can't be stopped halfway through, so a cancelled download tidies up after it once it is done
+        with trace.span("post_process"):
+            await asyncio.shield(task)
+    except asyncio.CancelledError:
+        task.add_done_callback(lambda _: asyncio.ensure_future(delete_if_exists(file_path)))
+        raise
+    except (OSError, subprocess.SubprocessError) as err:
+        log.warning(f"Could not post-process a clip from {route.backend}, playing it as it is: {err!r}")
+        send_processing_statistics(self, route, False, time.perf_counter() - start)
+        return False
+
+    send_processing_statistics(self, route, True, time.perf_counter() - start)
+    return True
+
+
+async def post_process_bytes(self: TTSBase, route: Route, data: bytes) -> bytes:
+    if self.audio_processor is None:
+        return data
+
+    start = time.perf_counter()
+    try:
+        processed = await asyncio.to_thread(self.audio_processor.process_bytes, data, route.extension)
+    except (OSError, subprocess.SubprocessError) as err:
+        log.warning(f"Could not post-process a clip from {route.backend}, playing it as it is: {err!r}")
+        send_processing_statistics(self, route, False, time.perf_counter() - start)
+        return data
+
+    send_processing_statistics(self, route, True, time.perf_counter() - start)
+    return processed
+
+
+def cache_key(self: TTSBase, route: Route, text: str) -> str:
+    # Processed clips are cached apart from unprocessed ones
+    backend = route.backend if self.audio_processor is None else f"{route.backend}:{self.audio_processor.tag}"
+    return audio_cache.make_key(backend, route.voice, text)
+
+
+def clip_path(self: TTSBase, route: Route, text: str) -> tuple[str | None, str]:
+    # Where a new clip goes, and its cache key if it is going in the cache
+    if self.audio_cache.enabled:
+        key = cache_key(self, route, text)
+        return key, self.audio_cache.file_path(key, route.extension)
+
+    return None, f"{self.audio_file_name}{uuid.uuid4()}.{route.extension}"
+
+
+async def fetch_hedged(self: TTSBase, primary: Route, backup: Route, text: str, percentile: float) -> str:
+    """
+    Downloads from the primary backend, but if it takes longer than it usually does the same clip is
+    requested from the backup as well, and whichever arrives first is used.
+    """
+
+    self.backend_router.hedge_eligible += 1
+
+    primary_task = asyncio.create_task(fetch_route(self, primary, text))
+    pending = {primary_task}
+
+    try:
+        done, pending = await asyncio.wait(pending, timeout=self.backend_router.hedge_delay(primary, percentile))
+
+        if done:
+            if primary_task.exception() is None:
+                return primary_task.result()
+
+            # It failed quickly, the backup is just the next one to try
+            log.warning(f"TTS backend {primary.backend} failed for voice {primary.voice}: "
+                        f"{primary_task.exception()!r}")
+            if not self.backend_router.allows_request(backup):
+                raise primary_task.exception()
+            return await fetch_route(self, backup, text)
+
+        if not self.backend_router.allows_request(backup):
+            # Waited on without taking it out of pending, so if we are cancelled its clip is still cleaned up
+            await asyncio.wait(pending)
+            pending = set()
+            return primary_task.result()
+
+        self.backend_router.hedged += 1
+        backup_task = asyncio.create_task(fetch_route(self, backup, text))
+        pending.add(backup_task)
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+            # If both made it at the same time, the primary wins
+            winners = [task for task in (primary_task, backup_task) if task in done and task.exception() is None]
+            if winners:
+                winner = winners[0]
+
+                if winner is backup_task:
+                    self.backend_router.hedge_wins += 1
+                send_hedge_statistics(self, primary, backup, "backup" if winner is backup_task else "primary")
+
+                # The other clip isn't needed
+                pending |= done - {winner}
+                return winner.result()
+
+        send_hedge_statistics(self, primary, backup, "none")
+        raise primary_task.exception()
+    finally:
+        for task in pending:
+            discard_download(self, task)
+
+
+def discard_download(self: TTSBase, task: asyncio.Task):
+    """
+    Cancels a download we no longer want, and gets rid of its clip if it got that far.
+    """
+    def release(finished: asyncio.Task):
+        if finished.cancelled() or finished.exception() is not None:
+            return
+        asyncio.create_task(release_audio(self, finished.result()))
+
+    if task.done():
+        release(task)
+    else:
+        task.cancel()
+        task.add_done_callback(release)
+
+
+async def resolve_routes(self: TTSBase, voice: str, text: str) -> list[Route]:
+    """
+    Works out which TTS APIs can do a voice, in the order we prefer them.
     """
 
     # Encode the text to be URL safe
-    text = urllib.parse.quote_plus(text)
-    voice = urllib.parse.quote_plus(voice)
+    quoted_text = urllib.parse.quote_plus(text)
+    quoted_voice = urllib.parse.quote_plus(voice)
+
+    routes = []
 
     if await self.config.local_api():
         # Depending on the voice, we can use a local voice API instead of the cloud API
         local_voices = await self.config.local_voices()
 
-        if voice.lower() in local_voices:
-            voice = local_voices[voice.lower()]
-            voice = urllib.parse.quote_plus(voice)
+        if quoted_voice.lower() in local_voices:
+            local_voice = urllib.parse.quote_plus(local_voices[quoted_voice.lower()])
 
             url = await self.config.local_api_url()
-            url= url.format(voice=voice, text=text)
+            url = url.format(voice=local_voice, text=quoted_text)
 
-            file_path = f"{self.audio_file_name}{uuid.uuid4()}.wav"
+            routes.append(Route("local", voice, url, "wav", "audio/wav"))
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
+    # The cloud API has every voice
+    url = await self.config.public_api_url()
+    url = url.format(voice=quoted_voice, text=quoted_text)
 
-                    # Check if the request returns an audio file
-                    if response.headers.get("content-type") != "audio/wav":
-                        log.error(f"Was expecting a wav file, got ({response.headers.get('content-type')})")
-                        log.error(f"Response: {await response.text()}")
-                        raise RuntimeError("Failed to download audio file.")
+    routes.append(Route("public", voice, url, "mp3", "audio/mp3"))
 
-                    # Save the audio file
-                    content = await response.read()
+    # Last resort, the built-in engine does every voice as one of its own and needs no network at all
+    if self.offline_tts is not None:
+        offline_voices = await self.config.offline_voices()
+        offline_voice = offline_voices.get(voice.lower(), offline_tts.DEFAULT_VOICE)
 
-                    await asyncio.to_thread(write_file, file_path, content)
+        # There is no URL, the engine just needs to know which of its voices to use
+        routes.append(Route(offline_tts.BACKEND, voice, offline_voice, "wav", "audio/wav"))
 
-                    await send_voice_statistics(self, text, voice, "local", response.status)
-            return file_path
+    return routes
 
-    # Use the cloud API
-    url = await self.config.public_api_url()
-    url = url.format(voice=voice, text=text)
 
-    file_path = f"{self.audio_file_name}{uuid.uuid4()}.mp3"
+async def stream_to_file(response, path: str):
+    """
+    Writes the response body to disk chunk by chunk, without holding the whole clip in memory.
+    """
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
+    # Write next to the final path first, so a half written clip is never picked up by another message
+    temp_path = f"{path}.{uuid.uuid4()}.part"
+    size = 0
 
-            # Check if the request returns an audio file
-            if response.headers.get("content-type") != "audio/mp3":
-                log.error("Failed to download audio file.")
+    file = await asyncio.to_thread(open, temp_path, 'wb')
+    try:
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            size += len(chunk)
 
+            if size > MAX_AUDIO_BYTES:
+                log.error(f"Audio file went over {MAX_AUDIO_BYTES} bytes, giving up.")
                 raise RuntimeError("Failed to download audio file.")
 
-            # Save the audio file
-            content = await response.read()
-            await asyncio.to_thread(write_file, file_path, content)
-            await send_voice_statistics(self, text, voice, "public", response.status)
-    return file_path
+            await asyncio.to_thread(file.write, chunk)
+
+        await asyncio.to_thread(file.close)
+
+        # The clip is complete, move it into place
+        await asyncio.to_thread(os.replace, temp_path, path)
+    except BaseException:
+        await asyncio.to_thread(file.close)
+        await asyncio.to_thread(remove_if_exists, temp_path)
+        raise
+
+
+async def stream_to_store(self: TTSBase, response, route: Route, fallback_path: str) -> str:
+    """
+    Reads the response body into the in-memory store and returns the URL Lavalink can play it from.
+    If the store is full the clip is written to fallback_path instead.
+    """
+
+    data = bytearray()
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        data += chunk
+
+        if len(data) > MAX_AUDIO_BYTES:
+            log.error(f"Audio file went over {MAX_AUDIO_BYTES} bytes, giving up.")
+            raise RuntimeError("Failed to download audio file.")
+
+    data = await post_process_bytes(self, route, bytes(data))
+
+    url = self.audio_store.add(data, route.extension, route.content_type)
+    if url is not None:
+        return url
+
+    # Plenty of clips waiting to be played already, this one can wait on disk
+    await asyncio.to_thread(write_file, fallback_path, data)
+    return fallback_path
+
 
 def write_file(path: str, data: bytes):
-    with open(path, 'wb') as f:
-        f.write(data)
+    # Same as stream_to_file, the clip only shows up under its real name once it is complete
+    temp_path = f"{path}.{uuid.uuid4()}.part"
+    try:
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        remove_if_exists(temp_path)
+        raise
+
+
+def remove_if_exists(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def scan_audio_files(path: str, prefix: str, min_age: float) -> list[str]:
+    """
+    Names of the clips in the folder that are at least min_age seconds old. Runs in a worker thread.
+    """
+    cutoff = time.time() - min_age
+    found = []
+
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if not entry.name.startswith(prefix) or not entry.name.endswith(AUDIO_SUFFIXES):
+                    continue
+                try:
+                    if entry.is_file() and entry.stat().st_mtime <= cutoff:
+                        found.append(entry.name)
+                except FileNotFoundError:
+                    # Played and deleted while we were looking
+                    pass
+    except FileNotFoundError:
+        pass
 
-def cleanup_audio(self: TTSBase):
+    return found
+
+
+def live_audio_files(self: TTSBase) -> set[str]:
     """
-    Removes all .mp3 files from the audio folder.
+    Names of the clips still queued on a player or waiting to be handed to one.
     """
+    live = set()
+
+    for playback in self.playback.values():
+        tracks = [playback.current_track]
+        if playback.player is not None:
+            tracks.append(playback.player.current)
+            tracks.extend(playback.player.queue)
+        live.update(os.path.basename(track.uri) for track in tracks if track is not None and track.uri)
 
-    log.info("Cleaning up audio files.")
+        if playback.pipeline is not None:
+            for job in playback.pipeline.jobs:
+                task = job.task
+                if task is not None and task.done() and not task.cancelled() and task.exception() is None \
+                        and task.result() is not None:
+                    live.add(os.path.basename(task.result()))
 
-    for file in os.listdir(self.cog_path):
-        if file.endswith(".mp3"):
-            os.remove(self.cog_path / file)
-        if file.endswith(".wav"):
-            os.remove(self.cog_path / file)
+    return live
+
+
+def staging_dirs(self: TTSBase) -> list[str]:
+    """
+    Every folder new clips might have been staged in, the current one first. A clip left behind before the
+    staging mode changed is as much an orphan as one in the current folder.
+    """
+    directories = [os.path.dirname(self.audio_file_name), self.cog_path.as_posix(),
+                   audio_staging.tmpfs_dir(self.cog_path).as_posix()]
+    return list(dict.fromkeys(directories))
+
+
+async def reconcile_audio(self: TTSBase, min_age: float = ORPHAN_AGE) -> int:
+    """
+    Removes clips nothing is going to play anymore, left behind by a crash, a reload or a track that failed
+    to play. The folder is scanned and cleaned in worker threads, so thousands of stale files do not
+    block the event loop. Returns how many files were removed.
+    """
+    _, prefix = os.path.split(self.audio_file_name)
+    found = []
+    for directory in staging_dirs(self):
+        names = await asyncio.to_thread(scan_audio_files, directory, prefix, min_age)
+        found.extend(f"{directory}/{name}" for name in names)
+
+    # Worked out after the scan, so anything queued while we were scanning is kept
+    live = live_audio_files(self)
+    orphans = [path for path in found if os.path.basename(path) not in live]
+
+    for start in range(0, len(orphans), RECONCILE_BATCH):
+        await asyncio.to_thread(audio_cache.remove_files, orphans[start:start + RECONCILE_BATCH])
+
+    if orphans:
+        log.info(f"Cleaned up {len(orphans)} orphaned audio files.")
+
+    return len(orphans)
+
+
+async def delete_if_exists(file_path: str):
+    await asyncio.to_thread(remove_if_exists, file_path)
 
 
 async def delete_audio(file_path: str):
@@ -94,16 +584,119 @@ async def delete_audio(file_path: str):
     """
     await asyncio.to_thread(os.remove, file_path)
 
-async def send_voice_statistics(self: TTSBase, text, voice, server, code) -> None:
+
+async def release_audio(self: TTSBase, file_path: str):
+    """
+    Called once a clip is done playing, cached clips are kept for reuse and everything else is deleted.
+    """
+    if self.audio_cache.owns(file_path):
+        self.audio_cache.release(file_path)
+    elif self.audio_store is not None and self.audio_store.owns(file_path):
+        self.audio_store.remove(file_path)
+    else:
+        await delete_audio(file_path)
+
+
+def forget_clip(self: TTSBase, file_path: str):
+    # The audio cache got rid of a clip
+    self.track_cache.invalidate(file_path)
+
+    if self.audio_store is not None and self.audio_store.owns(file_path):
+        self.audio_store.remove(file_path)
+
+
+async def setup_staging(self: TTSBase):
+    """
+    Works out where new clips go for Lavalink to pick up, from the audio_staging global setting.
+    Anything that can't be set up falls back to the cog folder on disk.
+
+    The audio cache goes along with it, on tmpfs its folder moves there and in memory the store holds the
+    cached clips too. Call this before loading the cache.
+    """
+
+    mode = await self.config.audio_staging()
+    self.audio_file_name = (self.cog_path / "audio").as_posix()
+    self.audio_cache.path = self.cog_path / "audio_cache"
+    self.audio_store = None
+
+    if mode == "tmpfs":
+        path = await asyncio.to_thread(audio_staging.make_tmpfs_dir, self.cog_path)
+        if path is None:
+            log.warning(f"{audio_staging.TMPFS_PATH} is not available, staging TTS clips on disk instead.")
+        else:
+            self.audio_file_name = (path / "audio").as_posix()
+            self.audio_cache.path = path / "audio_cache"
+
+    elif mode == "memory":
+        # Room for the clips waiting to be played, and for the cached ones on top
+        max_bytes = await self.config.staging_memory_size() * 1024 * 1024 + self.audio_cache.max_bytes
+        store = audio_staging.MemoryAudioStore(max_bytes)
+        try:
+            await store.start(await self.config.staging_host(), await self.config.staging_port())
+        except OSError as err:
+            log.error(f"Could not start the TTS audio server, staging TTS clips on disk instead: {err!r}")
+        else:
+            self.audio_store = store
+
+async def send_voice_statistics(self: TTSBase, text, route: Route, code, timing: RequestTiming) -> None:
+    stats = self.backend_router.get_stats(route.backend, route.voice)
+
     statistics_event_tags = {
-        "voice": voice,
-        "server": server,
+        "voice": urllib.parse.quote_plus(route.voice),
+        "server": route.backend,
         "code": code
     }
 
     statistics_event_data = {
         "length": len(text),
         "message": text,
+        "connect": timing.connect_time,
+        "first_byte": timing.first_byte_time,
+        "body": timing.body_time,
+        "latency": timing.total_time,
+        "p50": stats.p50,
+        "p95": stats.p95,
+        "error_rate": stats.error_rate,
+    }
+
+    self.bot.dispatch("statistics_event", "tts_backend", statistics_event_tags, statistics_event_data)
+
+def send_hedge_statistics(self: TTSBase, primary: Route, backup: Route, winner: str) -> None:
+    statistics_event_tags = {
+        "primary": primary.backend,
+        "backup": backup.backend,
+        "winner": winner
+    }
+
+    statistics_event_data = {
+        "hedge_rate": self.backend_router.hedge_rate,
+        "win_rate": self.backend_router.hedge_win_rate,
+    }
+
+    self.bot.dispatch("statistics_event", "tts_hedge", statistics_event_tags, statistics_event_data)
+
+def send_processing_statistics(self: TTSBase, route: Route, ok: bool, latency: float) -> None:
+    statistics_event_tags = {
+        "server": route.backend,
+        "result": "ok" if ok else "error"
+    }
+
+    statistics_event_data = {
+        "latency": latency,
+    }
+
+    self.bot.dispatch("statistics_event", "tts_post_process", statistics_event_tags, statistics_event_data)
+
+def send_cache_statistics(self: TTSBase, server, hit: bool) -> None:
+    statistics_event_tags = {
+        "server": server,
+        "result": "hit" if hit else "miss"
+    }
+
+    statistics_event_data = {
+        "hit_ratio": self.audio_cache.hit_ratio,
+        "bytes_saved": self.audio_cache.bytes_saved,
+        "size": self.audio_cache.size,
     }
 
-    self.bot.dispatch("statistics_event", "tts_backend", statistics_event_tags, statistics_event_data)
\ No newline at end of file
+    self.bot.dispatch("statistics_event", "tts_cache", statistics_event_tags, statistics_event_data)
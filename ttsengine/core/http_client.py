@@ -0,0 +1,73 @@
+import time
+from types import SimpleNamespace
+
+import aiohttp
+
+# Both TTS backends are a single host each, so a handful of kept-alive connections per host is plenty.
+CONNECTION_LIMIT = 32
+CONNECTION_LIMIT_PER_HOST = 8
+KEEPALIVE_TIMEOUT = 60
+DNS_CACHE_TTL = 300
+
+
+class RequestTiming:
+    """
+    Timestamps of a single backend request, filled in by the session trace hooks.
+    Pass an instance as `trace_request_ctx` and call `finish` once the body has been read.
+    """
+    __slots__ = ("start", "connected", "first_byte", "done")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.connected = None
+        self.first_byte = None
+        self.done = None
+
+    def finish(self):
+        self.done = time.perf_counter()
+
+    @property
+    def connect_time(self) -> float:
+        # A reused keep-alive connection counts as connected straight away
+        return (self.connected or self.start) - self.start
+
+    @property
+    def first_byte_time(self) -> float:
+        return (self.first_byte or self.start) - (self.connected or self.start)
+
+    @property
+    def body_time(self) -> float:
+        return (self.done or self.start) - (self.first_byte or self.start)
+
+    @property
+    def total_time(self) -> float:
+        return (self.done or self.start) - self.start
+
+
+async def _on_connection_ready(session, context: SimpleNamespace, params):
+    if isinstance(context.trace_request_ctx, RequestTiming):
+        context.trace_request_ctx.connected = time.perf_counter()
+
+
+async def _on_request_end(session, context: SimpleNamespace, params):
+    if isinstance(context.trace_request_ctx, RequestTiming):
+        context.trace_request_ctx.first_byte = time.perf_counter()
+
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    Creates the long-lived session shared by all TTS backend requests.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=CONNECTION_LIMIT,
+        limit_per_host=CONNECTION_LIMIT_PER_HOST,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=DNS_CACHE_TTL,
+    )
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(_on_connection_ready)
+    trace_config.on_connection_reuseconn.append(_on_connection_ready)
+    trace_config.on_request_end.append(_on_request_end)
+
+    return aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
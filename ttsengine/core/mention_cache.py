@@ -0,0 +1,71 @@
+import logging
+from collections import OrderedDict
+
+import discord
+
+from ttsengine.core import text_filter
+
+log = logging.getLogger("red.mednis-cogs.poitranslator.mention_cache")
+
+# <@id> and <@!id> both point at a member
+MEMBER = "@"
+ROLE = "@&"
+CHANNEL = "#"
+
+
+class MentionCache:
+    """
+    What mentions are read out as, per guild, so a ping heavy channel is not doing a member/role/channel lookup
+    for every mention of every message.
+
+    Only mentions that resolved are cached, an unknown id might be a member that has not been cached by
+    discord.py yet. The cog invalidates entries from the member, role and channel update events.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._guilds: dict[int, OrderedDict[tuple[str, int], str]] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, guild: discord.Guild, kind: str, mention_id: int) -> str | None:
+        key = (MEMBER if kind == "@!" else kind, mention_id)
+        entries = self._guilds.get(guild.id)
+
+        if entries is not None:
+            spoken = entries.get(key)
+            if spoken is not None:
+                self.hits += 1
+                entries.move_to_end(key)
+                return spoken
+
+        self.misses += 1
+        spoken = text_filter.resolve_mention(guild, kind, mention_id)
+
+        if spoken is not None:
+            if entries is None:
+                entries = self._guilds[guild.id] = OrderedDict()
+            entries[key] = spoken
+
+            # Least recently used goes first
+            if len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+        return spoken
+
+    def invalidate(self, guild_id: int, kind: str, mention_id: int):
+        entries = self._guilds.get(guild_id)
+        if entries is not None:
+            entries.pop((kind, mention_id), None)
+
+    def invalidate_member(self, member_id: int):
+        # Global display name changes show up in every guild the user is in
+        for entries in self._guilds.values():
+            entries.pop((MEMBER, member_id), None)
+
+    def forget_guild(self, guild_id: int):
+        self._guilds.pop(guild_id, None)
+
+    def clear(self):
+        self._guilds.clear()
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+import shutil
+import uuid
+
+log = logging.getLogger("red.mednis-cogs.poitranslator.offline_tts")
+
+# Name of the backend in routes and statistics, next to "local" and "public"
+BACKEND = "offline"
+
+# Used for voices that have no offline voice configured
+DEFAULT_VOICE = "en"
+
+# Any single message taking longer than this has gone wrong
+SYNTHESIS_TIMEOUT = 30
+
+
+class OfflineEngine:
+    """
+    Something that can turn text into a wav file without the network, by running a program. Engines are created
+    from their name and should not hold any state they need from the cog.
+    """
+    name = ""
+    binary = ""
+
+    def available(self) -> bool:
+        return shutil.which(self.binary) is not None
+
+    def command(self, voice: str, path: str) -> list[str]:
+        # The text is sent to the program on stdin
+        raise NotImplementedError
+
+
+class EspeakEngine(OfflineEngine):
+    name = "espeak-ng"
+    binary = "espeak-ng"
+
+    def command(self, voice: str, path: str) -> list[str]:
+        # The text goes in on stdin, so a message starting with a dash is not read as an option
+        return [self.binary, "-v", voice, "-w", path, "--stdin"]
+
+
+ENGINES: dict[str, type[OfflineEngine]] = {
+    EspeakEngine.name: EspeakEngine,
+}
+
+
+def remove_if_exists(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class OfflineSynthesiser:
+    """
+    Runs an offline engine as a subprocess, so the CPU heavy part of synthesis never happens on the event loop,
+    and at most `workers` messages are synthesised at once.
+    """
+
+    def __init__(self, engine: str, workers: int):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown offline TTS engine {engine}, expected one of {', '.join(ENGINES)}.")
+
+        self.engine = engine
+        self.workers = max(workers, 1)
+        self._limit = asyncio.Semaphore(self.workers)
+        self._running: set[asyncio.subprocess.Process] = set()
+
+    def available(self) -> bool:
+        return ENGINES[self.engine]().available()
+
+    async def synthesise(self, voice: str, text: str, path: str):
+        # Same as the downloads, the clip only shows up under its real name once it is complete
+        temp_path = f"{path}.{uuid.uuid4()}.part"
+
+        try:
+            async with self._limit:
+                await self._run(ENGINES[self.engine]().command(voice, temp_path), text)
+        except asyncio.CancelledError:
+            await asyncio.shield(asyncio.to_thread(remove_if_exists, temp_path))
+            raise
+        except Exception as err:
+            await asyncio.to_thread(remove_if_exists, temp_path)
+            raise RuntimeError(f"Offline synthesis failed: {err!r}") from err
+
+        await asyncio.to_thread(os.replace, temp_path, path)
+
+    async def _run(self, command: list[str], text: str):
+        process = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.PIPE,
+                                                       stdout=asyncio.subprocess.DEVNULL,
+                                                       stderr=asyncio.subprocess.PIPE)
+        self._running.add(process)
+
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(text.encode("utf-8")), SYNTHESIS_TIMEOUT)
+        except BaseException:
+            # Timed out or cancelled, don't leave the engine running
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        finally:
+            self._running.discard(process)
+
+        if process.returncode != 0:
+            raise RuntimeError(f"{command[0]} exited with {process.returncode}: "
+                               f"{stderr.decode('utf-8', 'replace').strip()}")
+
+    def shutdown(self):
+        for process in self._running:
+            if process.returncode is None:
+                process.kill()
+        self._running.clear()
@@ -0,0 +1,259 @@
+import asyncio
+import bisect
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+import discord
+
+from ttsengine.core.settings import TTSGuildSettings, TTSMessage
+from ttsengine.core.trace import TTSTrace
+
+log = logging.getLogger("red.mednis-cogs.poitranslator.pipeline")
+
+# If Lavalink never tells us a clip finished (a lost event, a dropped connection), stop waiting for it after this long
+ROOM_TIMEOUT = 60
+
+# Bucket bounds of the queue depth and wait time histograms
+DEPTH_BUCKETS = (1, 2, 5, 10, 20, 50)
+WAIT_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60)
+
+
+class Histogram:
+    """
+    Sample counts per bucket, a sample goes in the first bucket whose bound it does not go over.
+    The last bucket has everything above the highest bound.
+    """
+    __slots__ = ("bounds", "counts")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+
+    def record(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+
+    def as_dict(self) -> dict[str, int]:
+        labels = [f"le_{bound}" for bound in self.bounds] + ["inf"]
+        return dict(zip(labels, self.counts))
+
+
+class TTSJob:
+    # A single message (or a few coalesced ones) on its way through the pipeline
+    __slots__ = ("message", "settings", "ttsmessage", "voice", "created", "ready_at", "expires_at", "started", "task",
+                 "trace")
+
+    def __init__(self, message: discord.Message, settings: TTSGuildSettings, ttsmessage: TTSMessage, voice: str,
+                 delay: float = 0, trace: TTSTrace | None = None):
+        self.message = message
+        self.settings = settings
+        self.ttsmessage = ttsmessage
+        self.voice = voice
+        self.created = time.perf_counter()
+        self.ready_at = self.created + delay  # Synthesis waits until then, so more messages can be coalesced
+        self.expires_at: float | None = None  # Not worth reading out after this, set on submit
+        self.started = False
+        self.task: asyncio.Task | None = None
+        self.trace = trace
+
+
+class TTSPipeline:
+    """
+    Synthesises the queued messages of one guild concurrently, and hands them to playback one user at a time.
+
+    At most `workers` synthesis requests run at once. Each user's messages are read out in the order they
+    arrived, but users take turns, so one person spamming does not hold up everyone else. When more than
+    `max_depth` messages are waiting, or one user has more than their share, the oldest ones are dropped,
+    and messages that waited too long are dropped too, so a burst of chat does not leave the voice channel
+    minutes behind.
+
+    Clips are only handed over while `has_room` says playback can take another one, so the queue stays here
+    where it can still be reordered. Call `notify` whenever a clip finishes playing.
+    """
+
+    def __init__(self, synthesise: Callable[[TTSJob], Awaitable[str | None]],
+                 play: Callable[[TTSJob, str], Awaitable[None]],
+                 release: Callable[[str], Awaitable[None]],
+                 workers: int,
+                 has_room: Callable[[], bool] | None = None):
+        self._synthesise = synthesise
+        self._play = play
+        self._release = release
+        self._has_room = has_room
+
+        self.semaphore = asyncio.Semaphore(workers)
+        self.jobs: deque[TTSJob] = deque()
+        self.dropped = 0
+        self.expired = 0
+        self.coalesced = 0
+
+        self.depth_histogram = Histogram(DEPTH_BUCKETS)
+        self.wait_histogram = Histogram(WAIT_BUCKETS)
+
+        self._room = asyncio.Event()
+        self._turn = 0
+        self._last_served: dict[int, int] = {}  # author id -> turn they were last read out on
+
+        self._runner: asyncio.Task | None = None
+
+    def submit(self, job: TTSJob, max_depth: int, max_per_user: int = 0, max_age: float = 0):
+        if max_age > 0:
+            job.expires_at = job.created + max_age
+
+        job.task = asyncio.create_task(self._run_synthesis(job))
+        self.jobs.append(job)
+
+        # One user can only have so many messages waiting, their oldest go first
+        if max_per_user > 0:
+            author_id = job.message.author.id
+            queued = [queued for queued in self.jobs if queued.message.author.id == author_id]
+
+            for old in queued[:-max_per_user]:
+                self.jobs.remove(old)
+                self.discard(old)
+                self.dropped += 1
+                log.info(f"User {author_id} has too many queued TTS messages, dropped their oldest.")
+
+        # Backpressure, the oldest messages are the least relevant by now
+        while len(self.jobs) > max(max_depth, 1):
+            self.discard(self.jobs.popleft())
+            self.dropped += 1
+            log.info("TTS queue is full, dropped the oldest message.")
+
+        self.depth_histogram.record(len(self.jobs))
+
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+
+    def pending_job(self, author_id: int) -> TTSJob | None:
+        """
+        The last queued job, if it is from this author and synthesis has not started on it yet.
+        """
+        if not self.jobs:
+            return None
+
+        job = self.jobs[-1]
+        if job.started or job.message.author.id != author_id:
+            return None
+
+        return job
+
+    def coalesce(self, job: TTSJob, text: str, window: float):
+        separator = " " if job.ttsmessage.text.endswith((".", "!", "?")) else ". "
+        job.ttsmessage.text = job.ttsmessage.text + separator + text
+
+        # Give the author another window to keep typing
+        job.ready_at = time.perf_counter() + window
+        self.coalesced += 1
+
+    def discard(self, job: TTSJob):
+        if job.task.done():
+            self._release_result(job.task)
+        else:
+            # Let it finish in the background if it is mid-write, we just don't want the clip anymore
+            job.task.cancel()
+            job.task.add_done_callback(self._release_result)
+
+    def _release_result(self, task: asyncio.Task):
+        if task.cancelled() or task.exception() is not None or task.result() is None:
+            return
+        asyncio.create_task(self._release(task.result()))
+
+    async def _run_synthesis(self, job: TTSJob) -> str | None:
+        # ready_at can move forward while we sleep if more messages get coalesced into the job
+        while (delay := job.ready_at - time.perf_counter()) > 0:
+            await asyncio.sleep(delay)
+
+        job.started = True
+
+        async with self.semaphore:
+            return await self._synthesise(job)
+
+    def notify(self):
+        # Playback might have room for another clip now
+        self._room.set()
+
+    async def _wait_for_room(self):
+        if self._has_room is None:
+            return
+
+        while not self._has_room():
+            self._room.clear()
+            try:
+                await asyncio.wait_for(self._room.wait(), ROOM_TIMEOUT)
+            except asyncio.TimeoutError:
+                log.warning("Playback has not finished a TTS clip in a while, queueing the next one anyway.")
+                return
+
+    def _next_job(self) -> TTSJob | None:
+        now = time.perf_counter()
+
+        # Too old to be worth reading out anymore
+        for job in [job for job in self.jobs if job.expires_at is not None and now > job.expires_at]:
+            self.jobs.remove(job)
+            self.discard(job)
+            self.expired += 1
+
+        if not self.jobs:
+            return None
+
+        # The oldest message of every user, whoever was read out least recently goes next
+        heads: dict[int, TTSJob] = {}
+        for job in self.jobs:
+            heads.setdefault(job.message.author.id, job)
+
+        job = min(heads.values(), key=lambda head: (self._last_served.get(head.message.author.id, -1), head.created))
+
+        self._turn += 1
+        self._last_served[job.message.author.id] = self._turn
+
+        # Forget users that have been quiet, they lose nothing since their turn is long past
+        if len(self._last_served) > 256:
+            self._last_served = {author_id: turn for author_id, turn in self._last_served.items()
+                                 if author_id in heads}
+
+        return job
+
+    async def _run(self):
+        while self.jobs:
+            # Only pick the next message once playback can take it, anything that arrives meanwhile gets a fair go
+            await self._wait_for_room()
+
+            job = self._next_job()
+            if job is None:
+                continue
+
+            # Wait without letting a cancelled job cancel the runner itself
+            await asyncio.wait([job.task])
+
+            # The job might have been dropped while we were waiting
+            if job in self.jobs:
+                self.jobs.remove(job)
+            else:
+                continue
+
+            if job.task.cancelled():
+                continue
+
+            if job.task.exception() is not None:
+                log.error("TTS synthesis failed", exc_info=job.task.exception())
+                continue
+
+            file_path = job.task.result()
+            if file_path is None:
+                continue
+
+            self.wait_histogram.record(time.perf_counter() - job.created)
+
+            try:
+                await self._play(job, file_path)
+            except Exception:
+                log.exception("Failed to play TTS message")
+
+    def close(self):
+        if self._runner is not None:
+            self._runner.cancel()
+
+        while self.jobs:
+            self.discard(self.jobs.popleft())
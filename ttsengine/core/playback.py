@@ -0,0 +1,77 @@
+import time
+from collections import deque
+from enum import Enum
+from typing import NamedTuple
+
+import lavalink
+
+from ttsengine.core.pipeline import TTSPipeline
+from ttsengine.core.trace import TTSTrace
+
+
+class NonTTSTrack(NamedTuple):
+    # This sorts track information for non-tts tracks
+    track: lavalink.Track
+    position: int
+    was_paused: bool
+    volume: int
+
+
+class InterruptState(Enum):
+    PLAYING_TTS = "playing_tts"  # The music is waiting in the queue behind the TTS clips
+    RESUMING = "resuming"  # The last clip ended, the music is on its way back
+
+
+class Interruption:
+    """
+    A music track we stopped to play TTS, and how far along putting it back we are. Goes from PLAYING_TTS to
+    RESUMING once the last clip ends, and is dropped once the music starts again.
+    """
+    __slots__ = ("saved", "state", "interrupted_at", "resume_started", "updates")
+
+    def __init__(self, saved: NonTTSTrack):
+        self.saved = saved
+        self.state = InterruptState.PLAYING_TTS
+        self.interrupted_at = time.perf_counter()
+        self.resume_started: float | None = None
+        self.updates = 0  # Player updates we sent to put the music back, on top of Lavalink starting it
+
+    def matches(self, track: lavalink.Track | None) -> bool:
+        return track is not None and track.track_identifier == self.saved.track.track_identifier
+
+
+class GuildPlayback:
+    """
+    The TTS playback state of a single guild: its Lavalink player, the TTS tracks queued on it and
+    the music track we interrupted to play them.
+    """
+
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+
+        self.player: lavalink.Player | None = None  # The lavalink player.
+        self.tts_queue: list[str] = []  # Track identifiers of the tts messages to be played.
+        self.current_track: lavalink.Track | None = None  # The current track that is playing.
+        self.interruption: Interruption | None = None  # The music that was playing before TTS was started.
+        self.pipeline: TTSPipeline | None = None  # Messages being synthesised, created on the first message.
+        self.traces: dict[str, deque[TTSTrace]] = {}  # Track identifier -> traces of the messages waiting to start.
+
+    def is_tts_track(self, track: lavalink.Track | None) -> bool:
+        return track is not None and track.track_identifier in self.tts_queue
+
+    def add_trace(self, track_identifier: str, trace: TTSTrace):
+        # The same cached clip queued twice has the same identifier, they start in the order they were queued
+        self.traces.setdefault(track_identifier, deque()).append(trace)
+
+    def pop_trace(self, track: lavalink.Track | None) -> TTSTrace | None:
+        if track is None:
+            return None
+
+        traces = self.traces.get(track.track_identifier)
+        if not traces:
+            return None
+
+        trace = traces.popleft()
+        if not traces:
+            del self.traces[track.track_identifier]
+        return trace
@@ -1,4 +1,8 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ttsengine.core.text_filter import WordReplacer
 
 @dataclass
 class TTSGuildSettings:
@@ -10,22 +14,38 @@ class TTSGuildSettings:
     name_replacements: dict
     word_replacements: dict
     command_prefixes: list
+    max_queued_messages: int = 10
+    coalesce_window: float = 0
+    filter_engine: str = "classic"
+    max_user_messages: int = 3
+    max_message_age: float = 60
+
+    # Compiled word replacements, built by text_filter.get_word_replacer on first use
+    word_replacer: "WordReplacer | None" = field(default=None, init=False, repr=False, compare=False)
 
     @classmethod
     async def from_config(cls, config, guild):
+        # A single read of the whole guild scope instead of one awaited read per setting
+        data = await config.guild(guild).all()
+
         return cls(
-            say_name=await config.guild(guild).say_name(),
-            max_message_length=await config.guild(guild).max_message_length(),
-            max_word_length=await config.guild(guild).max_word_length(),
-            repeated_word_percentage=await config.guild(guild).repeated_word_percentage(),
-            global_tts_volume=await config.guild(guild).global_tts_volume(),
-            name_replacements=await config.guild(guild).name_replacements(),
-            word_replacements=await config.guild(guild).word_replacements(),
-            command_prefixes=await config.guild(guild).command_prefixes(),
+            say_name=data["say_name"],
+            max_message_length=data["max_message_length"],
+            max_word_length=data["max_word_length"],
+            repeated_word_percentage=data["repeated_word_percentage"],
+            global_tts_volume=data["global_tts_volume"],
+            name_replacements=data["name_replacements"],
+            word_replacements=data["word_replacements"],
+            command_prefixes=data["command_prefixes"],
+            max_queued_messages=data["max_queued_messages"],
+            coalesce_window=data["coalesce_window"],
+            filter_engine=data["filter_engine"],
+            max_user_messages=data["max_user_messages"],
+            max_message_age=data["max_message_age"],
         )
 
 
 @dataclass
 class TTSMessage:
     text: str
-    track_name: str
\ No newline at end of file
+    track_name: str
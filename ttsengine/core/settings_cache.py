@@ -0,0 +1,93 @@
+import logging
+
+import discord
+from redbot.core.config import Config
+
+from ttsengine.core.settings import TTSGuildSettings
+
+log = logging.getLogger("red.mednis-cogs.poitranslator.settings_cache")
+
+
+class GuildSettingsCache:
+    """
+    Keeps an in-memory TTSGuildSettings snapshot per guild, so the message hot path does not touch Config.
+
+    Any command that changes a guild setting has to call `invalidate` for that guild, the next message
+    will then load a fresh snapshot.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self._snapshots: dict[int, TTSGuildSettings] = {}
+
+        # Bumped on every invalidation, so a load that raced with a settings change is not stored.
+        self._generations: dict[int, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, guild: discord.Guild) -> TTSGuildSettings:
+        snapshot = self._snapshots.get(guild.id)
+
+        if snapshot is not None:
+            self.hits += 1
+            return snapshot
+
+        self.misses += 1
+        generation = self._generations.get(guild.id, 0)
+
+        snapshot = await TTSGuildSettings.from_config(self.config, guild)
+
+        # Only store the snapshot if the settings were not changed while we were loading them
+        if self._generations.get(guild.id, 0) == generation:
+            self._snapshots[guild.id] = snapshot
+
+        return snapshot
+
+    def invalidate(self, guild_id: int):
+        self._generations[guild_id] = self._generations.get(guild_id, 0) + 1
+        self._snapshots.pop(guild_id, None)
+
+    def clear(self):
+        for guild_id in list(self._snapshots):
+            self.invalidate(guild_id)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class GuildMembershipIndex:
+    """
+    Whitelisted channels and blacklisted users for every guild as frozensets.
+
+    Loaded once on cog load and kept up to date by the whitelist and blacklist commands, so on_message
+    can drop non-TTS traffic without awaiting anything.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self._whitelists: dict[int, frozenset[int]] = {}
+        self._blacklists: dict[int, frozenset[int]] = {}
+
+    async def load(self):
+        guilds = await self.config.all_guilds()
+
+        for guild_id, data in guilds.items():
+            self.set_whitelist(guild_id, data["whitelisted_channels"])
+            self.set_blacklist(guild_id, data["blacklisted_users"])
+
+        log.info(f"Loaded TTS channel whitelists for {len(self._whitelists)} guilds.")
+
+    def set_whitelist(self, guild_id: int, channel_ids):
+        self._whitelists[guild_id] = frozenset(channel_ids)
+
+    def set_blacklist(self, guild_id: int, user_ids):
+        self._blacklists[guild_id] = frozenset(user_ids)
+
+    def is_whitelisted(self, guild_id: int, channel_id: int) -> bool:
+        return channel_id in self._whitelists.get(guild_id, ())
+
+    def is_blacklisted(self, guild_id: int, user_id: int) -> bool:
+        return user_id in self._blacklists.get(guild_id, ())
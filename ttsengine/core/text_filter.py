@@ -1,18 +1,218 @@
 import re
+from typing import TYPE_CHECKING
 
 import discord
 from ttsengine.core.settings import TTSGuildSettings, TTSMessage
 import random
 import emoji
 
+if TYPE_CHECKING:
+    from ttsengine.core.mention_cache import MentionCache
+
+# All patterns are compiled once on import instead of on every message
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+MENTION_PATTERN = re.compile(r"<(@!?|@&|#)(\d+)>")
+CUSTOM_EMOTE_PATTERN = re.compile(r'<a?:(\w+):\d+>')
+EMOJI_NAME_PATTERN = re.compile(r':([a-zA-Z0-9_]+):')
+MULTIPLE_SPACES_PATTERN = re.compile(r' {2,}')
+SPOILER_PATTERN = re.compile(r'\|\|(.*?)\|\|', flags=re.DOTALL)
+URL_PATTERN = re.compile(r"https?://\S+")
+REPEATED_LETTER_PATTERN = re.compile(r"([a-zA-Z])\1{2,}")
+
+# Everything the tokenized engine treats as a span of its own, the rest of the message is plain text
+TOKEN_PATTERN = re.compile(
+    r"<(?P<kind>@!?|@&|#)(?P<id>\d+)>"
+    r"|<a?:(?P<emote>\w+):\d+>"
+    r"|(?P<url>https?://\S+)"
+    r"|(?P<spoiler>\|\|.*?\|\|)",
+    flags=re.DOTALL
+)
+
+FILTER_ENGINES = ("classic", "tokenized")
+
+# Word replacements made of nothing but letters and digits are looked up word by word
+WORD_KEY_PATTERN = re.compile(r"\w+")
+WORD_PATTERN = r"(?P<word>\w+)(?P<word_suffix>'s\b)?"
+
+
+class WordReplacer:
+    """
+    All word replacements of a guild. The text is split into words once and each word is looked up, so the cost
+    of a message doesn't depend on how many replacements there are. Only the few replacements with something
+    other than letters and digits in them need to be matched by a regex of their own.
+    """
+
+    def __init__(self, replacements: dict):
+        # Matching is case-insensitive, the first replacement for a word wins like it did when they were applied
+        # one after the other.
+        self.lookup = {}
+        special = []
+        for pattern, replacement in replacements.items():
+            if pattern and pattern.casefold() not in self.lookup:
+                self.lookup[pattern.casefold()] = replacement
+                if not WORD_KEY_PATTERN.fullmatch(pattern):
+                    special.append(pattern)
+
+        # Every word that has a replacement, with and without an s on the end
+        special_keys = {pattern.casefold() for pattern in special}
+        self.word_keys = {key + suffix for key in self.lookup if key not in special_keys for suffix in ("", "s")}
+
+        parts = []
+        self.special_pattern = None
+        if special:
+            # Longest first, so a replacement for "lol" does not stop one for "lol!" from matching
+            alternation = "|".join(re.escape(pattern) for pattern in sorted(special, key=len, reverse=True))
+
+            # Match the pattern with optional 's or s at the end
+            parts.append(r"\b(?P<special>" + alternation + r")(?P<special_suffix>(?:'s|s)?)\b")
+            self.special_pattern = re.compile(parts[0], flags=re.IGNORECASE)
+
+        if self.word_keys:
+            parts.append(WORD_PATTERN)
+
+        self.pattern = re.compile("|".join(parts), flags=re.IGNORECASE) if parts else None
+
+    def _replace(self, match: re.Match) -> str:
+        # There is no word group at all when every replacement has punctuation in it
+        word = match.groupdict().get("word")
+
+        if word is None:
+            # IGNORECASE matches a few characters that casefold() doesn't map to the key, leave those as they are
+            replacement = self.lookup.get(match.group("special").casefold())
+            if replacement is None:
+                return match.group(0)
+            return replacement + match.group("special_suffix")
+
+        # Keep the 's suffix
+        suffix = match.group("word_suffix") or ""
+
+        replacement = self.lookup.get(word.casefold())
+        if replacement is not None:
+            return replacement + suffix
+
+        # Or the s, "lols" is "lol" with an s on the end
+        if len(word) > 1 and word[-1] in "sS":
+            replacement = self.lookup.get(word[:-1].casefold())
+            if replacement is not None:
+                return replacement + word[-1] + suffix
+
+        return match.group(0)
+
+    def replace(self, text: str) -> str:
+        if self.pattern is None:
+            return text
+
+        # Most messages have nothing to replace, finding that out doesn't need a call for every word
+        if self.word_keys.isdisjoint(WORD_KEY_PATTERN.findall(text.casefold())) \
+                and (self.special_pattern is None or self.special_pattern.search(text) is None):
+            return text
+
+        return self.pattern.sub(self._replace, text)
+
+
+class EmojiTable:
+    """
+    Every unicode emoji and the :short_code: emoji.demojize would turn it into, so a message can be demojized
+    with one regex scan for runs of emoji characters and a few dict lookups per run.
+    """
+
+    def __init__(self):
+        emoji.config.load_language("en")
+
+        # An emoji without an English name is left as it is, like demojize does
+        self.names = {emj: data.get("en", emj) for emj, data in emoji.EMOJI_DATA.items()}
+
+        # demojize walks a trie and gives up on a sequence that stops halfway, so we need to know every prefix
+        self.prefixes = {emj[:length] for emj in self.names for length in range(1, len(emj) + 1)}
+
+        # Emoji live in a handful of blocks, close enough code points are merged into one range to keep the
+        # character class short. Anything that isn't an emoji in there just gets passed through.
+        code_points = sorted({ord(char) for emj in self.names for char in emj if not char.isascii()}
+                             | {0xFE0E, 0xFE0F})
+        ranges = [[code_points[0], code_points[0]]]
+        for code_point in code_points[1:]:
+            if code_point - ranges[-1][1] <= 64:
+                ranges[-1][1] = code_point
+            else:
+                ranges.append([code_point, code_point])
+
+        character_class = "".join(f"{re.escape(chr(start))}-{re.escape(chr(end))}" for start, end in ranges)
+
+        # Keycaps are the only emoji that start with an ASCII character
+        self.pattern = re.compile(f"(?:[#*0-9](?=[\\ufe0f\\u20e3])|[{character_class}])+")
+
+    def _replace_run(self, match: re.Match) -> str:
+        run = match.group()
+
+        name = self.names.get(run)
+        if name is not None:
+            return name
+
+        pieces = []
+        start = 0
+        while start < len(run):
+            # Longest sequence the trie in demojize would follow from here
+            end = start + 1
+            while end < len(run) and run[start:end + 1] in self.prefixes:
+                end += 1
+
+            name = self.names.get(run[start:end])
+            if name is not None:
+                pieces.append(name)
+                start = end
+            else:
+                # Variation selectors that aren't part of an emoji are dropped
+                if run[start] not in "\ufe0e\ufe0f":
+                    pieces.append(run[start])
+                start += 1
+
+        return "".join(pieces)
+
+    def demojize(self, text: str) -> str:
+        # ZWJ sequences that aren't a known emoji get pulled apart in ways of their own, leave those to demojize
+        if "\u200d" in text:
+            return emoji.demojize(text, language='en')
+        return self.pattern.sub(self._replace_run, text)
 
-async def filter_and_format_message(message: discord.Message, settings: TTSGuildSettings)-> TTSMessage|None:
+
+_emoji_table: EmojiTable | None = None
+
+
+def get_emoji_table() -> EmojiTable:
+    # Built on first use, the cog builds it in a thread when it loads
+    global _emoji_table
+    if _emoji_table is None:
+        _emoji_table = EmojiTable()
+    return _emoji_table
+
+
+def demojize(text: str) -> str:
+    # Emoji are never plain ASCII, so most messages can skip this entirely
+    if text.isascii():
+        return text
+    return get_emoji_table().demojize(text)
+
+
+def get_word_replacer(settings: TTSGuildSettings) -> WordReplacer:
+    # Built once per settings snapshot, the snapshot is replaced whenever the substitutions change
+    if settings.word_replacer is None:
+        settings.word_replacer = WordReplacer(settings.word_replacements)
+    return settings.word_replacer
+
+
+async def filter_and_format_message(message: discord.Message, settings: TTSGuildSettings,
+                                    mentions: "MentionCache | None" = None,
+                                    say_name: bool | None = None) -> TTSMessage|None:
+
+    # say_name overrides the guild setting for this message only
+    if say_name is None:
+        say_name = settings.say_name
 
     prefix = ""
     postfix = ""
     says = True
 
-    if settings.say_name:
+    if say_name:
 
         # Certain authors may not have a nick
         if getattr(message.author, 'nick', None):
@@ -34,13 +234,13 @@ async def filter_and_format_message(message: discord.Message, settings: TTSGuild
 
     # Forwarded messages can just be clobbered to "forwarded a message"
     if message.message_snapshots:
-        if settings.say_name:
+        if say_name:
             return TTSMessage(text=f"{prefix} forwarded a message", track_name=track_name)
         else:
             return None
 
     # Do all the fancy text filtering and replacements
-    text = await filter_message(text=message.content, settings=settings, guild=message.guild)
+    text = await filter_message(text=message.content, settings=settings, guild=message.guild, mentions=mentions)
 
     if message.attachments:
         media_type = message.attachments[0].content_type.split("/", 1)[0]
@@ -95,7 +295,7 @@ async def filter_and_format_message(message: discord.Message, settings: TTSGuild
 
 def repeated_word_filter(text: str) -> float:
     # Strip punctuation and normalize case
-    words = re.sub(r"[^\w\s]", "", text.lower()).split()
+    words = PUNCTUATION_PATTERN.sub("", text.lower()).split()
 
     if not words:
         return 0.0
@@ -117,69 +317,81 @@ def long_word_filter(text: str, length):
     return False
 
 
-def mention_filter(text: str, guild: discord.Guild):
-    mentions = re.findall(r"<(@!?\d+|@&\d+|#\d+)>", text)
-    for mention in mentions:
-        full_mention = f"<{mention}>"
-        id_part = int(re.findall(r"\d+", mention)[0])
-
-        if mention.startswith("@&"):
-            role = guild.get_role(id_part)
-            if role:
-                text = text.replace(full_mention, f"at {role.name}")
-        elif mention.startswith("#"):
-            channel = guild.get_channel(id_part)
-            if channel:
-                text = text.replace(full_mention, f"in {channel.name}")
-        else:
-            user = guild.get_member(id_part)
-            if user:
-                if getattr(user, 'nick', None):
-                    name = user.nick
-                else:
-                    name = user.display_name
-                text = text.replace(full_mention, f"to {name}")
+def resolve_mention(guild: discord.Guild, kind: str, mention_id: int) -> str | None:
+    # What a mention is read out as, None if it points at something we can't find
+    if kind == "@&":
+        role = guild.get_role(mention_id)
+        if role:
+            return f"at {role.name}"
+    elif kind == "#":
+        channel = guild.get_channel(mention_id)
+        if channel:
+            return f"in {channel.name}"
+    else:
+        user = guild.get_member(mention_id)
+        if user:
+            if getattr(user, 'nick', None):
+                name = user.nick
+            else:
+                name = user.display_name
+            return f"to {name}"
 
-    return text
+    return None
+
+
+def mention_filter(text: str, guild: discord.Guild, mentions: "MentionCache | None" = None):
+    # One pass over the text, whatever the number of mentions
+    def replace(match: re.Match) -> str:
+        spoken = resolve_guild_mention(guild, match.group(1), int(match.group(2)), mentions)
+        return spoken or match.group()
+
+    return MENTION_PATTERN.sub(replace, text)
+
+
+def resolve_guild_mention(guild: discord.Guild, kind: str, mention_id: int,
+                          mentions: "MentionCache | None") -> str | None:
+    if mentions is None:
+        return resolve_mention(guild, kind, mention_id)
+    return mentions.get(guild, kind, mention_id)
+
+
+def speak_emoji_name(match: re.Match) -> str:
+    # :emoji_name: becomes "emoji name ", the space keeps it apart from the next word
+    return match.group(1).replace('_', ' ') + ' '
 
 
 def emoji_textifier(text: str):
 
     # Process custom emotes first, replacing them with their names without the colons
     # Animated emotes can also start with <a:
-    emote_pattern = r'<a?:(\w+):\d+>'
-    text = re.sub(emote_pattern, lambda match: match.group(1), text)
+    text = CUSTOM_EMOTE_PATTERN.sub(lambda match: match.group(1), text)
 
     # Convert emojis to their text representation i.e :heart:
-    text = emoji.demojize(text, language='en')
+    text = demojize(text)
 
     # Process the demojized text to replace :emoji_name: with "emoji name"
     # Also add a space after the emoji name to ensure proper separation in TTS
-    text = re.sub(r':([a-zA-Z0-9_]+):', lambda m: m.group(1).replace('_', ' ') + ' ', text)
+    text = EMOJI_NAME_PATTERN.sub(speak_emoji_name, text)
 
     # Now we deal with the whitespace
     text = text.strip()
 
     # Sometimes we might end up adding an aditional space to a emoji that is spaced
     # We check for that and replace them with one space to avoid weird TTS pauses
-    text = re.sub(r' {2,}', ' ', text)
+    text = MULTIPLE_SPACES_PATTERN.sub(' ', text)
 
     return text
 
 
 def filter_spoilers(text: str):
-    spoiler_pattern = r'\|\|(.*?)\|\|'
-    text = re.sub(spoiler_pattern, "spoiler", text, flags=re.DOTALL)
+    text = SPOILER_PATTERN.sub("spoiler", text)
 
     return text
 
 
 def link_filter(text: str):
-    # Regular expression pattern to match URLs
-    url_pattern = re.compile(r"https?://\S+")
-
     # Remove URLs from the text
-    text_without_links = re.sub(url_pattern, 'Link', text)
+    text_without_links = URL_PATTERN.sub('Link', text)
 
     return text_without_links
 
@@ -196,18 +408,7 @@ def remove_characters(text: str):
 
 def fixup_text(text: str, replacements: dict) -> str:
     # Replace certain message patterns with more readable ones
-    for pattern, replacement in replacements.items():
-        # Regular expression to match the pattern with optional 's or s at the end
-        regex_pattern = r'\b' + re.escape(pattern) + r"(?:'s|s)?\b"
-
-        # Function to perform the replacement while keeping the 's or s suffix
-        def replace_with_suffix(match):
-            suffix = match.group(0)[len(pattern):]  # Extract the suffix ('s or s)
-            return replacement + suffix
-
-        text = re.sub(regex_pattern, replace_with_suffix, text, flags=re.IGNORECASE)
-
-    return text
+    return WordReplacer(replacements).replace(text)
 
 
 def fixup_name(text: str, name_replacements: dict) -> str:
@@ -218,7 +419,7 @@ def fixup_name(text: str, name_replacements: dict) -> str:
 
 def repeated_letter_fix(string):
     # This regex matches any letter that repeats 3 or more times consecutively.
-    return re.sub(r"([a-zA-Z])\1{2,}", r"\1\1", string)
+    return REPEATED_LETTER_PATTERN.sub(r"\1\1", string)
 
 # Ignore commands that start with the command prefix
 def command_ignore_filter(text: str, command_prefixes: list):
@@ -230,7 +431,104 @@ def command_ignore_filter(text: str, command_prefixes: list):
                 return ""
     return text
 
-async def filter_message(text: str, *, settings: TTSGuildSettings,  guild: discord.Guild) -> str:
+def textify_span(text: str) -> str:
+    # The emoji part of emoji_textifier, for a piece of plain text
+    text = demojize(text)
+    if ":" in text:
+        text = EMOJI_NAME_PATTERN.sub(speak_emoji_name, text)
+    return text
+
+
+def tokenized_filter(text: str, guild: discord.Guild, mentions: "MentionCache | None" = None) -> str | None:
+    """
+    Does what mention_filter, emoji_textifier, link_filter, remove_characters and filter_spoilers do one after
+    the other, but with a single walk over the tokens of the message.
+
+    The classic stages can feed into each other (a nickname with a spoiler in it, a link with an emoji in it,
+    a colon next to an emote). When the message has anything like that, None is returned and the classic
+    stages should be used, so the output is always the same as theirs.
+    """
+    # Links can swallow the end of a spoiler
+    if "||" in text and "http" in text:
+        return None
+
+    # demojize drops variation selectors, which can join up a spoiler or a link the tokens never saw
+    if "\ufe0f" in text or "\ufe0e" in text:
+        if "|" in text:
+            return None
+        joined = text.replace("\ufe0f", "").replace("\ufe0e", "")
+        if "://" in joined and URL_PATTERN.findall(joined) != URL_PATTERN.findall(text):
+            return None
+
+    pieces = []
+    position = 0
+    after_token = False
+
+    for match in TOKEN_PATTERN.finditer(text):
+        if match.start() > position:
+            span = text[position:match.start()]
+
+            # Could be the rest of an emoji that started in whatever the token turns into
+            if after_token and not span[0].isascii():
+                return None
+
+            pieces.append(textify_span(span))
+
+        token = match.lastgroup
+        if token == "id":
+            spoken = resolve_guild_mention(guild, match.group("kind"), int(match.group("id")), mentions)
+
+            if spoken is None:
+                pieces.append(match.group())
+            elif "<" in spoken or "|" in spoken:
+                # A name that the later stages would pick apart
+                return None
+            else:
+                pieces.append(textify_span(spoken))
+
+        elif token == "emote":
+            pieces.append(match.group("emote"))
+
+        elif token == "url":
+            url = match.group()
+
+            # Something the earlier stages would have changed inside the link
+            if "<" in url or url.count(":") > 1 or not url.isascii():
+                return None
+
+            pieces.append("Link")
+
+        else:
+            # The classic stages would look for mentions inside the spoiler first
+            if "<" in match.group():
+                return None
+
+            pieces.append("spoiler")
+
+        position = match.end()
+        after_token = True
+
+    if position < len(text):
+        span = text[position:]
+        if after_token and not span[0].isascii():
+            return None
+        pieces.append(textify_span(span))
+
+    filtered = "".join(pieces)
+
+    # Any colon left over could have paired up with one from another piece
+    if ":" in filtered:
+        return None
+
+    filtered = filtered.strip()
+    if "  " in filtered:
+        filtered = MULTIPLE_SPACES_PATTERN.sub(" ", filtered)
+
+    return filtered.replace("/", " ").replace("_", " ")
+
+
+async def filter_message(text: str, *, settings: TTSGuildSettings,  guild: discord.Guild,
+                         mentions: "MentionCache | None" = None) -> str:
 
     # Remove random spaces
     filtered = text.strip()
@@ -247,22 +545,29 @@ async def filter_message(text: str, *, settings: TTSGuildSettings,  guild: disco
         return ""
 
     # Replace certain message patterns with more readable ones
-    filtered = fixup_text(filtered, settings.word_replacements)
+    filtered = get_word_replacer(settings).replace(filtered)
 
-    # Replace mentions with the user's name
-    filtered = mention_filter(filtered, guild)
+    tokenized = None
+    if settings.filter_engine == "tokenized":
+        tokenized = tokenized_filter(filtered, guild, mentions)
+
+    if tokenized is not None:
+        filtered = tokenized
+    else:
+        # Replace mentions with the user's name
+        filtered = mention_filter(filtered, guild, mentions)
 
-    # Replace emotes with their text meanings
-    filtered = emoji_textifier(filtered)
+        # Replace emotes with their text meanings
+        filtered = emoji_textifier(filtered)
 
-    # Remove links
-    filtered = link_filter(filtered)
+        # Remove links
+        filtered = link_filter(filtered)
 
-    # Remove characters that cause issues
-    filtered = remove_characters(filtered)
+        # Remove characters that cause issues
+        filtered = remove_characters(filtered)
 
-    # Remove spoilers
-    filtered = filter_spoilers(filtered)
+        # Remove spoilers
+        filtered = filter_spoilers(filtered)
 
     # Clear message if it contains too long of a word
     if long_word_filter(filtered, settings.max_word_length):
@@ -0,0 +1,54 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# The trace of the message being worked on, so deep down code like the file writes can add to it
+current_trace: ContextVar["TTSTrace | None"] = ContextVar("current_trace", default=None)
+
+
+class TTSTrace:
+    """
+    Where the time goes for one message, from receiving it to Lavalink starting to play it.
+
+    `lap` closes the stage that has been running since the previous lap, so the laps add up to the total.
+    `span` times something inside a stage (writing the file, loading the track) on top of that.
+    """
+    __slots__ = ("start", "last", "spans")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.spans: dict[str, float] = {}
+
+    def lap(self, name: str):
+        now = time.perf_counter()
+        self.add(name, now - self.last)
+        self.last = now
+
+    def add(self, name: str, duration: float):
+        # A hedged download can write twice, that all counts
+        self.spans[name] = self.spans.get(name, 0.0) + duration
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    @property
+    def total(self) -> float:
+        return self.last - self.start
+
+
+@contextmanager
+def span(name: str):
+    # Times into the current message's trace, if there is one
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    with trace.span(name):
+        yield
@@ -0,0 +1,57 @@
+import copy
+import logging
+
+import lavalink
+
+from ttsengine.core.backend_router import LatencyStats
+
+log = logging.getLogger("red.mednis-cogs.poitranslator.track_cache")
+
+
+def node_name(player: lavalink.Player) -> str:
+    return f"{player.node.host}:{player.node.port}"
+
+
+class TrackCache:
+    """
+    The Lavalink tracks of clips in the audio cache, so playing a cached clip again does not need a
+    load_tracks round trip to the node. Entries go when the audio cache gets rid of the clip.
+
+    Also keeps the load_tracks latency of each node, to tell Lavalink delay apart from synthesis delay.
+    """
+
+    def __init__(self):
+        self._tracks: dict[str, dict[str, lavalink.Track]] = {}  # file path -> node -> track
+        self.load_stats: dict[str, LatencyStats] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, node: str, file_path: str) -> lavalink.Track | None:
+        track = self._tracks.get(file_path, {}).get(node)
+
+        if track is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        # Each queued copy gets its own title and position, the cached one stays as loaded
+        return copy.copy(track)
+
+    def add(self, node: str, file_path: str, track: lavalink.Track):
+        self._tracks.setdefault(file_path, {})[node] = copy.copy(track)
+
+    def invalidate(self, file_path: str):
+        self._tracks.pop(file_path, None)
+
+    def clear(self):
+        self._tracks.clear()
+
+    def get_load_stats(self, node: str) -> LatencyStats:
+        stats = self.load_stats.get(node)
+        if stats is None:
+            stats = self.load_stats[node] = LatencyStats()
+        return stats
+
+    def record_load(self, node: str, latency: float, ok: bool):
+        self.get_load_stats(node).record(latency, ok)
@@ -1,3 +1,4 @@
+import functools
 import logging
 import time
 
@@ -5,57 +6,124 @@ import discord
 
 from ttsengine.core import audio_manager, file_manager, text_filter
 from ttsengine.core.base import TTSBase
+from ttsengine.core.pipeline import TTSJob, TTSPipeline
 from ttsengine.core.settings import TTSGuildSettings
+from ttsengine.core.trace import TTSTrace, current_trace
 
 log = logging.getLogger("red.mednis-cogs.poitranslator.tts_generator")
 
 
-async def generate_tts(self: TTSBase, message: discord.Message):
+async def generate_tts(self: TTSBase, message: discord.Message, tts_guild_settings: TTSGuildSettings,
+                       trace: TTSTrace | None = None):
+    if trace is None:
+        trace = TTSTrace()
 
-    tts_guild_settings = await TTSGuildSettings.from_config(self.config, message.guild)
+    pipeline = await get_pipeline(self, message.guild.id)
 
-    ttsmessage = await text_filter.filter_and_format_message(message, tts_guild_settings)
+    if tts_guild_settings.coalesce_window > 0:
+        job = pipeline.pending_job(message.author.id)
+
+        # The author has a message that is still waiting, read this one out as part of it
+        if job is not None:
+            # Without the name, so it is only said once at the start
+            continuation = await text_filter.filter_and_format_message(
+                message, tts_guild_settings, self.mention_cache, say_name=False
+            )
+
+            if continuation is None:
+                return
+
+            # Don't let a chatty user build one never ending message
+            if len(job.ttsmessage.text) + len(continuation.text) <= tts_guild_settings.max_message_length:
+                pipeline.coalesce(job, continuation.text, tts_guild_settings.coalesce_window)
+                return
+
+    ttsmessage = await text_filter.filter_and_format_message(message, tts_guild_settings, self.mention_cache)
 
     if ttsmessage is None:
         log.info(f"Message from user {message.author.id} was filtered and will not be converted to TTS.")
         return
 
-    voice = await self.config.user(message.author).voice()
+    trace.lap("filter")
 
-    try:
-        if await self.config.statistics():
+    voice = (await self.user_profiles.get(message.author)).voice
 
-            # Start timing the API request
-            start = time.perf_counter()
+    # Synthesis starts straight away (or after the coalescing window), playback happens in order
+    job = TTSJob(message, tts_guild_settings, ttsmessage, voice, tts_guild_settings.coalesce_window, trace)
+    pipeline.submit(job, tts_guild_settings.max_queued_messages,
+                    tts_guild_settings.max_user_messages, tts_guild_settings.max_message_age)
 
-            # Do the API request
-            file_path = await file_manager.download_audio(self, voice, ttsmessage.text)
 
-            # Calculate the API latency
-            api_latency = time.perf_counter() - start
-            # Send the API statistics
-            await send_api_statistics(self, message, ttsmessage.text, api_latency, voice)
+async def get_pipeline(self: TTSBase, guild_id: int) -> TTSPipeline:
+    playback = audio_manager.get_playback(self, guild_id)
+
+    if playback.pipeline is None:
+        workers = await self.config.synthesis_workers()
+
+        # Another message might have created it while we were reading the config
+        if playback.pipeline is None:
+            playback.pipeline = TTSPipeline(
+                synthesise=functools.partial(synthesise_tts, self),
+                play=functools.partial(play_tts, self),
+                release=functools.partial(file_manager.release_audio, self),
+                workers=workers,
+                has_room=functools.partial(audio_manager.has_playback_room, self, guild_id),
+            )
+
+    return playback.pipeline
 
-            if api_latency > 2:
-                log.warning(f"API request took {api_latency} seconds for user {message.author.id}.\
-                 That is over 2 seconds, dropping the message.")
-                return
 
-        else:
-            file_path = await file_manager.download_audio(self, voice, ttsmessage.text)
+async def synthesise_tts(self: TTSBase, job: TTSJob) -> str | None:
+    message = job.message
+    voice = job.voice
+    text = job.ttsmessage.text
+
+    # Everything downloaded for this message adds to its trace, this task has a context of its own
+    current_trace.set(job.trace)
+    if job.trace is not None:
+        # Coalescing and waiting for a synthesis worker
+        job.trace.lap("waiting")
+
+    # Start timing the API request
+    start = time.perf_counter()
+
+    try:
+        # The router picks the backend, and falls back to the default voice if it has to
+        file_path = await file_manager.download_audio(self, voice, text)
     except RuntimeError:
-        # We had an error downloading the audio, lets reset the used voice to the default
-        log.error(f"API request failed for user {message.author.id} with voice {voice}, resetting to default voice.")
-        await self.config.user(message.author).voice.set("Brian")
-        try:
-            file_path = await file_manager.download_audio(self, "Brian", ttsmessage.text)
-        except RuntimeError:
-            log.error("!! Failed to download audio file after resetting voice to default, is the TTS API down? !!")
-            return
+        log.error("!! Failed to download audio file from every TTS backend, are the TTS APIs down? !!")
+        return None
+
+    if job.trace is not None:
+        job.trace.lap("synthesis")
+
+    if await self.config.statistics():
+        # Send the API statistics
+        await send_api_statistics(self, message, text, time.perf_counter() - start, voice)
+
+    return file_path
+
+
+async def play_tts(self: TTSBase, job: TTSJob, file_path: str):
+    message = job.message
+    settings = job.settings
+
+    if await self.config.statistics():
+        send_queue_statistics(self, message, job)
+
+    # Waiting for its turn in the queue
+    current_trace.set(job.trace)
+    if job.trace is not None:
+        job.trace.lap("queued")
+
+    # The user might have left while the message was being synthesised
+    if message.author.voice is None:
+        await file_manager.release_audio(self, file_path)
+        return
 
     try:
         await audio_manager.play_audio(self, message.author.voice.channel, file_path,
-                                       tts_guild_settings.global_tts_volume, ttsmessage.track_name)
+                                       settings.global_tts_volume, job.ttsmessage.track_name, job.trace)
     except RuntimeError:
         # Attempt to reset the lavalink connection
         await audio_manager.reconnect_ll(self, message.author.voice.channel)
@@ -63,7 +131,7 @@ async def generate_tts(self: TTSBase, message: discord.Message):
 
         try:
             await audio_manager.play_audio(self, message.author.voice.channel, file_path,
-                                           tts_guild_settings.global_tts_volume, ttsmessage.track_name)
+                                           settings.global_tts_volume, job.ttsmessage.track_name, job.trace)
         except RuntimeError as err:
             log.error("Failed to (re)connect LavaLink to a VC")
             log.error(err)
@@ -81,3 +149,33 @@ async def send_api_statistics(self: TTSBase, message, text, api_latency, voice)
     }
 
     self.bot.dispatch("statistics_event", "tts_request", statistics_event_tags, statistics_event_data)
+
+
+def send_queue_statistics(self: TTSBase, message, job: TTSJob) -> None:
+    pipeline = audio_manager.get_playback(self, message.guild.id).pipeline
+
+    statistics_event_tags = {
+        "guild_id": message.guild.id,
+    }
+    statistics_event_data = {
+        "wait": time.perf_counter() - job.created,
+        "depth": len(pipeline.jobs),
+        "dropped": pipeline.dropped,
+        "expired": pipeline.expired,
+        "depth_histogram": pipeline.depth_histogram.as_dict(),
+        "wait_histogram": pipeline.wait_histogram.as_dict(),
+    }
+
+    self.bot.dispatch("statistics_event", "tts_queue", statistics_event_tags, statistics_event_data)
+
+
+def send_trace_statistics(self: TTSBase, guild_id: int, trace: TTSTrace) -> None:
+    statistics_event_tags = {
+        "guild_id": guild_id,
+    }
+    statistics_event_data = {
+        **trace.spans,
+        "total": trace.total,
+    }
+
+    self.bot.dispatch("statistics_event", "tts_trace", statistics_event_tags, statistics_event_data)
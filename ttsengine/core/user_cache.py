@@ -0,0 +1,140 @@
+import logging
+from collections import OrderedDict
+from datetime import datetime
+
+import discord
+from redbot.core.config import Config
+
+log = logging.getLogger("red.mednis-cogs.poitranslator.user_cache")
+
+
+class TTSUserProfile:
+    # One of these is kept for every user that talks in a whitelisted channel, so keep it small.
+    __slots__ = ("last_tts_message_time", "tts_enabled", "warning_summon", "warning_notts", "voice")
+
+    def __init__(self, last_tts_message_time: datetime | None, tts_enabled: bool, warning_summon: bool,
+                 warning_notts: bool, voice: str):
+        self.last_tts_message_time = last_tts_message_time
+        self.tts_enabled = tts_enabled
+        self.warning_summon = warning_summon
+        self.warning_notts = warning_notts
+        self.voice = voice
+
+    @classmethod
+    def from_config_data(cls, data: dict):
+        last_message_time = data["last_tts_message_time"]
+
+        return cls(
+            last_tts_message_time=datetime.fromisoformat(last_message_time) if last_message_time else None,
+            tts_enabled=data["tts_enabled"],
+            warning_summon=data["warning_summon"],
+            warning_notts=data["warning_notts"],
+            voice=data["voice"],
+        )
+
+    def to_config_data(self) -> dict:
+        return {
+            "last_tts_message_time": self.last_tts_message_time.isoformat() if self.last_tts_message_time else "",
+            "tts_enabled": self.tts_enabled,
+            "warning_summon": self.warning_summon,
+            "warning_notts": self.warning_notts,
+            "voice": self.voice,
+        }
+
+
+class UserProfileStore:
+    """
+    Lazily loaded user profiles.
+
+    Settings changes (voice, enabling TTS) go through `update` and are written to Config straight away.
+    The message timestamp and warning flags change on nearly every message, so those are only marked
+    dirty and written out in batches by `flush`.
+
+    At most `max_profiles` are kept once they are saved, the least recently used go first and are
+    loaded again from Config when needed. Dirty profiles stay until they have been written.
+    """
+
+    def __init__(self, config: Config, max_profiles: int = 1024):
+        self.config = config
+        self.max_profiles = max_profiles
+        self._profiles: OrderedDict[int, TTSUserProfile] = OrderedDict()
+        self._dirty: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+    async def get(self, user: discord.abc.User) -> TTSUserProfile:
+        profile = self._profiles.get(user.id)
+
+        if profile is None:
+            data = await self.config.user(user).all()
+
+            # Another message from the same user might have loaded the profile while we were waiting
+            profile = self._profiles.setdefault(user.id, TTSUserProfile.from_config_data(data))
+            self._profiles.move_to_end(user.id)
+            self._evict(keep=user.id)
+        else:
+            self._profiles.move_to_end(user.id)
+
+        return profile
+
+    def _evict(self, keep: int | None = None):
+        excess = len(self._profiles) - self.max_profiles
+        if excess <= 0:
+            return
+
+        # Oldest first, anything not written yet has to wait for the next flush. The profile that was
+        # just loaded is about to be used, so it stays too.
+        clean = []
+        for user_id in self._profiles:
+            if len(clean) == excess:
+                break
+            if user_id not in self._dirty and user_id != keep:
+                clean.append(user_id)
+
+        for user_id in clean:
+            del self._profiles[user_id]
+
+    def mark_dirty(self, user_id: int):
+        self._dirty.add(user_id)
+
+    async def update(self, user: discord.abc.User, **fields):
+        profile = await self.get(user)
+
+        for field, value in fields.items():
+            setattr(profile, field, value)
+            await getattr(self.config.user(user), field).set(value)
+
+    async def flush(self):
+        if not self._dirty:
+            return
+
+        dirty, self._dirty = self._dirty, set()
+
+        log.debug(f"Writing {len(dirty)} TTS user profiles to config.")
+
+        unwritten = list(dirty)
+        try:
+            while unwritten:
+                user_id = unwritten[-1]
+                profile = self._profiles.get(user_id)
+
+                if profile is not None:
+                    try:
+                        await self.config.user_from_id(user_id).set(profile.to_config_data())
+                    except Exception as err:
+                        # Still dirty, so it isn't evicted and the next flush tries again
+                        log.error(f"Could not write the TTS user profile of {user_id}: {err!r}")
+                        self._dirty.add(user_id)
+
+                unwritten.pop()
+        finally:
+            # Cancelled halfway, the rest are still waiting to be written
+            self._dirty.update(unwritten)
+
+        # Now they are saved they can go too
+        self._evict()
+
+    def forget(self, user_id: int):
+        self._profiles.pop(user_id, None)
+        self._dirty.discard(user_id)
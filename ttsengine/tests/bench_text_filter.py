@@ -0,0 +1,233 @@
+"""
+Benchmarks for the TTS text filter pipeline.
+
+Run from the repository root with:
+    python -m ttsengine.tests.bench_text_filter [--iterations N] [--engine ENGINE] [--min-rate MESSAGES_PER_SECOND]
+
+Prints per-stage timings and messages/second for 0, 100 and 1000 word substitutions. With --min-rate the
+script exits non-zero if filter_message gets slower than that, so it can be used as a regression check.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from ttsengine.core import text_filter
+from ttsengine.core.settings import TTSGuildSettings
+
+
+class FakeMember:
+    def __init__(self, member_id: int):
+        self.nick = None if member_id % 2 else f"Nick{member_id}"
+        self.display_name = f"Member{member_id}"
+        self.name = f"member{member_id}"
+
+
+class FakeNamed:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class FakeGuild:
+    # Just enough of a discord.Guild for mention_filter, without the overhead of a MagicMock
+    id = 1234
+
+    def get_member(self, member_id: int):
+        return FakeMember(member_id)
+
+    def get_role(self, role_id: int):
+        return FakeNamed(f"role{role_id}")
+
+    def get_channel(self, channel_id: int):
+        return FakeNamed(f"channel{channel_id}")
+
+
+class FakeAuthor:
+    nick = None
+    name = "BenchUser"
+
+
+class FakeMessage:
+    def __init__(self, content: str, guild: FakeGuild):
+        self.content = content
+        self.guild = guild
+        self.author = FakeAuthor()
+        self.message_snapshots = []
+        self.attachments = []
+        self.stickers = []
+
+
+CORPUS = {
+    "plain": [
+        "hello everyone how is it going",
+        "I think we should go to the other objective first, they are all over there",
+        "lol that was so close, gg",
+        "can someone tell me what the password for the server is",
+    ],
+    "emoji": [
+        "that is amazing 😀😂🎉",
+        "good morning ☀️ <:pepehappy:123456789012345678>",
+        "<a:catjam:123456789012345678> <a:catjam:123456789012345678> vibing 🎶",
+        "👍 sounds good to me ❤️",
+    ],
+    "mention": [
+        "<@123456789012345678> are you coming?",
+        "<@&223456789012345678> raid starts in 5 minutes, check <#323456789012345678>",
+        "<@!423456789012345678> <@523456789012345678> <@623456789012345678> look at this",
+        "hey <@723456789012345678>, did you see the patch notes in <#823456789012345678>",
+    ],
+    "link": [
+        "https://example.com/some/really/long/path?with=query&and=more",
+        "check this out https://www.youtube.com/watch?v=dQw4w9WgXcQ it is great",
+        "docs are at https://docs.example.com/guide and https://docs.example.com/faq",
+        "https://cdn.discordapp.com/attachments/1/2/image.png",
+    ],
+    "spoiler": [
+        "the ending is ||they all die|| honestly",
+        "||spoiler one|| and ||spoiler two|| and ||spoiler three||",
+        "don't read this ||\nmultiline\nspoiler\n||",
+        "no spoilers here but | pipes | around",
+    ],
+    "spam": [
+        "noooooooooooooooo wayyyyyyyy",
+        "hahahahahaha soooooo goooooood",
+        "aaaaaaaa aaaaaaaa aaaaaaaa",
+        "yesssssss lets gooooooooooo",
+    ],
+}
+
+
+def make_settings(substitutions: int, engine: str) -> TTSGuildSettings:
+    word_replacements = {f"word{i}": f"replacement {i}" for i in range(substitutions)}
+
+    # A few that actually show up in the corpus
+    if substitutions:
+        word_replacements.update({"lol": "laugh out loud", "gg": "good game", "gooooooooooo": "go"})
+
+    return TTSGuildSettings(
+        say_name=True,
+        max_message_length=400,
+        max_word_length=30,
+        repeated_word_percentage=80,
+        global_tts_volume=100,
+        name_replacements={"benchuser": "bench user"},
+        word_replacements=word_replacements,
+        command_prefixes=["!", "?"],
+        filter_engine=engine,
+    )
+
+
+def stages(settings: TTSGuildSettings, guild: FakeGuild):
+    """
+    The stages of filter_message, in the same order.
+    """
+    replacer = text_filter.get_word_replacer(settings)
+
+    if settings.filter_engine == "tokenized":
+        return [
+            ("command", lambda text: text_filter.command_ignore_filter(text.strip(), settings.command_prefixes)),
+            ("repeated_words", lambda text: (text_filter.repeated_word_filter(text), text)[1]),
+            ("substitutions", replacer.replace),
+            ("tokenized", lambda text: text_filter.tokenized_filter(text, guild) or text),
+            ("long_words", lambda text: (text_filter.long_word_filter(text, settings.max_word_length), text)[1]),
+            ("repeated_letters", text_filter.repeated_letter_fix),
+        ]
+
+    return [
+        ("command", lambda text: text_filter.command_ignore_filter(text.strip(), settings.command_prefixes)),
+        ("repeated_words", lambda text: (text_filter.repeated_word_filter(text), text)[1]),
+        ("substitutions", replacer.replace),
+        ("mentions", lambda text: text_filter.mention_filter(text, guild)),
+        ("emoji", text_filter.emoji_textifier),
+        ("links", text_filter.link_filter),
+        ("characters", text_filter.remove_characters),
+        ("spoilers", text_filter.filter_spoilers),
+        ("long_words", lambda text: (text_filter.long_word_filter(text, settings.max_word_length), text)[1]),
+        ("repeated_letters", text_filter.repeated_letter_fix),
+    ]
+
+
+def bench_stages(messages: list[str], settings: TTSGuildSettings, guild: FakeGuild, iterations: int) -> dict:
+    timings = {}
+    stage_list = stages(settings, guild)
+
+    for _ in range(iterations):
+        for content in messages:
+            text = content
+            for name, stage in stage_list:
+                start = time.perf_counter()
+                text = stage(text)
+                timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+    return timings
+
+
+async def bench_filter_message(messages: list[str], settings: TTSGuildSettings, guild: FakeGuild,
+                               iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for content in messages:
+            await text_filter.filter_message(content, settings=settings, guild=guild)
+    return time.perf_counter() - start
+
+
+async def bench_filter_and_format(messages: list[FakeMessage], settings: TTSGuildSettings,
+                                  iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for message in messages:
+            await text_filter.filter_and_format_message(message, settings)
+    return time.perf_counter() - start
+
+
+async def run(iterations: int, engine: str) -> float:
+    guild = FakeGuild()
+    all_messages = [content for corpus in CORPUS.values() for content in corpus]
+    formatted_messages = [FakeMessage(content, guild) for content in all_messages]
+    total = len(all_messages) * iterations
+
+    slowest_rate = float("inf")
+
+    for substitutions in (0, 100, 1000):
+        settings = make_settings(substitutions, engine)
+
+        print(f"\n=== {substitutions} word substitutions ===")
+
+        print(f"{'corpus':<10}{'msg/s':>12}")
+        for name, messages in CORPUS.items():
+            elapsed = await bench_filter_message(messages, settings, guild, iterations)
+            print(f"{name:<10}{len(messages) * iterations / elapsed:>12.0f}")
+
+        print(f"\n{'stage':<18}{'total ms':>10}{'us/msg':>10}")
+        for name, elapsed in bench_stages(all_messages, settings, guild, iterations).items():
+            print(f"{name:<18}{elapsed * 1000:>10.1f}{elapsed / total * 1e6:>10.2f}")
+
+        elapsed = await bench_filter_message(all_messages, settings, guild, iterations)
+        rate = total / elapsed
+        slowest_rate = min(slowest_rate, rate)
+        print(f"\nfilter_message:            {rate:>10.0f} msg/s")
+
+        elapsed = await bench_filter_and_format(formatted_messages, settings, iterations)
+        print(f"filter_and_format_message: {total / elapsed:>10.0f} msg/s")
+
+    return slowest_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the TTS text filter pipeline.")
+    parser.add_argument("--iterations", type=int, default=200, help="Passes over the corpus per measurement.")
+    parser.add_argument("--engine", choices=text_filter.FILTER_ENGINES, default="classic",
+                        help="Which filter engine to benchmark.")
+    parser.add_argument("--min-rate", type=float, default=None,
+                        help="Fail if filter_message handles fewer messages per second than this.")
+    args = parser.parse_args()
+
+    slowest_rate = asyncio.run(run(args.iterations, args.engine))
+
+    if args.min_rate is not None and slowest_rate < args.min_rate:
+        print(f"\nFAIL: slowest filter_message rate {slowest_rate:.0f} msg/s is below {args.min_rate:.0f} msg/s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
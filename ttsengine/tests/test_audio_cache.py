@@ -0,0 +1,92 @@
+import os
+import pytest
+from ttsengine.core.audio_cache import AudioCache, make_key
+
+def write_clip(cache: AudioCache, key: str, size: int) -> str:
+    file_path = cache.file_path(key, "mp3")
+    with open(file_path, "wb") as f:
+        f.write(b"\0" * size)
+    return file_path
+
+def test_key_depends_on_voice_and_backend():
+    assert make_key("public", "Brian", "hello") == make_key("public", "Brian", "hello")
+    assert make_key("public", "Brian", "hello") != make_key("public", "Amy", "hello")
+    assert make_key("public", "Brian", "hello") != make_key("local", "Brian", "hello")
+
+@pytest.mark.asyncio
+async def test_cache_hit_after_add(tmp_path):
+    cache = AudioCache(tmp_path, max_bytes=1000)
+    await cache.load()
+
+    assert cache.get("a") is None
+    file_path = write_clip(cache, "a", 100)
+    await cache.add("a", file_path)
+
+    assert cache.get("a") == file_path
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert cache.bytes_saved == 100
+
+@pytest.mark.asyncio
+async def test_cache_evicts_least_recently_used(tmp_path):
+    cache = AudioCache(tmp_path, max_bytes=250)
+    await cache.load()
+
+    for key in ("a", "b"):
+        await cache.add(key, write_clip(cache, key, 100))
+        cache.release(cache.file_path(key, "mp3"))
+
+    # Touch "a" so "b" is the oldest entry
+    cache.release(cache.get("a"))
+
+    await cache.add("c", write_clip(cache, "c", 100))
+
+    assert cache.get("b") is None
+    assert not os.path.exists(cache.file_path("b", "mp3"))
+    assert cache.get("a") is not None
+
+@pytest.mark.asyncio
+async def test_cache_keeps_clips_in_use(tmp_path):
+    cache = AudioCache(tmp_path, max_bytes=150)
+    await cache.load()
+
+    await cache.add("a", write_clip(cache, "a", 100))
+    await cache.add("b", write_clip(cache, "b", 100))
+
+    # Both clips are still queued, so nothing can be evicted yet
+    assert os.path.exists(cache.file_path("a", "mp3"))
+
+    cache.release(cache.file_path("a", "mp3"))
+    await cache.evict()
+    assert not os.path.exists(cache.file_path("a", "mp3"))
+
+@pytest.mark.asyncio
+async def test_cache_loads_previous_clips(tmp_path):
+    cache = AudioCache(tmp_path, max_bytes=1000)
+    write_clip(cache, "a", 100)
+    with open(tmp_path / "b.mp3.1234.part", "wb") as f:
+        f.write(b"\0")
+
+    await cache.load()
+
+    assert cache.get("a") is not None
+    assert not os.path.exists(tmp_path / "b.mp3.1234.part")
+
+@pytest.mark.asyncio
+async def test_cache_reports_removed_clips(tmp_path):
+    cache = AudioCache(tmp_path, max_bytes=150)
+    removed = []
+    cache.on_remove = removed.append
+    await cache.load()
+
+    a = write_clip(cache, "a", 100)
+    await cache.add("a", a)
+    cache.release(a)
+
+    # Replaced with a fresh download of the same clip
+    await cache.add("a", write_clip(cache, "a", 100))
+    cache.release(a)
+    assert removed == [a]
+
+    await cache.add("b", write_clip(cache, "b", 100))
+    assert removed == [a, a]
@@ -0,0 +1,76 @@
+import os
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from ttsengine.core import audio_manager, file_manager
+from ttsengine.core.audio_processing import AudioProcessor
+from ttsengine.core.backend_router import Route
+
+PUBLIC = Route("public", "Brian", "http://public", "mp3", "audio/mp3")
+
+# Stands in for ffmpeg, "processing" upper cases the clip
+FAKE_FFMPEG = """#!/bin/sh
+while [ $# -gt 1 ]; do
+    if [ "$1" = "-i" ]; then src="$2"; fi
+    shift
+done
+if [ "$src" = "pipe:0" ]; then tr a-z A-Z; else tr a-z A-Z < "$src" > "$1"; fi
+"""
+
+@pytest.fixture
+def processor(tmp_path) -> AudioProcessor:
+    binary = tmp_path / "ffmpeg"
+    binary.write_text(FAKE_FFMPEG)
+    binary.chmod(0o755)
+    return AudioProcessor(binary.as_posix(), -16)
+
+def make_cog(processor: AudioProcessor | None) -> MagicMock:
+    cog = MagicMock()
+    cog.audio_processor = processor
+    return cog
+
+def test_command():
+    command = AudioProcessor("ffmpeg", -16).command("in.mp3", "out.mp3", "mp3")
+
+    assert command[command.index("-i") + 1] == "in.mp3"
+    assert "loudnorm=I=-16" in command[command.index("-af") + 1]
+    assert command[-3:] == ["mp3", "-y", "out.mp3"]
+
+@pytest.mark.asyncio
+async def test_post_process(processor, tmp_path):
+    path = tmp_path / "audio1.mp3"
+    path.write_text("hello")
+
+    assert await file_manager.post_process(make_cog(processor), PUBLIC, path.as_posix())
+    assert path.read_text() == "HELLO"
+    assert sorted(os.listdir(tmp_path)) == ["audio1.mp3", "ffmpeg"]
+
+    assert await file_manager.post_process_bytes(make_cog(processor), PUBLIC, b"hello") == b"HELLO"
+
+@pytest.mark.asyncio
+async def test_post_process_failure_keeps_clip(tmp_path):
+    path = tmp_path / "audio1.mp3"
+    path.write_text("hello")
+    cog = make_cog(AudioProcessor((tmp_path / "missing").as_posix(), -16))
+
+    assert not await file_manager.post_process(cog, PUBLIC, path.as_posix())
+    assert path.read_text() == "hello"
+    assert await file_manager.post_process_bytes(cog, PUBLIC, b"hello") == b"hello"
+
+def test_processed_clips_cached_separately(processor):
+    plain = file_manager.cache_key(make_cog(None), PUBLIC, "hi")
+
+    assert file_manager.cache_key(make_cog(processor), PUBLIC, "hi") != plain
+    assert file_manager.cache_key(make_cog(AudioProcessor("ffmpeg", -20)), PUBLIC, "hi") != \
+           file_manager.cache_key(make_cog(processor), PUBLIC, "hi")
+
+@pytest.mark.asyncio
+async def test_set_volume_skips_same_volume():
+    player = MagicMock()
+    player.volume = 100
+    player.set_volume = AsyncMock()
+
+    await audio_manager.set_volume(player, 100)
+    player.set_volume.assert_not_awaited()
+
+    await audio_manager.set_volume(player, 80)
+    player.set_volume.assert_awaited_once_with(80)
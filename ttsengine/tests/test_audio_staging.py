@@ -0,0 +1,123 @@
+import aiohttp
+import functools
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from ttsengine.core import audio_staging, file_manager
+from ttsengine.core.audio_cache import AudioCache
+from ttsengine.core.audio_staging import MemoryAudioStore
+from ttsengine.core.backend_router import Route
+
+PUBLIC = Route("public", "Brian", "http://public", "mp3", "audio/mp3")
+
+@pytest.mark.asyncio
+async def test_memory_store_serves_clips():
+    store = MemoryAudioStore(max_bytes=10)
+    await store.start("127.0.0.1", 0)
+
+    try:
+        url = store.add(b"abcdef", "mp3", "audio/mp3")
+        assert store.owns(url)
+
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                assert response.content_type == "audio/mp3"
+                assert await response.read() == b"abcdef"
+
+            # Lavalink seeking
+            async with session.get(url, headers={"Range": "bytes=2-"}) as response:
+                assert response.status == 206
+                assert response.headers["Content-Range"] == "bytes 2-5/6"
+                assert await response.read() == b"cdef"
+
+            # Full, the caller has to put it somewhere else
+            assert store.add(b"ghijk", "mp3", "audio/mp3") is None
+
+            store.remove(url)
+            assert not store.owns(url) and store.size == 0
+            async with session.get(url) as response:
+                assert response.status == 404
+    finally:
+        await store.stop()
+
+def make_response(*chunks: bytes) -> MagicMock:
+    async def iter_chunked(size):
+        for chunk in chunks:
+            yield chunk
+
+    response = MagicMock()
+    response.content.iter_chunked = iter_chunked
+    return response
+
+@pytest.mark.asyncio
+async def test_stream_to_store_falls_back_to_disk(tmp_path):
+    cog = MagicMock()
+    cog.audio_cache.owns.return_value = False
+    cog.audio_processor = None
+    cog.audio_store = MemoryAudioStore(max_bytes=4)
+    cog.audio_store.base_url = "http://127.0.0.1:1234/tts/"
+    path = (tmp_path / "audio1.mp3").as_posix()
+
+    url = await file_manager.stream_to_store(cog, make_response(b"ab", b"c"), PUBLIC, path)
+    assert url.startswith("http://127.0.0.1:1234/tts/") and url.endswith(".mp3")
+
+    # Too big for what is left in the store
+    assert await file_manager.stream_to_store(cog, make_response(b"def"), PUBLIC, path) == path
+    with open(path, "rb") as f:
+        assert f.read() == b"def"
+
+    await file_manager.release_audio(cog, url)
+    assert cog.audio_store.size == 0
+
+@pytest.mark.asyncio
+async def test_tmpfs_staging_moves_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_staging, "make_tmpfs_dir", lambda cog_path: tmp_path / "shm")
+    cog = MagicMock()
+    cog.cog_path = tmp_path / "cog"
+    cog.audio_cache = AudioCache(cog.cog_path / "audio_cache")
+    cog.config.audio_staging = AsyncMock(return_value="tmpfs")
+
+    await file_manager.setup_staging(cog)
+
+    assert cog.audio_file_name == (tmp_path / "shm" / "audio").as_posix()
+    assert cog.audio_cache.path == tmp_path / "shm" / "audio_cache"
+
+@pytest.mark.asyncio
+async def test_cached_clips_stay_in_memory(tmp_path):
+    cog = MagicMock()
+    cog.audio_cache = AudioCache(tmp_path / "audio_cache", max_bytes=5)
+    cog.audio_cache.on_remove = functools.partial(file_manager.forget_clip, cog)
+    cog.audio_store = MemoryAudioStore(max_bytes=10)
+    cog.audio_store.base_url = "http://127.0.0.1:1234/tts/"
+
+    url = cog.audio_store.add(b"abc", "mp3", "audio/mp3")
+    await cog.audio_cache.add("first", url, cog.audio_store.size_of(url))
+
+    # Played and released, the cache keeps it in the store
+    await file_manager.release_audio(cog, url)
+    assert cog.audio_store.owns(url) and cog.audio_cache.size == 3
+
+    # Evicted, so it goes from the store as well
+    other = cog.audio_store.add(b"defg", "mp3", "audio/mp3")
+    await cog.audio_cache.add("second", other, cog.audio_store.size_of(other))
+    assert not cog.audio_store.owns(url) and cog.audio_store.size == 4
+    cog.track_cache.invalidate.assert_called_with(url)
+
+@pytest.mark.asyncio
+async def test_duplicate_cached_clip_keeps_the_queued_one(tmp_path):
+    cog = MagicMock()
+    cog.audio_cache = AudioCache(tmp_path / "audio_cache", max_bytes=100)
+    cog.audio_cache.on_remove = functools.partial(file_manager.forget_clip, cog)
+    cog.audio_store = MemoryAudioStore(max_bytes=100)
+    cog.audio_store.base_url = "http://127.0.0.1:1234/tts/"
+
+    # Two messages with the same text missed the cache at the same time
+    first = cog.audio_store.add(b"abc", "mp3", "audio/mp3")
+    second = cog.audio_store.add(b"abc", "mp3", "audio/mp3")
+    assert await cog.audio_cache.add("key", first, 3)
+    assert not await cog.audio_cache.add("key", second, 3)
+
+    # The second copy is just a clip, the first one is still queued and stays
+    await file_manager.release_audio(cog, second)
+    assert cog.audio_store.owns(first) and not cog.audio_store.owns(second)
+    assert cog.audio_cache.owns(first) and not cog.audio_cache.owns(second)
+    assert cog.audio_cache.size == 3
@@ -0,0 +1,241 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from ttsengine.core import backend_router, file_manager
+from ttsengine.core.audio_cache import AudioCache
+from ttsengine.core.backend_router import BackendRouter, Route
+
+LOCAL = Route("local", "Brian", "http://local", "wav", "audio/wav")
+PUBLIC = Route("public", "Brian", "http://public", "mp3", "audio/mp3")
+
+def test_percentiles():
+    router = BackendRouter()
+    for latency in range(1, 51):
+        router.record(PUBLIC, latency / 100, True)
+    router.record(PUBLIC, None, False)
+
+    stats = router.get_stats("public", "Brian")
+    assert stats.p50 == 0.26
+    assert stats.p95 == 0.48
+    assert stats.error_rate == pytest.approx(1 / 50)
+
+def test_order_keeps_preference_when_healthy():
+    router = BackendRouter()
+    router.record(LOCAL, 0.5, True)
+    router.record(PUBLIC, 0.1, True)
+
+    assert router.order([LOCAL, PUBLIC]) == [LOCAL, PUBLIC]
+
+def test_order_slow_backend_goes_last():
+    router = BackendRouter()
+    for _ in range(10):
+        router.record(LOCAL, 3.0, True)
+    router.record(PUBLIC, 0.1, True)
+
+    assert router.order([LOCAL, PUBLIC]) == [PUBLIC, LOCAL]
+
+def test_circuit_breaker(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(backend_router.time, "monotonic", lambda: now)
+    router = BackendRouter()
+
+    for _ in range(backend_router.BREAKER_FAILURES):
+        assert router.allows_request(LOCAL)
+        router.record(LOCAL, 0.1, False)
+
+    # Open, skipped until the cooldown is up
+    assert not router.allows_request(LOCAL)
+    assert router.order([LOCAL, PUBLIC]) == [PUBLIC, LOCAL]
+
+    # Then a single trial request gets through
+    now += backend_router.BREAKER_COOLDOWN
+    assert router.order([LOCAL, PUBLIC]) == [LOCAL, PUBLIC]
+    assert router.allows_request(LOCAL)
+    assert not router.allows_request(LOCAL)
+
+    router.record(LOCAL, 0.1, True)
+    assert router.allows_request(LOCAL)
+
+def make_cog(local_voices: dict) -> MagicMock:
+    cog = MagicMock()
+    cog.backend_router = BackendRouter()
+    cog.audio_cache.enabled = False
+    cog.config.local_api = AsyncMock(return_value=True)
+    cog.config.local_voices = AsyncMock(return_value=local_voices)
+    cog.config.local_api_url = AsyncMock(return_value="http://local/{voice}?text={text}")
+    cog.config.public_api_url = AsyncMock(return_value="http://public/{voice}?text={text}")
+    cog.config.hedge_requests = AsyncMock(return_value=False)
+    cog.offline_tts = None
+    return cog
+
+@pytest.mark.asyncio
+async def test_resolve_routes():
+    routes = await file_manager.resolve_routes(make_cog({"brian": "en_GB-alan"}), "Brian", "hi there")
+
+    assert [route.backend for route in routes] == ["local", "public"]
+    assert routes[0].url == "http://local/en_GB-alan?text=hi+there"
+    assert routes[1].url == "http://public/Brian?text=hi+there"
+
+@pytest.mark.asyncio
+async def test_download_audio_fails_over(monkeypatch):
+    tried = []
+
+    async def fetch_route(self, route, text):
+        tried.append((route.backend, route.voice))
+        if route.backend == "local" or route.voice == "Joey":
+            raise RuntimeError("Failed to download audio file.")
+        return f"{route.backend}.{route.extension}"
+
+    monkeypatch.setattr(file_manager, "fetch_route", fetch_route)
+    cog = make_cog({"brian": "en_GB-alan", "joey": "en_US-joe"})
+
+    # Every backend with the voice gets a go, then the default voice is used for this message only
+    assert await file_manager.download_audio(cog, "Joey", "hi") == "public.mp3"
+    assert tried == [("local", "Joey"), ("public", "Joey"), ("local", "Brian"), ("public", "Brian")]
+
+@pytest.mark.asyncio
+async def test_download_audio_counts_one_cache_lookup(monkeypatch, tmp_path):
+    async def fetch_route(self, route, text):
+        if route.voice == "Joey":
+            raise RuntimeError("Failed to download audio file.")
+        return f"{route.backend}.{route.extension}"
+
+    monkeypatch.setattr(file_manager, "fetch_route", fetch_route)
+    cog = make_cog({"brian": "en_GB-alan", "joey": "en_US-joe"})
+    cog.audio_cache = AudioCache(tmp_path, max_bytes=1000)
+    cog.audio_processor = None
+
+    # Four routes over two voices looked at, one message that wasn't cached
+    await file_manager.download_audio(cog, "Joey", "hi")
+    assert (cog.audio_cache.hits, cog.audio_cache.misses) == (0, 1)
+
+    # Only the public backend has it, still one hit
+    (tmp_path / "clip.mp3").write_bytes(b"x")
+    await cog.audio_cache.add(file_manager.cache_key(cog, PUBLIC, "hi"), (tmp_path / "clip.mp3").as_posix())
+    assert await file_manager.download_audio(cog, "Brian", "hi") == (tmp_path / "clip.mp3").as_posix()
+    assert (cog.audio_cache.hits, cog.audio_cache.misses) == (1, 1)
+
+@pytest.mark.asyncio
+async def test_hedged_download(monkeypatch):
+    released = []
+
+    async def fetch_route(self, route, text):
+        if route.backend == "local":
+            await asyncio.sleep(1)
+        return f"{route.backend}.{route.extension}"
+
+    async def release_audio(self, path):
+        released.append(path)
+
+    monkeypatch.setattr(file_manager, "fetch_route", fetch_route)
+    monkeypatch.setattr(file_manager, "release_audio", release_audio)
+    cog = make_cog({"brian": "en_GB-alan"})
+    cog.config.hedge_requests = AsyncMock(return_value=True)
+    cog.config.hedge_percentile = AsyncMock(return_value=95)
+
+    # The local backend usually answers in 10ms, so the public one gets asked once that is up
+    for _ in range(10):
+        cog.backend_router.record(LOCAL, 0.01, True)
+
+    assert await file_manager.download_audio(cog, "Brian", "hi") == "public.mp3"
+    assert (cog.backend_router.hedged, cog.backend_router.hedge_wins) == (1, 1)
+    cog.bot.dispatch.assert_called_with("statistics_event", "tts_hedge",
+                                        {"primary": "local", "backup": "public", "winner": "backup"},
+                                        {"hedge_rate": 1.0, "win_rate": 1.0})
+    assert released == []
+
+@pytest.mark.asyncio
+async def test_hedge_not_needed(monkeypatch):
+    async def fetch_route(self, route, text):
+        return f"{route.backend}.{route.extension}"
+
+    monkeypatch.setattr(file_manager, "fetch_route", fetch_route)
+    cog = make_cog({"brian": "en_GB-alan"})
+    cog.config.hedge_requests = AsyncMock(return_value=True)
+    cog.config.hedge_percentile = AsyncMock(return_value=95)
+
+    assert await file_manager.download_audio(cog, "Brian", "hi") == "local.wav"
+    assert cog.backend_router.hedged == 0
+
+@pytest.mark.asyncio
+async def test_cancelled_hedge_releases_primary_clip(monkeypatch):
+    released = []
+
+    async def fetch_route(self, route, text):
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            # Too late to stop, the clip is there anyway
+            pass
+        return f"{route.backend}.{route.extension}"
+
+    async def release_audio(self, path):
+        released.append(path)
+
+    monkeypatch.setattr(file_manager, "fetch_route", fetch_route)
+    monkeypatch.setattr(file_manager, "release_audio", release_audio)
+    cog = make_cog({"brian": "en_GB-alan"})
+
+    # Slow primary, and the backup is down so it is waited for
+    for _ in range(10):
+        cog.backend_router.record(LOCAL, 0.001, True)
+    for _ in range(backend_router.BREAKER_FAILURES):
+        cog.backend_router.record(PUBLIC, 0.1, False)
+
+    task = asyncio.create_task(file_manager.fetch_hedged(cog, LOCAL, PUBLIC, "hi", 95))
+    await asyncio.sleep(0.02)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    await asyncio.sleep(0.01)
+    assert released == ["local.wav"]
+
+@pytest.mark.asyncio
+async def test_download_audio_batch(monkeypatch):
+    running = []
+    peak = []
+
+    async def download_audio(self, voice, text):
+        running.append(text)
+        peak.append(len(running))
+        # Later requests finish first
+        await asyncio.sleep(0.01 * (5 - len(text)))
+        running.remove(text)
+        if text == "bad":
+            raise RuntimeError("Failed to download audio file.")
+        return f"{voice}-{text}.mp3"
+
+    monkeypatch.setattr(file_manager, "download_audio", download_audio)
+
+    results = await file_manager.download_audio_batch(make_cog({}), [("Brian", "a"), ("Amy", "bb"), ("Brian", "bad"),
+                                                                     ("Joey", "dddd")], concurrency=2)
+
+    assert [result.file_path for result in results] == ["Brian-a.mp3", "Amy-bb.mp3", None, "Joey-dddd.mp3"]
+    assert isinstance(results[2].error, RuntimeError)
+    assert all(result.latency > 0 for result in results)
+    assert max(peak) == 2
+
+@pytest.mark.asyncio
+async def test_download_audio_batch_cancelled(monkeypatch):
+    released = []
+
+    async def download_audio(self, voice, text):
+        if text == "slow":
+            await asyncio.sleep(1)
+        return f"{text}.mp3"
+
+    async def release_audio(self, path):
+        released.append(path)
+
+    monkeypatch.setattr(file_manager, "download_audio", download_audio)
+    monkeypatch.setattr(file_manager, "release_audio", release_audio)
+
+    batch = asyncio.create_task(file_manager.download_audio_batch(make_cog({}), [("Brian", "fast"), ("Brian", "slow")]))
+    await asyncio.sleep(0.05)
+    batch.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await batch
+    await asyncio.sleep(0)
+    assert released == ["fast.mp3"]
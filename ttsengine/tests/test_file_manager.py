@@ -0,0 +1,79 @@
+import os
+import pytest
+from unittest.mock import MagicMock
+from ttsengine.core import audio_staging, file_manager
+
+# Dirty mock of an aiohttp response, only the streaming body
+def make_response(*chunks: bytes) -> MagicMock:
+    async def iter_chunked(size):
+        for chunk in chunks:
+            yield chunk
+
+    response = MagicMock()
+    response.content.iter_chunked = iter_chunked
+    return response
+
+@pytest.mark.asyncio
+async def test_stream_to_file(tmp_path):
+    path = (tmp_path / "audio.mp3").as_posix()
+    await file_manager.stream_to_file(make_response(b"abc", b"def"), path)
+
+    with open(path, "rb") as f:
+        assert f.read() == b"abcdef"
+    assert os.listdir(tmp_path) == ["audio.mp3"]
+
+@pytest.mark.asyncio
+async def test_stream_to_file_too_large(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_manager, "MAX_AUDIO_BYTES", 4)
+    path = (tmp_path / "audio.mp3").as_posix()
+
+    with pytest.raises(RuntimeError):
+        await file_manager.stream_to_file(make_response(b"abc", b"def"), path)
+
+    # Nothing is left behind, not even the partial file
+    assert os.listdir(tmp_path) == []
+
+@pytest.mark.asyncio
+async def test_reconcile_audio(tmp_path):
+    for name in ["audio1.mp3", "audio2.wav", "audio3.mp3", "audio4.mp3.abc.part", "notes.txt"]:
+        (tmp_path / name).write_bytes(b"x")
+    (tmp_path / "audio_cache").mkdir()
+    (tmp_path / "audio_cache" / "clip.mp3").write_bytes(b"x")
+
+    # Only old files count as orphans, audio3 might still be on its way to the player
+    for name in ["audio1.mp3", "audio2.wav", "audio4.mp3.abc.part"]:
+        os.utime(tmp_path / name, (0, 0))
+
+    playback = MagicMock()
+    playback.current_track = None
+    playback.pipeline = None
+    playback.player.current.uri = (tmp_path / "audio2.wav").as_posix()
+    playback.player.queue = []
+
+    cog = MagicMock()
+    cog.cog_path = tmp_path
+    cog.audio_file_name = (tmp_path / "audio").as_posix()
+    cog.playback = {1: playback}
+
+    assert await file_manager.reconcile_audio(cog) == 2
+    assert sorted(os.listdir(tmp_path)) == ["audio2.wav", "audio3.mp3", "audio_cache", "notes.txt"]
+    assert os.listdir(tmp_path / "audio_cache") == ["clip.mp3"]
+
+@pytest.mark.asyncio
+async def test_reconcile_audio_sweeps_old_staging_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_staging, "TMPFS_PATH", tmp_path / "shm")
+    cog = MagicMock()
+    cog.cog_path = tmp_path / "cog"
+    cog.playback = {}
+
+    # Staged on tmpfs now, on disk before that
+    tmpfs = audio_staging.tmpfs_dir(cog.cog_path)
+    tmpfs.mkdir(parents=True)
+    cog.cog_path.mkdir()
+    cog.audio_file_name = (tmpfs / "audio").as_posix()
+    for path in [tmpfs / "audio1.mp3", cog.cog_path / "audio2.mp3"]:
+        path.write_bytes(b"x")
+        os.utime(path, (0, 0))
+
+    assert await file_manager.reconcile_audio(cog) == 2
+    assert os.listdir(tmpfs) == [] and os.listdir(cog.cog_path) == []
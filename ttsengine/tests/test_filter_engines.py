@@ -0,0 +1,83 @@
+import dataclasses
+import pytest
+from unittest.mock import MagicMock
+from ttsengine.core.text_filter import filter_message, tokenized_filter
+from ttsengine.core.settings import TTSGuildSettings
+
+# Both engines have to read every message out exactly the same way
+
+def make_settings(**overrides) -> TTSGuildSettings:
+    defaults = dict(
+        say_name=True,
+        max_message_length=400,
+        max_word_length=30,
+        repeated_word_percentage=80,
+        global_tts_volume=100,
+        name_replacements={},
+        word_replacements={"lol": "laugh out loud", "gg": "good_game"},
+        command_prefixes=["!"]
+    )
+    return TTSGuildSettings(**{**defaults, **overrides})
+
+def make_guild(name="Mednis") -> MagicMock:
+    guild = MagicMock()
+    guild.get_member.return_value.nick = None
+    guild.get_member.return_value.display_name = name
+    guild.get_role.return_value.name = "Admins"
+    guild.get_channel.return_value.name = "general"
+    return guild
+
+MESSAGES = [
+    "hello world",
+    "  lots   of   spaces  ",
+    "!play something",
+    "spam spam spam spam spam",
+    "lol gg",
+    "<@123> <@!456> <@&789> <#101>",
+    "I love <:apples:123456789> and <a:cat_jam:987654321>!",
+    "Hello 😀😂 ❤️ 1️⃣ 👍🏻",
+    "check this out https://example.com/some_path and https://example.com",
+    "https://example.com",
+    "This is a ||apple|| sentence with multiple ||apples||.",
+    "noooooooooo wayyyyy",
+    "path/to_some/file_name",
+    ":smile: :a_b: not:an:emoji",
+    "||multi\nline||",
+    "|||odd pipes||",
+    # Things only the classic stages get right, the tokenized engine hands these back to them
+    "see:https://example.com",
+    "a:<:b:1>:c",
+    "||https://example.com||",
+    "||<@123>||",
+    "https://example.com/<@123>",
+    "|️||",
+    "<@123>️⃣",
+]
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("text", MESSAGES)
+async def test_engines_match(text):
+    classic = make_settings()
+    tokenized = dataclasses.replace(classic, filter_engine="tokenized")
+
+    expected = await filter_message(text, settings=classic, guild=make_guild())
+    assert await filter_message(text, settings=tokenized, guild=make_guild()) == expected
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", ["a_b", "x/y", "😀Joe", "pipe||name", "c:d:", "<:e:1>", "two  spaces"])
+async def test_engines_match_odd_names(name):
+    classic = make_settings()
+    tokenized = dataclasses.replace(classic, filter_engine="tokenized")
+    text = "hey <@123> ||look|| 😀"
+
+    expected = await filter_message(text, settings=classic, guild=make_guild(name))
+    assert await filter_message(text, settings=tokenized, guild=make_guild(name)) == expected
+
+def test_tokenized_filter():
+    assert tokenized_filter("hi <@123> 😀 https://example.com", make_guild()) == "hi to Mednis grinning face Link"
+    assert tokenized_filter("a ||b|| c_d", make_guild()) == "a spoiler c d"
+
+def test_tokenized_filter_falls_back():
+    assert tokenized_filter("a:<:b:1>:c", make_guild()) is None
+    assert tokenized_filter("||https://example.com||", make_guild()) is None
+    assert tokenized_filter("hey <@123>", make_guild("pipe||name")) is None
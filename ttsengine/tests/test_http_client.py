@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+from aiohttp import web
+from ttsengine.core import http_client
+from ttsengine.core.http_client import RequestTiming
+
+# How long the test server waits before the headers, and between the two halves of the body
+DELAY = 0.05
+
+async def make_server() -> tuple[web.AppRunner, str, list]:
+    connections = []
+
+    async def handler(request: web.Request) -> web.StreamResponse:
+        connections.append(request.transport)
+        await asyncio.sleep(DELAY)
+
+        response = web.StreamResponse(headers={"Content-Type": "audio/mp3"})
+        response.content_length = 6
+        await response.prepare(request)
+        await response.write(b"abc")
+        await asyncio.sleep(DELAY)
+        await response.write(b"def")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/tts", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+
+    return runner, f"http://127.0.0.1:{runner.addresses[0][1]}/tts", connections
+
+async def fetch(session, url: str) -> RequestTiming:
+    timing = RequestTiming()
+    async with session.get(url, trace_request_ctx=timing) as response:
+        assert await response.read() == b"abcdef"
+    timing.finish()
+    return timing
+
+@pytest.mark.asyncio
+async def test_request_timing():
+    runner, url, connections = await make_server()
+    session = http_client.create_session()
+
+    try:
+        first = await fetch(session, url)
+        second = await fetch(session, url)
+    finally:
+        await session.close()
+        await runner.cleanup()
+
+    # The server's delays show up in the stage they happen in
+    for timing in (first, second):
+        assert timing.connected is not None and timing.first_byte is not None
+        assert timing.first_byte_time >= DELAY
+        assert timing.body_time >= DELAY
+        assert timing.connect_time < DELAY
+        assert timing.total_time == pytest.approx(timing.connect_time + timing.first_byte_time + timing.body_time)
+
+    # Kept alive, so the second request didn't open a connection of its own
+    assert len(connections) == 2 and connections[0] is connections[1]
+    assert second.connect_time < 0.005
@@ -0,0 +1,113 @@
+import pytest
+from unittest.mock import MagicMock
+import lavalink
+from ttsengine.core import audio_manager
+from ttsengine.core.playback import GuildPlayback, InterruptState
+
+def make_track(identifier: str, seekable=True) -> lavalink.Track:
+    return lavalink.Track({"track": identifier, "info": {"isSeekable": seekable, "title": identifier}})
+
+class FakePlayer:
+    # Keeps the player updates in order, so the tests can see what Lavalink was sent
+    def __init__(self, current, position=0, paused=False, volume=100):
+        self.current = current
+        self.position = position
+        self.paused = paused
+        self.volume = volume
+        self.queue = []
+        self.ops = []
+
+    async def set_volume(self, volume):
+        self.volume = volume
+        self.ops.append(("volume", volume))
+
+    async def pause(self, pause=True):
+        self.paused = pause
+        self.ops.append(("pause", pause))
+
+    async def skip(self):
+        # Same as red-lavalink, the next track plays from its start timestamp
+        self.current = self.queue.pop(0)
+        self.ops.append(("play", self.current.track_identifier, self.current.start_timestamp))
+
+@pytest.mark.asyncio
+async def test_interrupt_queues_music_at_its_position():
+    music = make_track("music")
+    player = FakePlayer(music, position=42000, volume=60)
+    playback = GuildPlayback(1)
+
+    await audio_manager.interrupt_music(MagicMock(), playback, player, make_track("tts"), 100)
+
+    # Volume goes before the clip starts, and the music waits behind it at the same position
+    assert player.ops == [("volume", 100), ("play", "tts", 0)]
+    assert player.queue == [music] and player.queue[0] is not music
+    assert player.queue[0].start_timestamp == 42000 and music.start_timestamp == 0
+    assert playback.interruption.state is InterruptState.PLAYING_TTS
+
+@pytest.mark.asyncio
+async def test_interrupt_skips_equal_volume_and_unseekable_position():
+    player = FakePlayer(make_track("stream", seekable=False), position=5000, volume=100)
+    playback = GuildPlayback(1)
+
+    await audio_manager.interrupt_music(MagicMock(), playback, player, make_track("tts"), 100)
+
+    assert player.ops == [("play", "tts", 0)]
+    assert player.queue[0].start_timestamp == 0
+
+@pytest.mark.asyncio
+async def test_resume_restores_volume_without_seeking():
+    player = FakePlayer(make_track("music"), position=42000, volume=60)
+    playback = GuildPlayback(1)
+    await audio_manager.interrupt_music(MagicMock(), playback, player, make_track("tts"), 100)
+    player.ops.clear()
+
+    # The last clip ends, then Lavalink starts the music
+    await audio_manager.begin_resume(playback, player)
+    assert playback.interruption.state is InterruptState.RESUMING
+    await player.skip()
+    interruption = await audio_manager.finish_resume(playback, player)
+
+    assert player.ops == [("volume", 60), ("play", "music", 42000)]
+    assert interruption.updates == 1
+    assert playback.interruption is None
+
+@pytest.mark.asyncio
+async def test_resume_keeps_paused_music_paused():
+    player = FakePlayer(make_track("music"), position=1000, paused=True, volume=100)
+    playback = GuildPlayback(1)
+    await audio_manager.interrupt_music(MagicMock(), playback, player, make_track("tts"), 100)
+    player.ops.clear()
+
+    # Skipped clip, so no TRACK_END began the resume
+    await player.skip()
+    interruption = await audio_manager.finish_resume(playback, player)
+
+    assert player.ops == [("play", "music", 1000), ("pause", True)]
+    assert interruption.updates == 1 and interruption.resume_started is not None
+
+@pytest.mark.asyncio
+async def test_other_tracks_do_not_finish_resume():
+    player = FakePlayer(make_track("music"))
+    playback = GuildPlayback(1)
+    await audio_manager.interrupt_music(MagicMock(), playback, player, make_track("tts"), 50)
+
+    assert await audio_manager.finish_resume(playback, player) is None
+    assert playback.interruption is not None
+
+@pytest.mark.asyncio
+async def test_resume_statistics():
+    cog = MagicMock()
+    player = FakePlayer(make_track("music"), volume=60)
+    playback = GuildPlayback(1)
+    await audio_manager.interrupt_music(cog, playback, player, make_track("tts"), 100)
+    await audio_manager.begin_resume(playback, player)
+    await player.skip()
+
+    interruption = await audio_manager.finish_resume(playback, player)
+    audio_manager.send_resume_statistics(cog, 1, interruption)
+
+    name, tags, data = cog.bot.dispatch.call_args.args[1:]
+    assert name == "tts_resume"
+    assert tags == {"guild_id": 1, "was_paused": False}
+    assert data["updates"] == 1
+    assert 0 <= data["resume_latency"] <= data["interrupted_for"]
@@ -0,0 +1,52 @@
+from unittest.mock import MagicMock
+from ttsengine.core.mention_cache import MentionCache, ROLE
+from ttsengine.core.text_filter import mention_filter
+
+def make_guild() -> MagicMock:
+    guild = MagicMock()
+    guild.id = 1
+    guild.get_member.return_value.nick = None
+    guild.get_member.return_value.display_name = "Mednis"
+    guild.get_role.return_value.name = "Admins"
+    return guild
+
+def test_mention_cached():
+    guild = make_guild()
+    cache = MentionCache()
+
+    assert mention_filter("<@123> <@!123> <@123>", guild, cache) == "to Mednis to Mednis to Mednis"
+    guild.get_member.assert_called_once_with(123)
+    assert cache.hits == 2
+
+def test_mention_unknown_not_cached():
+    guild = make_guild()
+    guild.get_member.return_value = None
+    cache = MentionCache()
+
+    assert mention_filter("<@123> <@123>", guild, cache) == "<@123> <@123>"
+    assert guild.get_member.call_count == 2
+
+def test_mention_invalidate():
+    guild = make_guild()
+    cache = MentionCache()
+    mention_filter("<@123> <@&456>", guild, cache)
+
+    guild.get_member.return_value.display_name = "NotMednis"
+    guild.get_role.return_value.name = "Mods"
+    cache.invalidate(1, ROLE, 456)
+
+    assert mention_filter("<@123> <@&456>", guild, cache) == "to Mednis at Mods"
+
+    cache.invalidate_member(123)
+    assert mention_filter("<@123>", guild, cache) == "to NotMednis"
+
+def test_mention_lru():
+    guild = make_guild()
+    cache = MentionCache(max_entries=2)
+
+    mention_filter("<@1> <@2>", guild, cache)
+    mention_filter("<@1> <@3>", guild, cache)  # 2 is now the least recently used one
+    guild.get_member.reset_mock()
+
+    mention_filter("<@1> <@3> <@2>", guild, cache)
+    guild.get_member.assert_called_once_with(2)
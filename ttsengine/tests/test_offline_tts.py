@@ -0,0 +1,100 @@
+import aiohttp
+import os
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from ttsengine.core import file_manager, offline_tts
+from ttsengine.core.backend_router import BackendRouter
+from ttsengine.core.offline_tts import EspeakEngine, OfflineSynthesiser
+
+# Stands in for espeak-ng, the "audio" is the voice and the text
+FAKE_ESPEAK = """#!/bin/sh
+text=$(cat)
+if [ "$text" = "fail" ]; then echo "boom" >&2; exit 1; fi
+printf '%s:%s' "$2" "$text" > "$4"
+"""
+
+def make_binary(tmp_path) -> str:
+    binary = tmp_path / "espeak-ng"
+    binary.write_text(FAKE_ESPEAK)
+    binary.chmod(0o755)
+    return binary.as_posix()
+
+@pytest.fixture
+def synthesiser(monkeypatch, tmp_path):
+    engine = type("FakeEngine", (EspeakEngine,), {"name": "fake", "binary": make_binary(tmp_path)})
+    monkeypatch.setitem(offline_tts.ENGINES, "fake", engine)
+    return OfflineSynthesiser("fake", workers=1)
+
+def make_cog(synthesiser: OfflineSynthesiser, tmp_path) -> MagicMock:
+    cog = MagicMock()
+    cog.backend_router = BackendRouter()
+    cog.audio_cache.enabled = False
+    cog.audio_store = None
+    cog.audio_processor = None
+    cog.offline_tts = synthesiser
+    cog.audio_file_name = (tmp_path / "audio").as_posix()
+    cog.config.local_api = AsyncMock(return_value=False)
+    cog.config.public_api_url = AsyncMock(return_value="http://public/{voice}?text={text}")
+    cog.config.hedge_requests = AsyncMock(return_value=False)
+    cog.config.offline_voices = AsyncMock(return_value={"brian": "en-gb"})
+    return cog
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        OfflineSynthesiser("nope", workers=1)
+
+@pytest.mark.asyncio
+async def test_offline_synthesis(synthesiser, tmp_path):
+    path = (tmp_path / "audio1.wav").as_posix()
+    await synthesiser.synthesise("en-gb", "hello", path)
+
+    with open(path) as f:
+        assert f.read() == "en-gb:hello"
+
+    # Nothing is left behind when the engine fails
+    with pytest.raises(RuntimeError):
+        await synthesiser.synthesise("en-gb", "fail", (tmp_path / "audio2.wav").as_posix())
+    assert sorted(os.listdir(tmp_path)) == ["audio1.wav", "espeak-ng"]
+
+@pytest.mark.asyncio
+async def test_offline_route_is_last_resort(synthesiser, tmp_path):
+    cog = make_cog(synthesiser, tmp_path)
+
+    routes = await file_manager.resolve_routes(cog, "Brian", "hi")
+    assert [(route.backend, route.url) for route in routes][1] == ("offline", "en-gb")
+
+    # No network at all
+    cog.http_session.get.side_effect = aiohttp.ClientConnectionError()
+
+    file_path = await file_manager.download_audio(cog, "Brian", "hi")
+    with open(file_path) as f:
+        assert f.read() == "en-gb:hi"
+    assert cog.backend_router.get_stats("offline", "Brian").outcomes[-1]
+
+# Red loads the cog without putting its folder on sys.path, synthesis has to work like that
+RED_STYLE_LOAD = """
+import asyncio, importlib.machinery, importlib.util, sys
+spec = importlib.machinery.PathFinder.find_spec("ttsengine", [sys.argv[1]])
+lib = importlib.util.module_from_spec(spec)
+sys.modules["ttsengine"] = lib
+spec.loader.exec_module(lib)
+
+from ttsengine.core import offline_tts
+engine = type("FakeEngine", (offline_tts.EspeakEngine,), {"name": "fake", "binary": sys.argv[2]})
+offline_tts.ENGINES["fake"] = engine
+asyncio.run(offline_tts.OfflineSynthesiser("fake", workers=2).synthesise("en", "hello", sys.argv[3]))
+"""
+
+def test_synthesis_without_cog_on_path(tmp_path):
+    repo_root = Path(__file__).parents[2].as_posix()
+    path = (tmp_path / "audio.wav").as_posix()
+
+    # -I keeps the working directory and PYTHONPATH off sys.path
+    subprocess.run([sys.executable, "-I", "-c", RED_STYLE_LOAD, repo_root, make_binary(tmp_path), path],
+                   cwd=tmp_path, check=True, timeout=60)
+
+    with open(path) as f:
+        assert f.read() == "en:hello"
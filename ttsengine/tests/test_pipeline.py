@@ -0,0 +1,147 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock
+from ttsengine.core.pipeline import TTSJob, TTSPipeline
+
+def make_job(text: str) -> TTSJob:
+    ttsmessage = MagicMock()
+    ttsmessage.text = text
+    return TTSJob(MagicMock(), MagicMock(), ttsmessage, "Brian")
+
+# Synthesis takes longer for earlier messages, so they finish out of order
+def make_pipeline(played: list, released: list, delays: dict, workers=4, has_room=None) -> TTSPipeline:
+    async def synthesise(job):
+        await asyncio.sleep(delays.get(job.ttsmessage.text, 0))
+        return job.ttsmessage.text
+
+    async def play(job, file_path):
+        played.append(file_path)
+
+    async def release(file_path):
+        released.append(file_path)
+
+    return TTSPipeline(synthesise, play, release, workers, has_room)
+
+async def drain(pipeline: TTSPipeline):
+    while pipeline.jobs or (pipeline._runner is not None and not pipeline._runner.done()):
+        await asyncio.sleep(0.01)
+
+@pytest.mark.asyncio
+async def test_pipeline_plays_in_arrival_order():
+    played, released = [], []
+    pipeline = make_pipeline(played, released, {"a": 0.05, "b": 0.02, "c": 0})
+
+    for text in ("a", "b", "c"):
+        pipeline.submit(make_job(text), max_depth=10)
+
+    await drain(pipeline)
+    assert played == ["a", "b", "c"]
+
+@pytest.mark.asyncio
+async def test_pipeline_synthesises_concurrently():
+    running = []
+    peak = []
+
+    async def synthesise(job):
+        running.append(job)
+        peak.append(len(running))
+        await asyncio.sleep(0.02)
+        running.remove(job)
+        return job.ttsmessage.text
+
+    async def play(job, file_path):
+        pass
+
+    async def release(file_path):
+        pass
+
+    pipeline = TTSPipeline(synthesise, play, release, workers=2)
+    for text in ("a", "b", "c", "d"):
+        pipeline.submit(make_job(text), max_depth=10)
+
+    await drain(pipeline)
+    assert max(peak) == 2
+
+@pytest.mark.asyncio
+async def test_pipeline_drops_oldest_when_full():
+    played, released = [], []
+    pipeline = make_pipeline(played, released, {"a": 0.05, "b": 0.05, "c": 0.05})
+
+    for text in ("a", "b", "c"):
+        pipeline.submit(make_job(text), max_depth=2)
+
+    await drain(pipeline)
+    assert played == ["b", "c"]
+    assert pipeline.dropped == 1
+
+@pytest.mark.asyncio
+async def test_pipeline_coalesces_pending_job():
+    played, released = [], []
+    pipeline = make_pipeline(played, released, {})
+
+    job = make_job("testuser says hello")
+    job.message.author.id = 1
+    job.ready_at += 0.05
+    pipeline.submit(job, max_depth=10)
+
+    pending = pipeline.pending_job(1)
+    assert pending is job
+    pipeline.coalesce(pending, "how are you", 0.01)
+
+    assert pipeline.pending_job(2) is None
+
+    await drain(pipeline)
+    assert played == ["testuser says hello. how are you"]
+    assert pipeline.pending_job(1) is None
+
+def make_user_job(text: str, author_id: int) -> TTSJob:
+    job = make_job(text)
+    job.message.author.id = author_id
+    return job
+
+@pytest.mark.asyncio
+async def test_pipeline_users_take_turns():
+    played, released = [], []
+    pipeline = make_pipeline(played, released, {})
+
+    for text, author_id in (("a1", 1), ("a2", 1), ("a3", 1), ("b1", 2), ("c1", 3), ("b2", 2)):
+        pipeline.submit(make_user_job(text, author_id), max_depth=10)
+
+    await drain(pipeline)
+    assert played == ["a1", "b1", "c1", "a2", "b2", "a3"]
+
+@pytest.mark.asyncio
+async def test_pipeline_limits_messages_per_user():
+    played, released = [], []
+    pipeline = make_pipeline(played, released, {"a1": 0.05})
+
+    for text, author_id in (("a1", 1), ("a2", 1), ("a3", 1), ("b1", 2)):
+        pipeline.submit(make_user_job(text, author_id), max_depth=10, max_per_user=2)
+
+    await drain(pipeline)
+    assert played == ["a2", "b1", "a3"]
+    assert pipeline.dropped == 1
+
+@pytest.mark.asyncio
+async def test_pipeline_drops_stale_messages():
+    played, released = [], []
+    room = []
+    pipeline = make_pipeline(played, released, {}, has_room=lambda: bool(room))
+
+    pipeline.submit(make_user_job("old", 1), max_depth=10, max_age=0.02)
+    pipeline.submit(make_user_job("new", 2), max_depth=10, max_age=10)
+
+    # Nothing is handed over until playback has room, by then the first one is too old
+    await asyncio.sleep(0.05)
+    assert played == []
+
+    room.append(True)
+    pipeline.notify()
+    await drain(pipeline)
+
+    assert played == ["new"]
+    assert released == ["old"]
+    assert pipeline.expired == 1
+    assert pipeline.depth_histogram.as_dict()["le_1"] == 1
+    assert pipeline.depth_histogram.as_dict()["le_2"] == 1
+    assert sum(pipeline.wait_histogram.counts) == 1
@@ -0,0 +1,123 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from ttsengine.core.settings_cache import GuildMembershipIndex, GuildSettingsCache
+
+# Dirty mock of the Config guild scope, only what from_config needs
+def make_config(**overrides) -> MagicMock:
+    data = dict(
+        say_name=True,
+        blacklisted_users=[1],
+        whitelisted_channels=[2],
+        max_message_length=400,
+        max_word_length=15,
+        repeated_word_percentage=80,
+        global_tts_volume=100,
+        name_replacements={},
+        word_replacements={},
+        command_prefixes=[],
+        max_queued_messages=10,
+        coalesce_window=0,
+        filter_engine="classic",
+        max_user_messages=3,
+        max_message_age=60
+    )
+    config = MagicMock()
+    config.guild.return_value.all = AsyncMock(return_value={**data, **overrides})
+    return config
+
+def make_guild(guild_id=1234) -> MagicMock:
+    guild = MagicMock()
+    guild.id = guild_id
+    return guild
+
+@pytest.mark.asyncio
+async def test_cache_miss_then_hit():
+    config = make_config()
+    cache = GuildSettingsCache(config)
+    guild = make_guild()
+
+    first = await cache.get(guild)
+    second = await cache.get(guild)
+
+    assert first is second
+    assert cache.misses == 1
+    assert cache.hits == 1
+    config.guild.return_value.all.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_cache_membership_sets():
+    # The membership lists are kept by the index now, loaded from the same guild config as the snapshot
+    config = make_config()
+    config.all_guilds = AsyncMock(return_value={1234: await config.guild.return_value.all()})
+    cache = GuildSettingsCache(config)
+    index = GuildMembershipIndex(config)
+    await index.load()
+    await cache.get(make_guild())
+
+    assert index.is_whitelisted(1234, 2) and not index.is_whitelisted(1234, 1)
+    assert index.is_blacklisted(1234, 1) and not index.is_blacklisted(1234, 2)
+
+    # A settings change invalidates the snapshot, the index is updated with the new list
+    cache.invalidate(1234)
+    index.set_blacklist(1234, [])
+    await cache.get(make_guild())
+    assert not index.is_blacklisted(1234, 1)
+    assert cache.misses == 2
+
+@pytest.mark.asyncio
+async def test_cache_invalidate_reloads():
+    config = make_config()
+    cache = GuildSettingsCache(config)
+    guild = make_guild()
+
+    await cache.get(guild)
+    config.guild.return_value.all.return_value["say_name"] = False
+    cache.invalidate(guild.id)
+
+    settings = await cache.get(guild)
+    assert settings.say_name is False
+    assert cache.misses == 2
+
+@pytest.mark.asyncio
+async def test_cache_invalidate_during_load_is_not_stored():
+    config = make_config()
+    cache = GuildSettingsCache(config)
+    guild = make_guild()
+
+    async def all_and_invalidate():
+        cache.invalidate(guild.id)
+        return make_config().guild.return_value.all.return_value
+
+    config.guild.return_value.all = AsyncMock(side_effect=all_and_invalidate)
+
+    await cache.get(guild)
+    await cache.get(guild)
+    assert cache.misses == 2
+
+# Membership index tests
+
+@pytest.mark.asyncio
+async def test_membership_index_load():
+    config = MagicMock()
+    config.all_guilds = AsyncMock(return_value={
+        1234: {"whitelisted_channels": [2], "blacklisted_users": [1]}
+    })
+    index = GuildMembershipIndex(config)
+    await index.load()
+
+    assert index.is_whitelisted(1234, 2)
+    assert not index.is_whitelisted(1234, 3)
+    assert index.is_blacklisted(1234, 1)
+
+def test_membership_index_unknown_guild():
+    index = GuildMembershipIndex(MagicMock())
+    assert not index.is_whitelisted(1234, 2)
+    assert not index.is_blacklisted(1234, 1)
+
+def test_membership_index_update():
+    index = GuildMembershipIndex(MagicMock())
+    index.set_whitelist(1234, [2])
+    assert index.is_whitelisted(1234, 2)
+
+    index.set_whitelist(1234, [])
+    assert not index.is_whitelisted(1234, 2)
@@ -122,6 +122,30 @@ def test_fixup_text_with_suffix():
     text = "I can't believe it lols."
     assert ttsengine.core.text_filter.fixup_text(text, {"lol": "laugh"}) == "I can't believe it laughs."
 
+def test_fixup_text_longest_match():
+    text = "lol lolz"
+    replacements = {"lol": "laugh", "lolz": "laughs a lot"}
+    assert ttsengine.core.text_filter.fixup_text(text, replacements) == "laugh laughs a lot"
+
+def test_fixup_text_many_replacements():
+    replacements = {f"word{i}": f"replacement{i}" for i in range(1000)}
+    text = "word1 and WORD999's"
+    assert ttsengine.core.text_filter.fixup_text(text, replacements) == "replacement1 and replacement999's"
+
+def test_fixup_text_unusual_case():
+    # ſ matches s case-insensitively, but lower() keeps it as it is
+    assert ttsengine.core.text_filter.fixup_text("ſus thing", {"sus": "suspicious"}) == "suspicious thing"
+    assert ttsengine.core.text_filter.fixup_text("Straße", {"STRAßE": "street"}) == "street"
+
+def test_fixup_text_punctuation_in_pattern():
+    replacements = {"lol": "laugh", "w/e": "whatever", "o.o": "surprised"}
+    text = "LOLs w/e, lol's O.O"
+    assert ttsengine.core.text_filter.fixup_text(text, replacements) == "laughs whatever, laugh's surprised"
+
+def test_fixup_text_only_punctuation_patterns():
+    replacements = {"w/e": "whatever", "o.o": "surprised"}
+    assert ttsengine.core.text_filter.fixup_text("ok w/e man O.O", replacements) == "ok whatever man surprised"
+
 # Test Name Filter
 def test_name_filter_no_filter():
     text = "mednis"
@@ -145,4 +169,20 @@ def test_name_filter_partial_match():
 
 def test_name_filter_multiple_matches():
     text = "Mednis is great. But I am Mednis!"
-    assert ttsengine.core.text_filter.fixup_name(text, {"Mednis":"NotMednis"}) == "NotMednis is great. but i am NotMednis!"
\ No newline at end of file
+    assert ttsengine.core.text_filter.fixup_name(text, {"Mednis":"NotMednis"}) == "NotMednis is great. but i am NotMednis!"
+
+# Emoji Table Tests
+
+def test_demojize_matches_emoji_library():
+    import emoji
+    texts = [
+        "plain ascii :smile:",
+        "Zoë café",
+        "❤️ ❤ 1️⃣ 1⃣ #️⃣ *",
+        "👍🏻👍🏿 🇺🇸🇬🇧 🇺",
+        "🏴󠁧󠁢󠁳󠁣󠁴󠁿 🏴󠁧󠁢",
+        "️ lone variation selectors ︎",
+        "👨‍👩‍👧 family 👨‍ half",
+    ]
+    for text in texts:
+        assert ttsengine.core.text_filter.demojize(text) == emoji.demojize(text, language='en')
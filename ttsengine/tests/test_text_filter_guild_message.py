@@ -90,6 +90,18 @@ async def test_does_not_say_name():
     result = await filter_and_format_message(message, make_settings(say_name=False))
     assert result.text == "hello"
 
+@pytest.mark.asyncio
+async def test_say_name_override_keeps_compiled_replacements():
+    message = make_message(content="hello world", name="testuser")
+    settings = make_settings(say_name=True, word_replacements={"world": "universe"})
+
+    result = await filter_and_format_message(message, settings, say_name=False)
+    replacer = settings.word_replacer
+    await filter_and_format_message(message, settings, say_name=False)
+
+    assert result.text == "hello universe"
+    assert replacer is not None and settings.word_replacer is replacer
+
 @pytest.mark.asyncio
 async def test_uses_nick():
     message = make_message(content="hello", nick="NotMednis", name="Mednis")
@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock
+from ttsengine.core import trace
+from ttsengine.core.playback import GuildPlayback
+from ttsengine.core.trace import TTSTrace, current_trace
+
+@pytest.mark.asyncio
+async def test_laps_add_up_to_total():
+    message_trace = TTSTrace()
+
+    message_trace.lap("config")
+    await asyncio.sleep(0.01)
+    message_trace.lap("synthesis")
+    message_trace.lap("synthesis")
+
+    assert list(message_trace.spans) == ["config", "synthesis"]
+    assert message_trace.spans["synthesis"] >= 0.01
+    assert sum(message_trace.spans.values()) == pytest.approx(message_trace.total)
+
+@pytest.mark.asyncio
+async def test_span_goes_to_current_trace():
+    # Nothing to record into, nothing happens
+    with trace.span("write"):
+        pass
+
+    message_trace = TTSTrace()
+
+    async def download():
+        with trace.span("write"):
+            await asyncio.sleep(0.01)
+
+    async def synthesise():
+        current_trace.set(message_trace)
+        # Tasks started from here, like hedge requests, record into the same trace
+        await asyncio.gather(download(), asyncio.create_task(download()))
+
+    await asyncio.create_task(synthesise())
+
+    assert message_trace.spans["write"] >= 0.02
+    assert current_trace.get() is None
+
+def test_traces_start_in_order():
+    playback = GuildPlayback(1)
+    track = MagicMock(track_identifier="abc")
+    first, second = TTSTrace(), TTSTrace()
+
+    # The same cached clip queued twice
+    playback.add_trace("abc", first)
+    playback.add_trace("abc", second)
+
+    assert playback.pop_trace(track) is first
+    assert playback.pop_trace(track) is second
+    assert playback.pop_trace(track) is None
+    assert playback.pop_trace(None) is None
+    assert playback.traces == {}
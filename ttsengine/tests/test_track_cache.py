@@ -0,0 +1,63 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from ttsengine.core import audio_manager
+from ttsengine.core.track_cache import TrackCache
+
+def make_player(host="localhost") -> MagicMock:
+    player = MagicMock()
+    player.node.host = host
+    player.node.port = 2333
+    player.load_tracks = AsyncMock(return_value=MagicMock(tracks=[MagicMock(title="clip.mp3")]))
+    return player
+
+def make_cog(cached_paths: set) -> MagicMock:
+    cog = MagicMock()
+    cog.track_cache = TrackCache()
+    cog.audio_cache.owns = lambda path: path in cached_paths
+    return cog
+
+@pytest.mark.asyncio
+async def test_cached_clip_skips_load_tracks():
+    cog = make_cog({"cache/abc.mp3"})
+    player = make_player()
+
+    first = await audio_manager.load_track(cog, player, "cache/abc.mp3")
+    first.title = "TTS"
+    second = await audio_manager.load_track(cog, player, "cache/abc.mp3")
+
+    assert player.load_tracks.await_count == 1
+    assert second is not first and second.title == "clip.mp3"
+    assert (cog.track_cache.hits, cog.track_cache.misses) == (1, 1)
+    assert len(cog.track_cache.get_load_stats("localhost:2333").latencies) == 1
+    cog.bot.dispatch.assert_called_with("statistics_event", "tts_track_load",
+                                        {"node": "localhost:2333", "result": "hit"},
+                                        {"latency": None, "p50": pytest.approx(0, abs=1),
+                                         "p95": pytest.approx(0, abs=1), "error_rate": 0.0})
+
+    # Each node loads it for itself
+    other = make_player("lavalink2")
+    await audio_manager.load_track(cog, other, "cache/abc.mp3")
+    assert other.load_tracks.await_count == 1
+
+    # Gone once the audio cache gets rid of the clip
+    cog.track_cache.invalidate("cache/abc.mp3")
+    await audio_manager.load_track(cog, player, "cache/abc.mp3")
+    assert player.load_tracks.await_count == 2
+
+@pytest.mark.asyncio
+async def test_uncached_clip_always_loads():
+    cog = make_cog(set())
+    player = make_player()
+
+    await audio_manager.load_track(cog, player, "audio1.mp3")
+    await audio_manager.load_track(cog, player, "audio1.mp3")
+    assert player.load_tracks.await_count == 2
+
+@pytest.mark.asyncio
+async def test_nothing_loaded():
+    cog = make_cog({"cache/abc.mp3"})
+    player = make_player()
+    player.load_tracks.return_value = MagicMock(tracks=[])
+
+    assert await audio_manager.load_track(cog, player, "cache/abc.mp3") is None
+    assert cog.track_cache.get_load_stats("localhost:2333").error_rate == 1.0
@@ -0,0 +1,107 @@
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+from ttsengine.core.user_cache import TTSUserProfile, UserProfileStore
+
+def make_config() -> MagicMock:
+    config = MagicMock()
+    config.user.return_value.all = AsyncMock(return_value={
+        "last_tts_message_time": "",
+        "tts_enabled": True,
+        "warning_summon": False,
+        "warning_notts": False,
+        "voice": "Brian"
+    })
+    config.user_from_id.return_value.set = AsyncMock()
+    return config
+
+def make_user(user_id=1234) -> MagicMock:
+    user = MagicMock()
+    user.id = user_id
+    return user
+
+def test_profile_round_trip():
+    now = datetime.now(timezone.utc)
+    profile = TTSUserProfile(now, True, False, True, "Amy")
+    assert TTSUserProfile.from_config_data(profile.to_config_data()).last_tts_message_time == now
+
+def test_profile_has_no_dict():
+    profile = TTSUserProfile(None, False, False, False, "Brian")
+    assert not hasattr(profile, "__dict__")
+
+@pytest.mark.asyncio
+async def test_profile_loaded_once():
+    config = make_config()
+    store = UserProfileStore(config)
+    user = make_user()
+
+    assert await store.get(user) is await store.get(user)
+    config.user.return_value.all.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_flush_only_writes_dirty_profiles():
+    config = make_config()
+    store = UserProfileStore(config)
+
+    await store.get(make_user(1))
+    profile = await store.get(make_user(2))
+    profile.warning_notts = True
+    store.mark_dirty(2)
+
+    await store.flush()
+    config.user_from_id.assert_called_once_with(2)
+    assert config.user_from_id.return_value.set.await_args.args[0]["warning_notts"] is True
+
+    # Nothing left to write
+    await store.flush()
+    config.user_from_id.return_value.set.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_clean_profiles_are_evicted():
+    config = make_config()
+    store = UserProfileStore(config, max_profiles=2)
+
+    first = await store.get(make_user(1))
+    store.mark_dirty(1)
+    await store.get(make_user(2))
+    await store.get(make_user(3))
+
+    # 1 is the oldest but hasn't been written yet, so 2 goes
+    assert len(store) == 2
+    assert await store.get(make_user(1)) is first
+    assert config.user.return_value.all.await_count == 3
+
+    # Everything older is waiting to be written, so there is one too many until the flush
+    store.mark_dirty(3)
+    await store.get(make_user(4))
+    assert len(store) == 3
+    await store.flush()
+    assert len(store) == 2
+    await store.get(make_user(3))
+    assert config.user.return_value.all.await_count == 5
+
+@pytest.mark.asyncio
+async def test_failed_writes_stay_dirty():
+    config = make_config()
+    store = UserProfileStore(config, max_profiles=1)
+
+    for user_id in (1, 2, 3):
+        await store.get(make_user(user_id))
+        store.mark_dirty(user_id)
+
+    def user_from_id(user_id):
+        group = MagicMock()
+        group.set = AsyncMock(side_effect=RuntimeError("Config is down") if user_id == 2 else None)
+        return group
+
+    config.user_from_id.side_effect = user_from_id
+
+    # 2 didn't make it, so it is kept for the next flush while the others can go
+    await store.flush()
+    assert len(store) == 1
+    assert await store.get(make_user(2)) is not None
+    assert config.user.return_value.all.await_count == 3
+
+    config.user_from_id.side_effect = None
+    await store.flush()
+    config.user_from_id.assert_called_with(2)
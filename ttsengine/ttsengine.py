@@ -1,15 +1,26 @@
+import asyncio
+import functools
 import logging
 from datetime import datetime, timezone
 from typing import Literal
 
 import discord
 import lavalink
+from discord.ext import tasks
 
 from redbot.core import commands, data_manager
 from redbot.core.bot import Red
 from redbot.core.config import Config
 
-from ttsengine.core import audio_manager, file_manager, tts_generator
+from ttsengine.core import audio_manager, file_manager, http_client, text_filter, tts_generator
+from ttsengine.core import mention_cache, offline_tts
+from ttsengine.core.audio_cache import AudioCache
+from ttsengine.core.audio_processing import AudioProcessor
+from ttsengine.core.backend_router import BackendRouter
+from ttsengine.core.settings_cache import GuildMembershipIndex, GuildSettingsCache
+from ttsengine.core.trace import TTSTrace
+from ttsengine.core.track_cache import TrackCache
+from ttsengine.core.user_cache import UserProfileStore
 
 # Import command classes
 from ttsengine.commands.blacklist import BlacklistCommands
@@ -20,17 +31,15 @@ RequestType = Literal["discord_deleted_user", "owner", "user", "user_strict"]
 
 log = logging.getLogger("red.mednis-cogs.poitranslator.main")
 
-def is_within_time(last_message_time: str, time=5 * 60) -> bool:
+def is_within_time(last_message_time: datetime | None, time=5 * 60) -> bool:
     """
     Check if the users last message was within a specified time.
     """
 
     # If the last message time is not set, return False
-    if last_message_time == "":
+    if last_message_time is None:
         return False
 
-    last_message_time = datetime.fromisoformat(last_message_time)
-
     # Check if the last TTS message was within a specified time.
     if (datetime.now(timezone.utc) - last_message_time).total_seconds() < time:
         return True
@@ -50,22 +59,23 @@ class TTSEngine(TTSCommands, BlacklistCommands, SettingsCommands, commands.Cog):
     def __init__(self, bot: Red) -> None:
         self.bot = bot
 
-        self.tts_queue = []  # List of tts messages to be played.
-
-        self.last_non_tts_track = None  # The last track that was played before TTS was started.
-        self.current_track = None  # The current track that is playing.
+        self.playback = {}  # Per guild TTS playback state, see audio_manager.get_playback.
 
         self.cog_path = data_manager.cog_data_path(self)  # The path to the cog data folder.
         self.audio_file_name = (data_manager.cog_data_path(self) / 'audio').as_posix()  # The path to the audio files.
-        self.llplayer = None  # The lavalink player.
+        self.audio_cache = AudioCache(self.cog_path / "audio_cache")  # Generated clips kept for reuse.
+        self.audio_store = None  # Clips served to Lavalink from memory, when the staging mode is memory.
+        self.audio_processor = None  # Trims and normalises new clips, if post-processing is on.
+        self.track_cache = TrackCache()  # Lavalink tracks of the cached clips, and load_tracks latency per node.
+        self.audio_cache.on_remove = functools.partial(file_manager.forget_clip, self)
+        self.http_session = None  # Shared session for the TTS APIs, opened in cog_load.
+        self.offline_tts = None  # Built-in synthesis for when there is no network, if enabled.
+        self.backend_router = BackendRouter()  # Latency and error stats of the TTS APIs, picks which one to use.
 
         # Register the lavalink event listener.
         lavalink.unregister_event_listener(self.lavalink_events)
         lavalink.register_event_listener(self.lavalink_events)
 
-        # Cleanup any old audio files.
-        file_manager.cleanup_audio(self)
-
         self.config = Config.get_conf(
             self,
             identifier=92651437657460736,
@@ -89,11 +99,33 @@ class TTSEngine(TTSCommands, BlacklistCommands, SettingsCommands, commands.Cog):
             },
 
             # Command prefixes
-            "command_prefixes": []
+            "command_prefixes": [],
+
+            # How many messages can wait to be read out before the oldest get dropped
+            "max_queued_messages": 10,
+
+            # Seconds to wait for more messages from the same user to read out together, 0 disables it
+            "coalesce_window": 0,
+
+            # Which text filter implementation to use, see text_filter.FILTER_ENGINES
+            "filter_engine": "classic",
+
+            # How many of those can be from one user, and how many seconds they can wait before they are dropped
+            "max_user_messages": 3,
+            "max_message_age": 60
         }
 
         self.config.register_guild(**default_guild)
 
+        # In-memory guild settings, invalidated by the settings commands.
+        self.guild_settings_cache = GuildSettingsCache(self.config)
+
+        # Whitelisted channels and blacklisted users, kept up to date by the whitelist/blacklist commands.
+        self.membership_index = GuildMembershipIndex(self.config)
+
+        # What mentions are read out as, kept up to date by the member, role and channel listeners.
+        self.mention_cache = mention_cache.MentionCache()
+
         # Default user configuration
         default_user = {
             "last_tts_message_time": "",
@@ -104,6 +136,9 @@ class TTSEngine(TTSCommands, BlacklistCommands, SettingsCommands, commands.Cog):
         }
         self.config.register_user(**default_user)
 
+        # In-memory user profiles, the message timestamps and warnings get written back by a loop.
+        self.user_profiles = UserProfileStore(self.config)
+
         default_bot = {
             "regular_voices": [
                 {"name": "Brian (🇬🇧)", "value": "Brian"},
@@ -131,7 +166,22 @@ class TTSEngine(TTSCommands, BlacklistCommands, SettingsCommands, commands.Cog):
             "local_api": False,
             "local_voices": {},
             "local_api_url": "",
-            "public_api_url": "https://api.streamelements.com/kappa/v2/speech?voice={voice}&text={text}"
+            "public_api_url": "https://api.streamelements.com/kappa/v2/speech?voice={voice}&text={text}",
+            "audio_cache_size": 64,  # MB of generated clips kept for reuse where clips are staged, 0 disables it
+            "synthesis_workers": 3,  # Concurrent TTS API requests per guild
+            "hedge_requests": False,  # Also ask a second backend when the first one is being slow
+            "hedge_percentile": 95,  # How slow is slow, as a percentile of the backend's recent latency
+            "audio_staging": "disk",  # Where clips wait for Lavalink, see audio_staging.STAGING_MODES
+            "staging_host": "127.0.0.1",  # Address of the audio server for the memory mode, Lavalink has to reach it
+            "staging_port": 0,  # 0 picks any free port
+            "staging_memory_size": 64,  # MB of waiting clips the memory mode holds, the cache gets its own on top
+            "offline_tts": False,  # Synthesise with a local engine when the TTS APIs can't
+            "offline_engine": "espeak-ng",  # See offline_tts.ENGINES
+            "offline_voices": {},  # Our voice (lowercase) -> the engine's voice
+            "offline_workers": 2,  # Messages the offline engine synthesises at once
+            "post_processing": False,  # Trim silence and normalise loudness of new clips with ffmpeg
+            "ffmpeg_path": "ffmpeg",
+            "loudness_target": -16  # LUFS the clips are normalised to
         }
 
         self.config.register_global(**default_bot)
@@ -160,19 +210,104 @@ class TTSEngine(TTSCommands, BlacklistCommands, SettingsCommands, commands.Cog):
         self.blacklist_remove_app.guild_only = True
         self.debug_message_app.guild_only = True
 
-    def cog_load(self):
+    async def cog_load(self):
+        # Load the whitelists before we start listening to messages
+        await self.membership_index.load()
+
+        # Where clips go for Lavalink to play them, the cache lives there too
+        self.audio_cache.max_bytes = await self.config.audio_cache_size() * 1024 * 1024
+        await file_manager.setup_staging(self)
+
+        # Pick up the clips cached by the last run
+        await self.audio_cache.load()
+
+        # One pooled session for all TTS API requests, so we are not doing DNS/TCP/TLS setup per message
+        self.http_session = http_client.create_session()
+
+        # Build the emoji lookup table up front instead of on the first message with an emoji in it
+        await asyncio.to_thread(text_filter.get_emoji_table)
+
         # Load app commands when the cog is loaded
         self.bot.tree.add_command(self.blacklist_add_app)
         self.bot.tree.add_command(self.blacklist_remove_app)
         self.bot.tree.add_command(self.debug_message_app)
 
-    def cog_unload(self):
+        self.flush_user_profiles.start()
+
+        if await self.config.offline_tts():
+            await self.setup_offline_tts()
+
+        if await self.config.post_processing():
+            await self.setup_audio_processor()
+
+        # Nothing is queued yet, so every clip the last run left behind can go, however recent
+        await file_manager.reconcile_audio(self, min_age=0)
+
+        # Then keep an eye out for leaked ones
+        self.reconcile_audio_files.start()
+
+    async def cog_unload(self):
         # Unload app commands when unloading cog
         self.bot.tree.remove_command(self.blacklist_add_app.name, type=self.blacklist_add_app.type)
         self.bot.tree.remove_command(self.blacklist_remove_app.name, type=self.blacklist_remove_app.type)
         self.bot.tree.remove_command(self.debug_message_app.name, type=self.debug_message_app.type)
         lavalink.unregister_event_listener(self.lavalink_events)
-        file_manager.cleanup_audio(self)
+
+        for playback in self.playback.values():
+            if playback.pipeline is not None:
+                playback.pipeline.close()
+
+        # Anything not queued on a player anymore can go
+        self.reconcile_audio_files.cancel()
+        await file_manager.reconcile_audio(self, min_age=0)
+
+        if self.audio_store is not None:
+            await self.audio_store.stop()
+
+        if self.offline_tts is not None:
+            self.offline_tts.shutdown()
+
+        if self.http_session is not None:
+            await self.http_session.close()
+
+        # Write out anything that has not been saved yet
+        self.flush_user_profiles.cancel()
+        await self.user_profiles.flush()
+
+    async def setup_offline_tts(self):
+        try:
+            synthesiser = offline_tts.OfflineSynthesiser(await self.config.offline_engine(),
+                                                         await self.config.offline_workers())
+        except ValueError as err:
+            log.error(err)
+            return
+
+        if not await asyncio.to_thread(synthesiser.available):
+            log.error(f"Offline TTS engine {synthesiser.engine} is not installed, not using it.")
+            return
+
+        self.offline_tts = synthesiser
+
+    async def setup_audio_processor(self):
+        processor = AudioProcessor(await self.config.ffmpeg_path(), await self.config.loudness_target())
+
+        if not await asyncio.to_thread(processor.available):
+            log.error(f"ffmpeg was not found at {processor.binary}, clips will not be post-processed.")
+            return
+
+        self.audio_processor = processor
+
+    @tasks.loop(seconds=30)
+    async def flush_user_profiles(self):
+        await self.user_profiles.flush()
+
+    @tasks.loop(minutes=10)
+    async def reconcile_audio_files(self):
+        # cog_load already did the first pass
+        if self.reconcile_audio_files.current_loop == 0:
+            return
+
+        await file_manager.reconcile_audio(self)
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
@@ -180,31 +315,41 @@ class TTSEngine(TTSCommands, BlacklistCommands, SettingsCommands, commands.Cog):
             return
 
         # If the channel is not whitelisted
-        if message.channel.id not in await self.config.guild(message.guild).whitelisted_channels():
+        if not self.membership_index.is_whitelisted(message.guild.id, message.channel.id):
             return
 
         # If the message author is blacklisted
-        if message.author.id in await self.config.guild(message.guild).blacklisted_users():
+        if self.membership_index.is_blacklisted(message.guild.id, message.author.id):
             return
 
+        # Where the time goes from here until Lavalink starts playing the message
+        trace = TTSTrace()
+
+        tts_guild_settings = await self.guild_settings_cache.get(message.guild)
+
+        profile = await self.user_profiles.get(message.author)
+
         # Store the previous tts mesasge time
-        last_message_time = await self.config.user(message.author).last_tts_message_time()
+        last_message_time = profile.last_tts_message_time
 
         # Update the last TTS message time
-        await self.config.user(message.author).last_tts_message_time.set(datetime.now(timezone.utc).isoformat())
+        profile.last_tts_message_time = datetime.now(timezone.utc)
 
         # If the message author has TTS enabled
-        if await self.config.user(message.author).tts_enabled():
+        if profile.tts_enabled:
+            # Only users with TTS enabled need their timestamp and warnings saved
+            self.user_profiles.mark_dirty(message.author.id)
+
             # If the user is not in a voice channel
             if message.author.voice is None:
 
                 # Check if the user has been warned about not being in a voice channel
-                if not await self.config.user(message.author).warning_notts() or not is_within_time(last_message_time):
+                if not profile.warning_notts or not is_within_time(last_message_time):
 
                     # Warn the user that they are not in a voice channel
                     await message.reply("❌ You are not in a VC, your messages will not be read out until you join."
                                         , delete_after = 10)
-                    await self.config.user(message.author).warning_notts.set(True)
+                    profile.warning_notts = True
 
                 return
 
@@ -214,80 +359,130 @@ class TTSEngine(TTSCommands, BlacklistCommands, SettingsCommands, commands.Cog):
             if voice_clients is None or voice_clients.channel == message.author.voice.channel:
 
                 # Reset the warning flags
-                await self.config.user(message.author).warning_summon.set(False)
-                await self.config.user(message.author).warning_notts.set(False)
+                profile.warning_summon = False
+                profile.warning_notts = False
 
                 # Generate the TTS message and play it
-                await tts_generator.generate_tts(self, message)
+                trace.lap("config")
+                await tts_generator.generate_tts(self, message, tts_guild_settings, trace)
 
             # If the bot is connected to a different voice channel
             elif voice_clients.channel != message.author.voice.channel:
 
-                if not await self.config.user(message.author).warning_summon() or not is_within_time(last_message_time):
+                if not profile.warning_summon or not is_within_time(last_message_time):
 
                     # If the user has not been warned about the bot being in a different voice channel
                     await message.reply(f"❌ **I'm already in {voice_clients.channel.mention}.** \n"
                                         f"Please use the `/summon` command to bring me here.\n"
                                         f"_Also, make sure the people in the other channel are okay with it :D_",
                                         delete_after = 30)
-                    await self.config.user(message.author).warning_summon.set(True)
+                    profile.warning_summon = True
                     return
 
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        self.mention_cache.invalidate(after.guild.id, mention_cache.MEMBER, after.id)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        self.mention_cache.invalidate(member.guild.id, mention_cache.MEMBER, member.id)
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        # A new global name changes the display name in every guild
+        self.mention_cache.invalidate_member(after.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        self.mention_cache.invalidate(after.guild.id, mention_cache.ROLE, after.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        self.mention_cache.invalidate(role.guild.id, mention_cache.ROLE, role.id)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        self.mention_cache.invalidate(after.guild.id, mention_cache.CHANNEL, after.id)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        self.mention_cache.invalidate(channel.guild.id, mention_cache.CHANNEL, channel.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.mention_cache.forget_guild(guild.id)
+
     async def lavalink_events(self, player, event: lavalink.LavalinkEvents, extra):
+        playback = self.playback.get(player.guild.id)
+
+        # TTS was never played in this guild, nothing for us to do.
+        if playback is None:
+            return
+
+        try:
+            await self.handle_lavalink_event(playback, player, event)
+        finally:
+            # A clip might have finished, let the next one through
+            if playback.pipeline is not None:
+                playback.pipeline.notify()
 
+    async def handle_lavalink_event(self, playback, player, event: lavalink.LavalinkEvents):
         # Track end event.
         if event == lavalink.LavalinkEvents.TRACK_END:
 
-            if self.current_track is None:
+            if playback.current_track is None:
                 return
 
-            if self.current_track.track_identifier in self.tts_queue:
+            if playback.is_tts_track(playback.current_track):
                 # The track that just ended was a tts track.
-                self.tts_queue.remove(self.current_track.track_identifier)
-                await file_manager.delete_audio(self.current_track.uri)
+                playback.tts_queue.remove(playback.current_track.track_identifier)
 
-        # Track start event.
-        if event == lavalink.LavalinkEvents.TRACK_START:
-            self.current_track = player.current
+                # That was the last clip, Lavalink is already starting the music again
+                if not playback.tts_queue:
+                    await audio_manager.begin_resume(playback, player)
 
-            if self.last_non_tts_track is not None:
-                if player.current.track_identifier == self.last_non_tts_track.track.track_identifier:
-                    # The track that just started was not a tts track, pause it and seek to where it was before.
-                    await player.pause()
-                    await player.seek(self.last_non_tts_track.position)
+                await file_manager.release_audio(self, playback.current_track.uri)
 
-                    # Set the player volume to the same as we had when playing the previous track
-                    await player.set_volume(self.last_non_tts_track.volume)
+        # Track start event.
+        if event == lavalink.LavalinkEvents.TRACK_START:
+            playback.current_track = player.current
 
-                    # Check if the track was paused before we played TTS
-                    if not self.last_non_tts_track.was_paused:
-                        # Unpause it if needed
-                        await player.pause(False)
+            # The TTS message is finally being read out
+            trace = playback.pop_trace(player.current)
+            if trace is not None:
+                trace.lap("track_start")
+                if await self.config.statistics():
+                    tts_generator.send_trace_statistics(self, player.guild.id, trace)
 
-                    # Clear the non-tts track queue
-                    self.last_non_tts_track = None
+            # The music we interrupted is back, finish putting it the way it was
+            interruption = await audio_manager.finish_resume(playback, player)
+            if interruption is not None and await self.config.statistics():
+                audio_manager.send_resume_statistics(self, player.guild.id, interruption)
 
         if event == lavalink.LavalinkEvents.QUEUE_END:
             # The queue has ended, cleanup the tts queue.
-            self.tts_queue.clear()
-            self.current_track = None
+            playback.tts_queue.clear()
+            playback.traces.clear()
+            playback.interruption = None
+            playback.current_track = None
 
         if event == lavalink.LavalinkEvents.TRACK_STUCK:
             # The track has become stuck, if it is a tts track, remove it from the tts queue and the regular queue,
             # then delete.
-            if self.current_track.track_identifier in self.tts_queue:
-                if self.current_track in player.queue:
-                    await player.queue.remove(self.current_track)
-                await audio_manager.delete_file_and_remove(self, self.current_track)
+            if playback.is_tts_track(playback.current_track):
+                if playback.current_track in player.queue:
+                    player.queue.remove(playback.current_track)
+                await audio_manager.delete_file_and_remove(self, playback, playback.current_track)
 
         if event == lavalink.LavalinkEvents.TRACK_EXCEPTION:
             # The track has thrown an exception, if it is a tts track, remove it from the tts queue, and remove it
             # from the regular queue.
-            if self.current_track.track_identifier in self.tts_queue:
-                if self.current_track in player.queue:
-                    await player.queue.remove(self.current_track)
-                await audio_manager.delete_file_and_remove(self, self.current_track)
+            if playback.is_tts_track(playback.current_track):
+                if playback.current_track in player.queue:
+                    player.queue.remove(playback.current_track)
+                await audio_manager.delete_file_and_remove(self, playback, playback.current_track)
 
     async def red_delete_data_for_user(self, *, requester: RequestType, user_id: int) -> None:
         # TODO: Replace this with the proper end user data removal handling.
+        self.user_profiles.forget(user_id)
         super().red_delete_data_for_user(requester=requester, user_id=user_id)